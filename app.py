@@ -1,14 +1,48 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime
 from pathlib import Path
-from typing import List
-
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from typing import List, Optional, Tuple
+
+import click
+from markupsafe import Markup
+from flask import (
+    Flask,
+    Response,
+    abort,
+    flash,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    send_file,
+    send_from_directory,
+    session,
+    stream_with_context,
+    url_for,
+)
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import column, func, insert, literal_column, select, table, text, tuple_
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import selectinload
 
 # Flask app setup
-app = Flask(__name__, instance_relative_config=True)
+# ESTIMATE_INSTANCE_PATH で instance フォルダ（DB・キャッシュ世代ファイル）を差し替えられる（ベンチマーク用の使い捨てDBなど）
+_instance_override = os.environ.get('ESTIMATE_INSTANCE_PATH')
+app = Flask(
+    __name__,
+    instance_relative_config=True,
+    instance_path=os.path.abspath(_instance_override) if _instance_override else None,
+)
 app.config['SECRET_KEY'] = 'dev-secret-key'  # 開発用
 # 管理モード用の簡易パスワード（必要に応じて環境変数などに移行）
 app.config.setdefault('VIEW_COST_PASSWORD', '393290')
@@ -18,6 +52,30 @@ instance_path = Path(app.instance_path)
 instance_path.mkdir(parents=True, exist_ok=True)
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{instance_path / 'app.db'}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# 見積一覧の1ページあたり件数
+app.config.setdefault('ESTIMATE_LIST_PAGE_SIZE', 50)
+# 全文検索（関連度順）の1ページあたり件数
+app.config.setdefault('ESTIMATE_SEARCH_LIMIT', 100)
+# 一括取り込みで1回の INSERT にまとめる見積数
+app.config.setdefault('ESTIMATE_IMPORT_CHUNK_SIZE', 500)
+# 見積詳細の描画済みHTMLをキャッシュする件数（0 で無効）
+app.config.setdefault('ESTIMATE_DETAIL_CACHE_SIZE', 512)
+# 見積登録の書き込みキュー（有効にすると登録を1本の書き込みスレッドでまとめてコミットする）
+app.config.setdefault('ESTIMATE_WRITE_QUEUE', False)
+app.config.setdefault('ESTIMATE_WRITE_QUEUE_MAX_BATCH', 50)
+app.config.setdefault('ESTIMATE_WRITE_QUEUE_MAX_WAIT_MS', 5.0)
+# 登録画面で ID を待つ秒数。超えた場合は受付番号（ticket）の確認画面へ移る
+app.config.setdefault('ESTIMATE_WRITE_QUEUE_TIMEOUT', 10.0)
+# 受付番号が別のワーカー・再起動前のものでDBにも見つからない場合に「保存中」とみなす秒数
+app.config.setdefault('ESTIMATE_WRITE_TICKET_TTL', 300.0)
+# SQLite の接続ごとの PRAGMA（WAL・ビジータイムアウトなど。services/sqlite_tuning.py の DEFAULT_PRAGMAS）
+app.config.setdefault('SQLITE_PRAGMAS', None)
+# リクエストごとの計測（ルート別の応答時間・SQL・テンプレート描画・マスタ読み込み。/admin/metrics）
+app.config.setdefault('REQUEST_METRICS', True)
+# この時間（ミリ秒）を超えたリクエストを内訳付きでログに出す（None で無効）
+app.config.setdefault('SLOW_REQUEST_MS', None)
+# 原価マスタの索引付きDB（python -m services.xlsx_to_json --sheet 製品マスタ --sqlite で作成）
+app.config.setdefault('COST_MASTER_DB', None)
 
 db = SQLAlchemy(app)
 
@@ -45,8 +103,28 @@ class Estimate(db.Model):
     # 営業利益＝粗利 − 販管費（販管費＝小計×0.2）
     operating_profit = db.Column(db.Float, default=0.0, nullable=False)
 
+    # 材料費とその内訳（作成時に計算して保存。NULL は未計算の旧データ → backfill-material-cost で埋める）
+    material_cost = db.Column(db.Float, nullable=True)
+    material_solar = db.Column(db.Float, nullable=True)
+    material_battery = db.Column(db.Float, nullable=True)
+    material_v2h_single = db.Column(db.Float, nullable=True)
+    material_v2h_hybrid = db.Column(db.Float, nullable=True)
+    material_powercon_exchange = db.Column(db.Float, nullable=True)
+
+    # 登録の重複防止キー（入力画面ごとに発行。オフラインで溜めた登録の再送でも同じ見積を2件作らない）
+    idempotency_key = db.Column(db.String(64), nullable=True)
+
     items = db.relationship('EstimateItem', backref='estimate', cascade='all, delete-orphan')
 
+    __table_args__ = (
+        # 一覧のキーセットページング（created_at DESC, id DESC）用
+        db.Index('ix_estimates_created_at_id', 'created_at', 'id'),
+        # 顧客ごとの見積の絞り込み・集計用
+        db.Index('ix_estimates_customer_id_created_at', 'customer_id', 'created_at'),
+        # 重複防止キーの検索と一意性（NULL は複数可）
+        db.Index('ux_estimates_idempotency_key', 'idempotency_key', unique=True),
+    )
+
 
 class EstimateItem(db.Model):
     __tablename__ = 'estimate_items'
@@ -66,12 +144,22 @@ class EstimateItem(db.Model):
     line_total_price = db.Column(db.Float, default=0.0, nullable=False)
     line_total_cost = db.Column(db.Float, default=0.0, nullable=False)
 
+    __table_args__ = (
+        # 詳細・エクスポートでの明細の取得用
+        db.Index('ix_estimate_items_estimate_id', 'estimate_id'),
+    )
+
+
+from services import assets, request_metrics, sqlite_tuning
 
 # 初回起動時にテーブル作成
 with app.app_context():
+    # 最初の接続より前に、接続ごとの PRAGMA（WAL 等）を設定する
+    sqlite_tuning.install(db.engine, app.config['SQLITE_PRAGMAS'])
+    if app.config['REQUEST_METRICS']:
+        request_metrics.install(app, db.engine)
     db.create_all()
     # 既存DBに列が無い場合は追加（SQLite）
-    from sqlalchemy import text
     try:
         rows = db.session.execute(text("PRAGMA table_info(estimate_items)")).fetchall()
         existing_cols = {r[1] for r in rows}  # 1番目が列名
@@ -103,49 +191,420 @@ with app.app_context():
             db.session.execute(
                 text("ALTER TABLE estimates ADD COLUMN operating_profit FLOAT NOT NULL DEFAULT 0.0")
             )
+        # 材料費の保存列（既存データは NULL のまま。backfill-material-cost で計算する）
+        for col in (
+            'material_cost',
+            'material_solar',
+            'material_battery',
+            'material_v2h_single',
+            'material_v2h_hybrid',
+            'material_powercon_exchange',
+        ):
+            if col not in existing_cols:
+                db.session.execute(text(f"ALTER TABLE estimates ADD COLUMN {col} FLOAT"))
+        if 'idempotency_key' not in existing_cols:
+            db.session.execute(text("ALTER TABLE estimates ADD COLUMN idempotency_key VARCHAR(64)"))
+        db.session.execute(
+            text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ux_estimates_idempotency_key "
+                "ON estimates (idempotency_key)"
+            )
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+
+    # 既存DBにインデックスが無い場合は追加
+    try:
+        for statement in sqlite_tuning.index_statements():
+            db.session.execute(text(statement))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+
+    # 月次の売上・利益集計表。新しく作った場合は既存の見積から集計する
+    from services.rollups import ensure_rollup_tables, rebuild_rollups
+    try:
+        if ensure_rollup_tables(db.session):
+            rebuild_rollups(db.session)
         db.session.commit()
     except Exception:
         db.session.rollback()
 
+    # 全文検索（FTS5 trigram）の索引と同期トリガ。未対応の SQLite では LIKE 検索のまま
+    from services.estimate_search import ensure_search_index
+    app.config['ESTIMATE_FTS_ENABLED'] = ensure_search_index(db.session)
+
 
 # サービス層
 from services.masters import (
-    get_customers,
-    get_products,
-    get_models,
     find_product_by_code,
     find_customer_by_id,
+    get_master_payload,
+    get_master_version,
+    MASTER_FILES,
+    add_load_listener as add_master_load_listener,
+    get_cache_stats as get_master_cache_stats,
+    preload as preload_masters,
+)
+from services.calculator import calculate_line_totals
+from services.pricing_rules import get_pricing_rules, price_estimate
+from services.material_cost import (
+    MATERIAL_CATEGORIES,
+    MATERIAL_PRODUCT_CODES,
+    calculate_material_breakdown,
+)
+from services.estimate_import import (
+    ImportValidationError,
+    detect_format,
+    parse_csv_estimates,
+    parse_json_estimates,
+    prepare_estimates,
+)
+from services import fragment_cache
+from services.write_queue import WriteQueue
+from services.rollups import (
+    PRODUCT_TYPES,
+    add_to_rollups,
+    facts_from_estimate,
+    facts_from_values,
+    load_dashboard,
+    rebuild_rollups,
+)
+from services.estimate_export import EXPORT_FIELDS, iter_csv, write_xlsx
+from services.estimate_preview import get_line_cache_stats, preview_estimate
+from services.recost import recost_estimates, write_report_csv
+from services.master_store import DEFAULT_STORE_PATH, MasterStore
+from services.estimate_search import (
+    FTS_TABLE,
+    MARK_OPEN,
+    MARK_CLOSE,
+    build_match_query,
+    has_highlight,
+    index_estimate_items,
+    render_highlight,
 )
-from services.calculator import (
-    calculate_line_totals,
-    calculate_estimate_totals,
+
+if app.config['REQUEST_METRICS']:
+    add_master_load_listener(request_metrics.record_master_load)
+# マスタは import 時に読み込んでおく（gunicorn --preload 時は fork 前に1回だけ）
+preload_masters()
+fragment_cache.configure(
+    maxsize=app.config['ESTIMATE_DETAIL_CACHE_SIZE'],
+    generation_path=instance_path / 'estimate_cache.generation',
 )
 
 
-# 太陽光用：モジュール型式ごとの容量(kW)
-MODULE_CAPACITY_MAP = {
-    # 例：JKM450N-54HL4R-V は 0.45kW/枚
-    'JKM450N-54HL4R-V': 0.45,
-}
+def _apply_material_breakdown(est: Estimate, items) -> None:
+    """材料費の内訳を計算して見積の material_* 列に設定する"""
+    breakdown = calculate_material_breakdown(items)
+    est.material_cost = breakdown['total']
+    for key in MATERIAL_CATEGORIES:
+        setattr(est, f'material_{key}', breakdown[key])
+
+
+def _material_breakdown_of(est: Estimate) -> dict:
+    """保存済みの材料費内訳を返す。未計算の旧データのみその場で計算する"""
+    if est.material_cost is None:
+        return calculate_material_breakdown(est.items)
+    breakdown = {key: float(getattr(est, f'material_{key}') or 0.0) for key in MATERIAL_CATEGORIES}
+    breakdown['total'] = float(est.material_cost)
+    return breakdown
+
+
+# 一覧に表示する列のみを取得する（明細や原価列は読み込まない）
+ESTIMATE_LIST_COLUMNS = (
+    Estimate.id,
+    Estimate.created_at,
+    Estimate.title,
+    Estimate.customer_name,
+    Estimate.subtotal_price,
+    Estimate.total_price,
+)
+
+
+def _encode_cursor(created_at: datetime, estimate_id: int) -> str:
+    return f"{created_at.isoformat()}_{estimate_id}"
+
+
+def _decode_cursor(value: str) -> Optional[Tuple[datetime, int]]:
+    """'作成日時_ID' 形式のカーソルを復元する。不正な値は None"""
+    try:
+        created_at, estimate_id = value.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(estimate_id)
+    except (ValueError, AttributeError):
+        return None
+
+
+def _encode_rank_cursor(rank: float, estimate_id: int) -> str:
+    return f"{rank!r}_{estimate_id}"
+
+
+def _decode_rank_cursor(value: str) -> Optional[Tuple[float, int]]:
+    """'関連度_ID' 形式のカーソル（全文検索のページング）を復元する。不正な値は None"""
+    try:
+        rank, estimate_id = value.rsplit('_', 1)
+        return float(rank), int(estimate_id)
+    except (ValueError, AttributeError):
+        return None
+
+
+@app.template_global()
+def asset_url(name: str) -> str:
+    """static/ のファイルのURL。flask build-assets 済みなら内容ハッシュ付きの配信URL、未ビルドなら元ファイル"""
+    hashed = assets.hashed_file(name)
+    if hashed is None:
+        return url_for('static', filename=name)
+    return url_for('asset', filename=hashed)
+
+
+@app.get('/assets/<path:filename>')
+def asset(filename: str):
+    """ビルド済みの静的ファイル。URL に内容のハッシュを含むため1年・immutable でキャッシュさせる"""
+    served, encoding = assets.choose_encoding(filename, request.headers.get('Accept-Encoding', ''))
+    resp = send_from_directory(
+        assets.DIST_DIR,
+        served,
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        max_age=31536000,
+    )
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    resp.headers['Vary'] = 'Accept-Encoding'
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
+
+
+@app.template_filter('search_highlight')
+def search_highlight_filter(value):
+    return render_highlight(value)
+
+
+@app.template_test('highlighted')
+def highlighted_test(value):
+    return has_highlight(value)
+
+
+def _estimate_filter(q: str):
+    """
+    一覧・エクスポート共通の検索条件。全文検索が使える検索語は FTS（件名・顧客・明細）、
+    使えない場合（短い語・FTS5 非対応）は件名・顧客の部分一致。検索語が無ければ None。
+    """
+    if not q:
+        return None
+    match = build_match_query(q) if app.config.get('ESTIMATE_FTS_ENABLED') else None
+    if match:
+        fts_rowids = (
+            select(literal_column('rowid'))
+            .select_from(table(FTS_TABLE))
+            .where(text(f'{FTS_TABLE} MATCH :match').bindparams(match=match))
+        )
+        return Estimate.id.in_(fts_rowids)
+    like = f"%{q}%"
+    return Estimate.title.ilike(like) | Estimate.customer_name.ilike(like)
+
+
+def _search_estimates(match: str, after=None, before=None, limit: int = 100):
+    """
+    FTS5 で検索し、関連度順に一覧列＋強調表示用の列を返す。
+    (関連度, ID) のキーセットでページングする（after=次ページ、before=前ページ。前ページは逆順で返る）。
+    """
+    fts = table(FTS_TABLE, column('rowid'))
+    fts_ref = literal_column(FTS_TABLE)
+    rank = literal_column(f'{FTS_TABLE}.rank')
+    key = tuple_(rank, Estimate.id)
+    query = (
+        db.session.query(
+            *ESTIMATE_LIST_COLUMNS,
+            rank.label('rank'),
+            func.highlight(fts_ref, 0, MARK_OPEN, MARK_CLOSE).label('title_hl'),
+            func.highlight(fts_ref, 1, MARK_OPEN, MARK_CLOSE).label('customer_name_hl'),
+            func.snippet(fts_ref, 2, MARK_OPEN, MARK_CLOSE, '…', 12).label('items_hl'),
+        )
+        .join(fts, fts.c.rowid == Estimate.id)
+        .filter(text(f'{FTS_TABLE} MATCH :match').bindparams(match=match))
+    )
+    if before:
+        query = query.filter(key < before).order_by(rank.desc(), Estimate.id.desc())
+    else:
+        if after:
+            query = query.filter(key > after)
+        query = query.order_by(rank.asc(), Estimate.id.asc())
+    return query.limit(limit).all()
+
+
+@app.errorhandler(OperationalError)
+def sqlite_operational_error(error: OperationalError):
+    """
+    SQLite のロック待ちの打ち切り（database is locked）は 503 で返し、X-Error ヘッダで区別できるようにする
+    （負荷試験 benchmarks/load.py が数える）。それ以外の OperationalError は通常の 500 にする。
+    """
+    if 'locked' not in str(error.orig):
+        raise error
+    db.session.rollback()
+    route = request.url_rule.rule if request.url_rule is not None else request_metrics.UNMATCHED_ROUTE
+    request_metrics.metrics.observe_lock_error(route)
+    app.logger.warning('SQLite のロック待ちがタイムアウトしました: %s %s', request.method, request.path)
+    message = 'データベースが混み合っています。しばらくしてから再度お試しください。'
+    if request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json':
+        resp = jsonify({'status': 'error', 'error': message})
+    else:
+        resp = Response(message, mimetype='text/plain')
+    resp.status_code = 503
+    resp.headers['X-Error'] = 'sqlite-locked'
+    resp.headers['Retry-After'] = '1'
+    return resp
 
 
 # --- Routes ---
 @app.get('/')
 def estimate_list():
     q = request.args.get('q', '').strip()
-    query = Estimate.query.order_by(Estimate.created_at.desc())
+    # 全文検索：件名・顧客・明細（商品/型式）を関連度順に表示する
+    match = build_match_query(q) if q and app.config.get('ESTIMATE_FTS_ENABLED') else None
+    if match:
+        page_size = int(app.config.get('ESTIMATE_SEARCH_LIMIT', 100))
+        after = _decode_rank_cursor(request.args.get('after', ''))
+        before = None if after else _decode_rank_cursor(request.args.get('before', ''))
+        # 1件多く取得して次のページの有無を判定する
+        rows = _search_estimates(match, after=after, before=before, limit=page_size + 1)
+        has_more = len(rows) > page_size
+        estimates = rows[:page_size]
+        if before:
+            estimates.reverse()
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = after is not None, has_more
+        return render_template(
+            'estimate_list.html',
+            estimates=estimates,
+            q=q,
+            is_ranked_search=True,
+            prev_cursor=_encode_rank_cursor(estimates[0].rank, estimates[0].id) if estimates and has_prev else None,
+            next_cursor=_encode_rank_cursor(estimates[-1].rank, estimates[-1].id) if estimates and has_next else None,
+        )
+
+    page_size = int(app.config.get('ESTIMATE_LIST_PAGE_SIZE', 50))
+    # キーセットページング：after=次ページ（古い方）、before=前ページ（新しい方）
+    after = _decode_cursor(request.args.get('after', ''))
+    before = None if after else _decode_cursor(request.args.get('before', ''))
+
+    key = tuple_(Estimate.created_at, Estimate.id)
+    query = db.session.query(*ESTIMATE_LIST_COLUMNS)
     if q:
-        like = f"%{q}%"
-        query = query.filter((Estimate.title.ilike(like)) | (Estimate.customer_name.ilike(like)))
-    estimates = query.all()
-    return render_template('estimate_list.html', estimates=estimates, q=q)
+        query = query.filter(_estimate_filter(q))
+    if before:
+        query = query.filter(key > before).order_by(Estimate.created_at.asc(), Estimate.id.asc())
+    else:
+        if after:
+            query = query.filter(key < after)
+        query = query.order_by(Estimate.created_at.desc(), Estimate.id.desc())
+
+    # 1件多く取得して次のページの有無を判定する
+    rows = query.limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    estimates = rows[:page_size]
+    if before:
+        estimates.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
+
+    prev_cursor = _encode_cursor(estimates[0].created_at, estimates[0].id) if estimates and has_prev else None
+    next_cursor = _encode_cursor(estimates[-1].created_at, estimates[-1].id) if estimates and has_next else None
+    return render_template(
+        'estimate_list.html',
+        estimates=estimates,
+        q=q,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor,
+    )
+
+
+# エクスポートの列（services.estimate_export.EXPORT_FIELDS の順）
+EXPORT_COLUMNS = [
+    Estimate.id if name == 'estimate_id' else getattr(Estimate, name, None) or getattr(EstimateItem, name)
+    for name in EXPORT_FIELDS
+]
+
+
+def _export_rows(q: str = ''):
+    """検索条件に合う見積と明細を1行ずつ返す（新しい見積順）。結果はまとめて読み込まずに順次取得する"""
+    query = (
+        select(*EXPORT_COLUMNS)
+        .outerjoin(EstimateItem, EstimateItem.estimate_id == Estimate.id)
+        .order_by(Estimate.created_at.desc(), Estimate.id.desc(), EstimateItem.id.asc())
+        .execution_options(yield_per=1000)
+    )
+    criterion = _estimate_filter(q)
+    if criterion is not None:
+        query = query.where(criterion)
+    yield from db.session.execute(query)
+
+
+def _export_filename(ext: str) -> str:
+    return f"estimates_{datetime.now().strftime('%Y%m%d_%H%M')}.{ext}"
+
+
+@app.get('/estimates/export.csv')
+def estimate_export_csv():
+    """見積と明細を CSV で出力する（原価の列は管理モードのみ）"""
+    q = request.args.get('q', '').strip()
+    include_costs = bool(session.get('is_admin_mode', False))
+    body = stream_with_context(iter_csv(_export_rows(q), include_costs=include_costs))
+    resp = Response(body, mimetype='text/csv')
+    resp.headers['Content-Disposition'] = f'attachment; filename="{_export_filename("csv")}"'
+    return resp
+
+
+@app.get('/estimates/export.xlsx')
+def estimate_export_xlsx():
+    """見積と明細を XLSX で出力する（一時ファイルに書き出してから送信）"""
+    q = request.args.get('q', '').strip()
+    include_costs = bool(session.get('is_admin_mode', False))
+    fp = tempfile.TemporaryFile()
+    write_xlsx(_export_rows(q), fp, include_costs=include_costs)
+    fp.seek(0)
+    return send_file(
+        fp,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=_export_filename('xlsx'),
+    )
+
+
+@app.get('/api/masters/<name>')
+def api_master(name: str):
+    """
+    マスタJSONを返す。ETag はマスタの版（sha256）。
+    ?v=<版> 付きのURLは内容が変わらないため長期キャッシュさせ、
+    版なし・古い版のURLは毎回 If-None-Match で再検証させる。
+    """
+    try:
+        version, body = get_master_payload(name)
+    except KeyError:
+        abort(404)
+    resp = Response(body, mimetype='application/json')
+    resp.set_etag(version)
+    if request.args.get('v') == version:
+        resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        resp.headers['Cache-Control'] = 'no-cache'
+    return resp.make_conditional(request)
+
+
+def _master_urls() -> dict:
+    """マスタの版付きURL（内容が変われば URL が変わる）"""
+    return {
+        name: url_for('api_master', name=name, v=get_master_version(name))
+        for name in MASTER_FILES
+    }
 
 
 @app.get('/estimates/new')
 def estimate_new():
-    customers = get_customers()
-    products = get_products()
-    models = get_models()
+    # マスタはテンプレートに埋め込まず、版付きURLからブラウザに取得・キャッシュさせる
+    master_urls = _master_urls()
     # 複数選択（type=... を複数指定）に対応。単一指定の後方互換も維持
     selected_types = [t.strip() for t in request.args.getlist('type') if t.strip()]
     if not selected_types:
@@ -153,29 +612,37 @@ def estimate_new():
         selected_types = [single] if single else []
     return render_template(
         'estimate_form.html',
-        customers=customers,
-        products=products,
-        models=models,
+        master_urls=master_urls,
         selected_types=selected_types,
         selected_type=(selected_types[0] if selected_types else ''),
         is_admin_mode=session.get('is_admin_mode', False),
+        # 二重送信・オフライン登録の再送で見積が重複しないよう、入力画面ごとに付けるキー
+        # （サービスワーカーのキャッシュから表示した場合は画面側で作り直す）
+        idempotency_key=uuid.uuid4().hex,
     )
 
 
 @app.post('/estimates')
 def estimate_create():
     form = request.form
+    # オフラインで溜めた登録の再送（Accept: application/json）には JSON で結果を返す
+    wants_json = request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+    # 同じ入力画面からの再送（二重送信・オフライン登録の再送）は、登録済みの見積を返す
+    idempotency_key = form.get('idempotency_key', '').strip()[:64] or None
+    if idempotency_key:
+        existing_id = _estimate_id_for_key(idempotency_key)
+        if existing_id is not None:
+            return _estimate_created(existing_id, wants_json, duplicate=True)
 
     title = form.get('title', '').strip()
     customer_id = form.get('customer_id', '').strip()
     if not title or not customer_id:
-        flash('件名と顧客は必須です。', 'error')
-        return redirect(url_for('estimate_new'))
+        return _estimate_rejected('件名と顧客は必須です。', wants_json)
 
     customer = find_customer_by_id(customer_id)
     if not customer:
-        flash('選択した顧客が見つかりません。', 'error')
-        return redirect(url_for('estimate_new'))
+        return _estimate_rejected('選択した顧客が見つかりません。', wants_json)
 
     # アイテム行の復元
     codes: List[str] = form.getlist('item_product_code')
@@ -221,74 +688,8 @@ def estimate_create():
         )
         )
 
-    # ---- 太陽光 電気工事費（SOL-009）の原価を「電材費」「電気工事費」に分けてバックエンドで計算 ----
-    # システム容量(kW)は太陽電池モジュール（SOL-001）の枚数と型式から算出
-    system_capacity_kw = 0.0
-    for it in items:
-        if it.product_code == 'SOL-001':
-            per_kw = MODULE_CAPACITY_MAP.get(it.model_code or '', 0.0)
-            system_capacity_kw += per_kw * float(it.quantity or 0)
-
-    # パワコン台数はパワーコンディショナ（SOL-002）の数量合計
-    powercon_count = 0
-    for it in items:
-        if it.product_code == 'SOL-002':
-            powercon_count += int(it.quantity or 0)
-
-    # 電気工事費 原価（単価）：システム容量(kW)×6,857 + 20,000
-    if system_capacity_kw > 0:
-        total_electric_cost_unit = float(system_capacity_kw) * 6857.0 + 20000.0
-
-        for it in items:
-            if it.product_code == 'SOL-009':
-                it.unit_cost = total_electric_cost_unit
-                # 数量は通常 1 だが、念のため数量を掛けて行原価を再計算
-                it.line_total_cost = float(it.quantity or 0) * total_electric_cost_unit
-
-    # ---- 蓄電池：その他部材（BAT-006）の原価を蓄電池ユニット型式からバックエンドで計算 ----
-    battery_unit_model_code = None
-    for it in items:
-        if it.product_code == 'BAT-004':
-            battery_unit_model_code = (it.model_code or '').strip()
-            if battery_unit_model_code:
-                break
-
-    if battery_unit_model_code:
-        other_material_cost = 0.0
-        installation_cost = 0.0
-        if battery_unit_model_code == 'ES-T3M1':
-            other_material_cost = 152787.0
-            installation_cost = 125000.0
-        elif battery_unit_model_code in ('ESS-U4M1', 'ESS-U4X1'):
-            other_material_cost = 189700.0
-            if battery_unit_model_code == 'ESS-U4M1':
-                installation_cost = 190885.0
-            elif battery_unit_model_code == 'ESS-U4X1':
-                installation_cost = 220082.0
-
-        if other_material_cost > 0:
-            for it in items:
-                if it.product_code == 'BAT-006':
-                    it.unit_cost = other_material_cost
-                    # 数量は通常 1 だが、念のため数量を掛けて行原価を再計算
-                    it.line_total_cost = float(it.quantity or 0) * other_material_cost
-
-        if installation_cost > 0:
-            for it in items:
-                if it.product_code == 'BAT-007':
-                    it.unit_cost = installation_cost
-                    # 数量は通常 1 だが、念のため数量を掛けて行原価を再計算
-                    it.line_total_cost = float(it.quantity or 0) * installation_cost
-
     if not items:
-        flash('1件以上の商品を追加してください。', 'error')
-        return redirect(url_for('estimate_new'))
-
-    # アイテムから小計・原価小計を集計
-    subtotal_price, subtotal_cost, _, _ = calculate_estimate_totals(items)
-    # 「その他」原価（全見積タイプ共通）：① 小計(税抜) × 0.07 を原価に加算
-    other_cost = subtotal_price * 0.07
-    subtotal_cost = subtotal_cost + other_cost
+        return _estimate_rejected('1件以上の商品を追加してください。', wants_json)
 
     # フォームの値引額（税抜）
     discount_str = form.get('discount_amount', '0').strip()
@@ -296,187 +697,491 @@ def estimate_create():
         discount = float(discount_str)
     except Exception:
         discount = 0.0
-    if discount < 0:
-        discount = 0.0
 
-    # 一般モードの場合、値引額の上限は小計の5%
+    # 特殊原価ルール（SOL-009・BAT-006/007 等、data/pricing_rules.json）を適用し、
+    # 「その他」原価・値引上限・粗利・営業利益を計算
     is_admin_mode = session.get('is_admin_mode', False)
-    if not is_admin_mode:
-        max_discount = int(subtotal_price * 0.05)
-        if discount > max_discount:
-            discount = float(max_discount)
-            flash(f'一般モードでの値引上限（5%: ¥{max_discount:,}）を超えたため、上限値に補正しました。', 'warning')
-
-    # 合計＝小計 − 値引（マイナスにはしない）
-    total_price = max(0.0, subtotal_price - discount)
-
-    # 粗利・粗利率・営業利益を計算
-    # 粗利  = 合計税抜（total_price） − 原価（subtotal_cost）
-    gross_profit = total_price - subtotal_cost
-    gross_margin_rate = gross_profit / total_price if total_price > 0 else 0.0
-    # 販管費 = 小計（subtotal_price）× 0.2
-    selling_expense = subtotal_price * 0.2
-    # 営業利益 = 粗利 − 販管費
-    operating_profit = gross_profit - selling_expense
+    pricing = price_estimate(items, discount=discount, is_admin_mode=is_admin_mode)
+    # 補正の通知（画面からの送信はフラッシュ、JSON の再送は応答の warnings で返す）
+    warnings: List[str] = []
+    if pricing.discount_capped:
+        cap_rate = get_pricing_rules().general_discount_cap_rate
+        warnings.append(
+            f'一般モードでの値引上限（{cap_rate:.0%}: ¥{pricing.max_discount:,}）を超えたため、上限値に補正しました。'
+        )
+    if not wants_json:
+        for message in warnings:
+            flash(message, 'warning')
 
     est = Estimate(
         title=title,
         customer_id=customer['id'],
         customer_name=customer['name'],
-        subtotal_price=subtotal_price,
-        subtotal_cost=subtotal_cost,
-        discount=discount,
-        total_price=total_price,
-        gross_profit=gross_profit,
-        gross_margin_rate=gross_margin_rate,
-        operating_profit=operating_profit,
+        # 月次集計の月を登録時点で確定させるため、既定値に任せず設定する
+        created_at=datetime.utcnow(),
+        subtotal_price=pricing.subtotal_price,
+        subtotal_cost=pricing.subtotal_cost,
+        discount=pricing.discount,
+        total_price=pricing.total_price,
+        gross_profit=pricing.gross_profit,
+        gross_margin_rate=pricing.gross_margin_rate,
+        operating_profit=pricing.operating_profit,
+        idempotency_key=idempotency_key,
     )
     for it in items:
         est.items.append(it)
+    # 材料費（内訳）は作成時に1回だけ計算して保存する
+    _apply_material_breakdown(est, items)
+
+    if app.config.get('ESTIMATE_WRITE_QUEUE'):
+        # 受付番号から重複防止キーで登録済みの見積を引けるよう、キーの無い送信にも付ける
+        est.idempotency_key = est.idempotency_key or uuid.uuid4().hex
+        future = _get_write_queue().submit(est, ticket=_write_ticket(est.idempotency_key))
+        try:
+            estimate_id = future.result(timeout=float(app.config.get('ESTIMATE_WRITE_QUEUE_TIMEOUT', 10.0)))
+        except FutureTimeoutError:
+            # 書き込み待ちが長い場合は受付番号の確認画面で完了を待つ
+            if wants_json:
+                return jsonify({
+                    'status': 'pending',
+                    'ticket': future.ticket,
+                    'status_url': url_for('api_estimate_ticket', ticket=future.ticket),
+                    'warnings': warnings,
+                }), 202
+            return redirect(url_for('estimate_pending', ticket=future.ticket))
+        except Exception:
+            # 同じキーの登録が先に書き込まれていた場合（一意制約違反）はそちらを返す
+            existing_id = _estimate_id_for_key(idempotency_key) if idempotency_key else None
+            if existing_id is not None:
+                return _estimate_created(existing_id, wants_json, duplicate=True)
+            app.logger.exception('見積の登録に失敗しました')
+            return _estimate_rejected('見積の保存に失敗しました。もう一度お試しください。', wants_json, status=500)
+        return _estimate_created(estimate_id, wants_json, warnings=warnings)
 
     db.session.add(est)
-    db.session.commit()
+    add_to_rollups(db.session, [facts_from_estimate(est, items)])
+    try:
+        db.session.flush()
+        _index_estimate_items([est.id])
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        existing_id = _estimate_id_for_key(idempotency_key) if idempotency_key else None
+        if existing_id is None:
+            raise
+        return _estimate_created(existing_id, wants_json, duplicate=True)
+    return _estimate_created(est.id, wants_json, warnings=warnings)
+
+
+def _index_estimate_items(estimate_ids: List[int]) -> None:
+    """登録した見積の明細を全文検索の索引に書き込む（同じトランザクション内で呼ぶ）"""
+    if app.config.get('ESTIMATE_FTS_ENABLED'):
+        index_estimate_items(db.session, estimate_ids)
+
+
+def _estimate_id_for_key(idempotency_key: str) -> Optional[int]:
+    return db.session.execute(
+        select(Estimate.id).where(Estimate.idempotency_key == idempotency_key)
+    ).scalar()
+
+
+def _estimate_created(estimate_id: int, wants_json: bool, duplicate: bool = False, warnings: Optional[List[str]] = None):
+    """登録完了の応答。duplicate は同じ重複防止キーで登録済みだった場合（warnings は JSON の応答にだけ含める）"""
+    url = url_for('estimate_detail', estimate_id=estimate_id)
+    if wants_json:
+        body = {
+            'status': 'done',
+            'estimate_id': estimate_id,
+            'url': url,
+            'duplicate': duplicate,
+            'warnings': warnings or [],
+        }
+        return jsonify(body), (200 if duplicate else 201)
+    flash('この見積は保存済みです。' if duplicate else '見積を保存しました。', 'success')
+    return redirect(url)
+
+
+def _estimate_rejected(message: str, wants_json: bool, status: int = 422):
+    """登録できなかった場合の応答（画面からの送信は入力画面へ戻す）"""
+    if wants_json:
+        return jsonify({'status': 'error', 'error': message}), status
+    flash(message, 'error')
+    return redirect(url_for('estimate_new'))
+
+
+# --- オフライン（iPad のホーム画面アプリ） ---
+# サービスワーカー（/sw.js）が入力画面・静的ファイル・版付きマスタをキャッシュし、
+# 通信できないときの登録は端末の IndexedDB に溜めて、通信が戻ったら重複防止キー付きで再送する
+# （static/js/outbox.js）。キャッシュする入力画面は未ログイン（管理モードでない）状態のもの。
+
+@app.get('/estimates/offline')
+def estimate_outbox():
+    """端末に溜まった未送信の見積（一覧は画面側で IndexedDB から表示する）"""
+    return render_template('estimate_outbox.html')
+
+
+def _offline_precache_urls() -> List[str]:
+    urls = [
+        url_for('estimate_new'),
+        url_for('estimate_outbox'),
+        url_for('web_manifest'),
+        url_for('static', filename='icons/icon.svg'),
+    ]
+    urls += [asset_url(name) for name in assets.ASSETS]
+    urls += list(_master_urls().values())
+    return urls
+
+
+@app.get('/sw.js')
+def service_worker():
+    """
+    サービスワーカー。キャッシュ名はキャッシュするURLの一覧から作るため、
+    静的ファイルのビルドやマスタの更新で内容が変わり、ブラウザが新しい版に入れ替える。
+    """
+    precache = _offline_precache_urls()
+    version = hashlib.sha256('\n'.join(precache).encode('utf-8')).hexdigest()[:12]
+    body = render_template(
+        'sw.js',
+        cache_name=f'estimate-offline-{version}',
+        precache=precache,
+        shell_url=url_for('estimate_new'),
+        outbox_url=url_for('estimate_outbox'),
+        create_url=url_for('estimate_create'),
+        outbox_script=asset_url('js/outbox.js'),
+    )
+    resp = Response(body, mimetype='text/javascript')
+    # 更新をすぐ反映させるため、ブラウザの HTTP キャッシュには残さない
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+
+@app.get('/manifest.webmanifest')
+def web_manifest():
+    """ホーム画面に追加したときのアプリ情報"""
+    resp = jsonify({
+        'name': '見積アプリ',
+        'short_name': '見積',
+        'start_url': url_for('estimate_list'),
+        'scope': '/',
+        'display': 'standalone',
+        'background_color': '#ffffff',
+        'theme_color': '#0f172a',
+        'icons': [{
+            'src': url_for('static', filename='icons/icon.svg'),
+            'sizes': 'any',
+            'type': 'image/svg+xml',
+        }],
+    })
+    resp.mimetype = 'application/manifest+json'
+    return resp
+
+
+# --- 書き込みキュー ---
+_write_queue: Optional[WriteQueue] = None
+_write_queue_lock = threading.Lock()
+
+
+def _write_estimates_batch(estimates: List[Estimate]) -> List[int]:
+    """書き込みスレッドから呼ばれる。まとめて1トランザクションで登録し、登録順の ID を返す"""
+    with app.app_context():
+        try:
+            db.session.add_all(estimates)
+            add_to_rollups(db.session, [facts_from_estimate(est) for est in estimates])
+            db.session.flush()
+            _index_estimate_items([est.id for est in estimates])
+            db.session.commit()
+            return [est.id for est in estimates]
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+
+def _get_write_queue() -> WriteQueue:
+    """書き込みキュー（最初の登録時に書き込みスレッドを起動する）"""
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteQueue(
+                _write_estimates_batch,
+                max_batch=int(app.config.get('ESTIMATE_WRITE_QUEUE_MAX_BATCH', 50)),
+                max_wait_ms=float(app.config.get('ESTIMATE_WRITE_QUEUE_MAX_WAIT_MS', 5.0)),
+                name='estimate-writer',
+            )
+        return _write_queue
+
+
+def _write_ticket(idempotency_key: str) -> str:
+    """受付番号（'<重複防止キー>.<受付時刻(UNIX秒)>'）。どのワーカーでもDBから状態を答えられる"""
+    return f'{idempotency_key}.{int(time.time())}'
+
+
+def _write_ticket_status(ticket: str) -> dict:
+    """
+    受付番号の状態。受け付けたワーカーならキューの状態を、そうでなければ重複防止キーで
+    登録済みの見積を探す。見つからなければ、受付から ESTIMATE_WRITE_TICKET_TTL 秒までは
+    保存中（別のワーカーが書き込み中）、それを過ぎたら失敗とみなす。
+    """
+    idempotency_key, _, accepted_at = ticket.rpartition('.')
+    if not idempotency_key or not accepted_at.isdigit():
+        abort(404)
+    status = _write_queue.status(ticket) if _write_queue else None
+    if status is not None:
+        return status
+    estimate_id = _estimate_id_for_key(idempotency_key)
+    if estimate_id is not None:
+        return {'status': 'done', 'result': estimate_id}
+    if time.time() - int(accepted_at) < float(app.config['ESTIMATE_WRITE_TICKET_TTL']):
+        return {'status': 'pending'}
+    return {'status': 'error', 'error': '見積が保存されていません。'}
+
+
+@app.get('/estimates/pending/<ticket>')
+def estimate_pending(ticket: str):
+    """書き込みキューに入った見積の登録完了を待つ画面（完了したら詳細へ移る）"""
+    status = _write_ticket_status(ticket)
+    if status['status'] == 'done':
+        flash('見積を保存しました。', 'success')
+        return redirect(url_for('estimate_detail', estimate_id=status['result']))
+    if status['status'] == 'error':
+        flash('見積の保存に失敗しました。もう一度お試しください。', 'error')
+        return redirect(url_for('estimate_new'))
+    return render_template('estimate_pending.html', ticket=ticket)
 
-    flash('見積を保存しました。', 'success')
-    return redirect(url_for('estimate_detail', estimate_id=est.id))
 
+@app.get('/api/estimates/tickets/<ticket>')
+def api_estimate_ticket(ticket: str):
+    """受付番号の状態：{"status": "pending"|"done"|"error", "estimate_id"}"""
+    status = _write_ticket_status(ticket)
+    body = {'status': status['status']}
+    if status['status'] == 'done':
+        body['estimate_id'] = status['result']
+        body['url'] = url_for('estimate_detail', estimate_id=status['result'])
+    return jsonify(body)
 
-@app.get('/estimates/<int:estimate_id>')
-def estimate_detail(estimate_id: int):
-    est = Estimate.query.get_or_404(estimate_id)
-
-    # --- 材料費（太陽光）の算出 ---
-    # 対象：太陽電池モジュール、パワーコンディショナ、カラーモニター、漏電遮断器、
-    #       配線用遮断器、接続ユニット、取付架台、電材費
-    material_cost = 0.0
-    # 太陽光の部材品目（取付架台は SOL-007 / SOL-007R の両方を対象とする）
-    MATERIAL_PRODUCT_CODES = {
-        'SOL-001',  # 太陽電池モジュール
-        'SOL-002',  # パワーコンディショナ
-        'SOL-003',  # カラーモニター
-        'SOL-004',  # 漏電遮断器
-        'SOL-005',  # 配線用遮断器
-        'SOL-006',  # 接続ユニット
-        'SOL-007',  # 取付架台
-        'SOL-007R',  # 取付架台（陸屋根）
-    }
 
-    # 上記の部材行の原価（行合計）を集計
-    for it in est.items:
-        if it.product_code in MATERIAL_PRODUCT_CODES:
-            material_cost += float(it.line_total_cost or 0.0)
-
-    # 電材費（電気工事費 SOL-009 のうち、電材部分）を追加
-    has_solar_electric = any(it.product_code == 'SOL-009' for it in est.items)
-    if has_solar_electric:
-        system_capacity_kw = 0.0
-        powercon_count = 0
-        electric_line_qty = 0
-        for it in est.items:
-            if it.product_code == 'SOL-001':
-                per_kw = MODULE_CAPACITY_MAP.get(it.model_code or '', 0.0)
-                system_capacity_kw += per_kw * float(it.quantity or 0)
-            elif it.product_code == 'SOL-002':
-                powercon_count += int(it.quantity or 0)
-            elif it.product_code == 'SOL-009':
-                electric_line_qty += int(it.quantity or 0)
-
-        if electric_line_qty > 0 and (system_capacity_kw > 0 or powercon_count > 0):
-            # 電材費：システム容量(kW)×6857 + 20000（見積単位）
-            electric_material_cost_unit = float(system_capacity_kw) * 6857.0 + 20000.0
-            # 行数（数量）を掛けて全体の電材費を算出
-            material_cost += electric_material_cost_unit * float(electric_line_qty)
-
-    # --- 材料費（蓄電池）の算出 ---
-    # 対象：パワーコンディショナ、漏電遮断器、配線用遮断器、蓄電池ユニット、
-    #       自動切替開閉器、その他部材
-    BATTERY_MATERIAL_PRODUCT_CODES = {
-        'BAT-001',  # パワーコンディショナ
-        'BAT-002',  # 漏電遮断器
-        'BAT-003',  # 配線用遮断器
-        'BAT-004',  # 蓄電池ユニット
-        'BAT-005',  # 自動切替開閉器
-        'BAT-006',  # その他部材
-    }
-    for it in est.items:
-        if it.product_code in BATTERY_MATERIAL_PRODUCT_CODES:
-            material_cost += float(it.line_total_cost or 0.0)
-
-    # --- 材料費（単機能V2H）の算出 ---
-    # 対象：本体搬入費、電気工事労務費、取付工事費、現場雑費、現場管理費 以外
-    #       （= V2H本体、設置部材セット、施工ケーブルセット、その他部材費、
-    #          リモコンセット、ケーブルカバー、AC_CTケーブルセット、CTセンサ）
-    V2H_SINGLE_MATERIAL_PRODUCT_CODES = {
-        'V2H-001',  # V2H本体
-        'V2H-002',  # 設置部材セット
-        'V2H-003',  # 施工ケーブルセット
-        'V2H-005',  # その他部材費
-        'V2H-010',  # リモコンセット
-        'V2H-011',  # ケーブルカバー
-        'V2H-012',  # AC_CTケーブルセット
-        'V2H-013',  # CTセンサ（内径θ24）
-    }
-    for it in est.items:
-        if it.product_code in V2H_SINGLE_MATERIAL_PRODUCT_CODES:
-            material_cost += float(it.line_total_cost or 0.0)
-
-    # --- 材料費（トライブリッドV2H）の算出 ---
-    # 対象：V2H本体、V2H通信ケーブル、その他部材、V2Hポッド用ポール
-    V2H_HYBRID_MATERIAL_PRODUCT_CODES = {
-        'TVH-001',  # V2H本体
-        'TVH-002',  # V2H通信ケーブル
-        'TVH-004',  # その他部材
-        'TVH-007',  # V2Hポッド用ポール
+@app.get('/api/write-queue/metrics')
+def api_write_queue_metrics():
+    """書き込みキューの状態（キューの長さ・コミット時間など。管理モードのみ）"""
+    if not session.get('is_admin_mode'):
+        abort(403)
+    if not app.config.get('ESTIMATE_WRITE_QUEUE') or _write_queue is None:
+        return jsonify({'enabled': bool(app.config.get('ESTIMATE_WRITE_QUEUE')), 'started': False})
+    return jsonify({'enabled': True, 'started': True, **_write_queue.metrics()})
+
+
+_cost_master: Optional[MasterStore] = None
+_cost_master_mtime: Optional[float] = None
+_cost_master_lock = threading.Lock()
+
+
+def _get_cost_master() -> Optional[MasterStore]:
+    """原価マスタDBを開く（未作成なら None）。DBが作り直されていれば開き直す"""
+    global _cost_master, _cost_master_mtime
+    path = Path(app.config.get('COST_MASTER_DB') or DEFAULT_STORE_PATH)
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    with _cost_master_lock:
+        if _cost_master is None or _cost_master.path != path or _cost_master_mtime != mtime:
+            if _cost_master is not None:
+                _cost_master.close()
+            _cost_master = MasterStore(path)
+            _cost_master_mtime = mtime
+        return _cost_master
+
+
+@app.get('/api/cost-master')
+def api_cost_master():
+    """原価マスタの検索（?code=商品ＣＤ の完全一致、または ?q=商品名の部分一致。管理モードのみ）"""
+    if not session.get('is_admin_mode'):
+        abort(403)
+    store = _get_cost_master()
+    if store is None:
+        return jsonify({'error': '原価マスタのDBがありません。xlsx_to_json.py --sqlite で作成してください。'}), 404
+    code = (request.args.get('code') or '').strip()
+    q = (request.args.get('q') or '').strip()
+    if code:
+        row = store.find_by_code(code)
+        rows = [row] if row else []
+    elif q:
+        limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+        rows = store.search_name(q, limit=limit)
+    else:
+        return jsonify({'error': 'code または q を指定してください。'}), 400
+    return jsonify({
+        'items': [
+            {'code': r.code, 'name': r.name, 'moving_avg_cost': r.moving_avg_cost, 'sheet': r.sheet}
+            for r in rows
+        ],
+    })
+
+
+@app.post('/api/estimates/preview')
+def api_estimate_preview():
+    """入力中の明細から合計・利益・材料費を計算して返す（保存はしない。原価・利益を含むため管理モードのみ）"""
+    if not session.get('is_admin_mode'):
+        abort(403)
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('items'), list):
+        return jsonify({'error': '{"items": [...], "discount": 0} 形式の JSON を送信してください。'}), 400
+    result = preview_estimate(
+        payload['items'],
+        discount=payload.get('discount', 0.0),
+        is_admin_mode=True,
+    )
+    return jsonify(result)
+
+
+def _import_estimates(raws, strict: bool = False, dry_run: bool = False, chunk_size: Optional[int] = None) -> dict:
+    """
+    取り込み対象を検証・計算し、見積と明細をまとめて INSERT する（全件で1トランザクション）。
+    strict=True の場合は1件でもエラーがあれば何も登録しない。dry_run=True は検証のみ。
+    """
+    chunk_size = chunk_size or int(app.config.get('ESTIMATE_IMPORT_CHUNK_SIZE', 500))
+    started = time.perf_counter()
+    prepared, errors = prepare_estimates(raws)
+    imported_ids: List[int] = []
+    item_count = 0
+    if prepared and not dry_run and not (strict and errors):
+        try:
+            for start in range(0, len(prepared), chunk_size):
+                chunk = prepared[start:start + chunk_size]
+                ids = db.session.execute(
+                    insert(Estimate).returning(Estimate.id, sort_by_parameter_order=True),
+                    [p.values for p in chunk],
+                ).scalars().all()
+                item_rows = [
+                    dict(row, estimate_id=estimate_id)
+                    for p, estimate_id in zip(chunk, ids)
+                    for row in p.items
+                ]
+                db.session.execute(insert(EstimateItem), item_rows)
+                _index_estimate_items(ids)
+                imported_ids.extend(ids)
+                item_count += len(item_rows)
+            add_to_rollups(db.session, (facts_from_values(p.values, p.items) for p in prepared))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    elapsed = time.perf_counter() - started
+    return {
+        'received': len(raws),
+        'valid': len(prepared),
+        'imported': len(imported_ids),
+        'imported_items': item_count,
+        'estimate_ids': imported_ids,
+        'errors': errors,
+        'dry_run': dry_run,
+        'elapsed_sec': round(elapsed, 3),
+        'estimates_per_sec': round(len(imported_ids) / elapsed, 1) if elapsed > 0 else None,
     }
-    for it in est.items:
-        if it.product_code in V2H_HYBRID_MATERIAL_PRODUCT_CODES:
-            material_cost += float(it.line_total_cost or 0.0)
-
-    # --- 材料費（パワコン交換）の算出 ---
-    # 対象：パワーコンディショナ、設置工事費の材料部分、電気工事費（材料費込）の材料部分
-    # パワコン台数を集計
-    powercon_exchange_count = 0
-    for it in est.items:
-        if it.product_code == 'PWR-001':
-            powercon_exchange_count += int(it.quantity or 0)
-
-    # パワーコンディショナ（PWR-001）の原価を材料費に追加
-    for it in est.items:
-        if it.product_code == 'PWR-001':
-            material_cost += float(it.line_total_cost or 0.0)
-
-    # 設置工事費（PWR-003）の材料部分：パワコン1台につき10600円
-    if powercon_exchange_count > 0:
-        installation_material_cost = powercon_exchange_count * 10600.0
-        material_cost += installation_material_cost
-
-    # 電気工事費（材料費込）（PWR-004）の材料部分：パワコン1台につき5000円
-    if powercon_exchange_count > 0:
-        electric_material_cost = powercon_exchange_count * 5000.0
-        material_cost += electric_material_cost
-
-    # 材料費対象の商品コードセットをテンプレートに渡す
-    material_product_codes = (
-        MATERIAL_PRODUCT_CODES
-        | BATTERY_MATERIAL_PRODUCT_CODES
-        | V2H_SINGLE_MATERIAL_PRODUCT_CODES
-        | V2H_HYBRID_MATERIAL_PRODUCT_CODES
+
+
+@app.post('/api/estimates/import')
+def api_estimates_import():
+    """
+    見積の一括取り込み（管理モードのみ）。JSON / CSV を本文またはファイル（file）で受け取る。
+    ?strict=1 でエラーが1件でもあれば全件取り消し、?dry_run=1 で検証のみ。
+    """
+    if not session.get('is_admin_mode'):
+        abort(403)
+    upload = request.files.get('file')
+    if upload:
+        fmt = detect_format(upload.filename, upload.mimetype)
+        body = upload.read().decode('utf-8-sig')
+    else:
+        fmt = detect_format(None, request.mimetype)
+        body = request.get_data(as_text=True)
+    try:
+        raws = parse_csv_estimates(body) if fmt == 'csv' else parse_json_estimates(json.loads(body))
+    except (ImportValidationError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    report = _import_estimates(
+        raws,
+        strict=request.args.get('strict') == '1',
+        dry_run=request.args.get('dry_run') == '1',
     )
-    # SOL-009（電気工事費）は電材費部分が材料費に含まれるため、材料費対象として扱う
-    material_product_codes.add('SOL-009')
-    # PWR-001（パワーコンディショナ）は材料費に含まれるため、材料費対象として扱う
-    material_product_codes.add('PWR-001')
+    return jsonify(report)
 
-    # 管理モード（セッション）フラグ
-    is_admin_mode = session.get('is_admin_mode', False)
 
-    return render_template(
-        'estimate_detail.html',
+DETAIL_BODY_TEMPLATE = '_estimate_detail_body.html'
+
+
+def _template_version(name: str) -> Tuple[int, int]:
+    """テンプレートファイルの (mtime_ns, サイズ)。テンプレートを変更するとキャッシュが切り替わる"""
+    st = (Path(app.root_path) / app.template_folder / name).stat()
+    return st.st_mtime_ns, st.st_size
+
+
+def _render_estimate_detail_body(estimate_id: int, is_admin_mode: bool) -> str:
+    key = (estimate_id, is_admin_mode, _template_version(DETAIL_BODY_TEMPLATE), fragment_cache.current_generation())
+    html = fragment_cache.get(key)
+    if html is not None:
+        return html
+
+    # 明細は同じ往復でまとめて読み込む（描画中の遅延読み込みをしない）
+    est = db.session.get(Estimate, estimate_id, options=[selectinload(Estimate.items)])
+    if est is None:
+        abort(404)
+    # 材料費は作成時に保存した値を使う（太陽光・蓄電池・V2H・パワコン交換の内訳）
+    material_breakdown = _material_breakdown_of(est)
+    html = render_template(
+        DETAIL_BODY_TEMPLATE,
         estimate=est,
-        material_cost=material_cost,
-        material_product_codes=material_product_codes,
+        material_cost=material_breakdown['total'],
+        material_breakdown=material_breakdown,
+        material_categories=MATERIAL_CATEGORIES,
+        material_product_codes=MATERIAL_PRODUCT_CODES,
         is_admin_mode=is_admin_mode,
     )
+    fragment_cache.put(key, html)
+    return html
+
+
+@app.get('/estimates/<int:estimate_id>')
+def estimate_detail(estimate_id: int):
+    # 管理モード（セッション）フラグ
+    is_admin_mode = bool(session.get('is_admin_mode', False))
+    # 本文は見積ごとにキャッシュする（見積は保存後に変更されないため）
+    body = _render_estimate_detail_body(estimate_id, is_admin_mode)
+    return render_template('estimate_detail.html', body=Markup(body))
+
+
+@app.get('/admin/dashboard')
+def admin_dashboard():
+    """月次の売上・粗利・営業利益（顧客別・商品種別）。集計表だけを読む（管理モードのみ）"""
+    if not session.get('is_admin_mode'):
+        return redirect(url_for('admin_mode_login', next=request.full_path))
+    months = min(max(request.args.get('months', 12, type=int), 1), 60)
+    return render_template(
+        'admin_dashboard.html',
+        dashboard=load_dashboard(db.session, months=months),
+        product_types=PRODUCT_TYPES,
+        months=months,
+    )
+
+
+@app.get('/admin/metrics')
+def admin_metrics():
+    """計測値（Prometheus のテキスト形式。管理モードのみ）"""
+    if not session.get('is_admin_mode'):
+        abort(403)
+    extra = (
+        request_metrics.format_gauges('estimate_master_cache', 'Master JSON cache', get_master_cache_stats())
+        + request_metrics.format_gauges('estimate_detail_cache', 'Rendered estimate detail cache', fragment_cache.get_stats())
+        + request_metrics.format_gauges('estimate_preview_line_cache', 'Preview line cache', get_line_cache_stats())
+    )
+    if _write_queue is not None:
+        extra += request_metrics.format_gauges('estimate_write_queue', 'Estimate write queue', _write_queue.metrics())
+    return Response(
+        request_metrics.metrics.render(extra),
+        mimetype='text/plain',
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8', 'Cache-Control': 'no-store'},
+    )
 
 
 @app.route('/admin_mode_login', methods=['GET', 'POST'])
@@ -505,5 +1210,134 @@ def admin_mode_logout():
     return redirect(next_url)
 
 
+@app.cli.command('backfill-material-cost')
+@click.option('--batch-size', default=500, show_default=True, help='1回のコミットで処理する見積数')
+def backfill_material_cost(batch_size: int):
+    """材料費が未保存（NULL）の見積について、材料費と内訳を計算して保存する"""
+    total = 0
+    while True:
+        batch = (
+            Estimate.query.options(selectinload(Estimate.items))
+            .filter(Estimate.material_cost.is_(None))
+            .order_by(Estimate.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for est in batch:
+            _apply_material_breakdown(est, est.items)
+        db.session.commit()
+        total += len(batch)
+        click.echo(f'{total} 件処理しました')
+    if total:
+        fragment_cache.bump_generation()
+    click.echo(f'材料費の保存が完了しました（{total} 件）。')
+
+
+@app.cli.command('import-estimates')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option('--strict', is_flag=True, help='エラーが1件でもあれば何も登録しない')
+@click.option('--dry-run', is_flag=True, help='検証と計算のみ行い、登録しない')
+@click.option('--chunk-size', type=int, default=None, help='1回の INSERT にまとめる見積数')
+def import_estimates_command(path: Path, strict: bool, dry_run: bool, chunk_size: Optional[int]):
+    """JSON / CSV（拡張子で判定）から見積を一括登録する"""
+    body = path.read_text(encoding='utf-8-sig')
+    try:
+        if detect_format(path.name, None) == 'csv':
+            raws = parse_csv_estimates(body)
+        else:
+            raws = parse_json_estimates(json.loads(body))
+    except (ImportValidationError, ValueError) as e:
+        raise click.ClickException(str(e))
+    report = _import_estimates(raws, strict=strict, dry_run=dry_run, chunk_size=chunk_size)
+    for err in report['errors']:
+        click.echo(f"- 行{err['row']}（{err['key']}）: {err['error']}", err=True)
+    click.echo(
+        f"受付 {report['received']} 件 / 有効 {report['valid']} 件 / 登録 {report['imported']} 件"
+        f"（明細 {report['imported_items']} 行）/ エラー {len(report['errors'])} 件"
+    )
+    click.echo(f"所要時間 {report['elapsed_sec']} 秒（{report['estimates_per_sec'] or 0} 件/秒）")
+
+
+@app.cli.command('recost-estimates')
+@click.option('--apply', 'apply_changes', is_flag=True, help='再計算結果を保存する（指定しない場合は差分の確認のみ）')
+@click.option('--report', 'report_path', type=click.Path(dir_okay=False, path_type=Path), default=None, help='見積ごとの差分を書き出す CSV')
+@click.option('--batch-size', default=2000, show_default=True, help='1回に読み込む見積数')
+def recost_estimates_command(apply_changes: bool, report_path: Optional[Path], batch_size: int):
+    """型式マスタの原価更新を保存済みの見積に反映する（原価小計・粗利・営業利益・材料費）"""
+    report = recost_estimates(db.session, apply=apply_changes, batch_size=batch_size)
+    if report.applied and report.estimates_changed:
+        # 粗利・営業利益が変わるため月次集計を作り直し、起動中のアプリの見積詳細キャッシュを無効にする
+        rebuild_rollups(db.session)
+        db.session.commit()
+        fragment_cache.bump_generation()
+    for diff in report.diffs[:20]:
+        click.echo(
+            f"- #{diff.estimate_id} {diff.title}: 原価 {diff.old_subtotal_cost:,.0f} → {diff.new_subtotal_cost:,.0f}"
+            f" / 粗利率 {diff.old_gross_margin_rate:.1%} → {diff.new_gross_margin_rate:.1%}"
+        )
+    if len(report.diffs) > 20:
+        click.echo(f'  ほか {len(report.diffs) - 20} 件')
+    if report_path:
+        with report_path.open('w', encoding='utf-8-sig', newline='') as fp:
+            write_report_csv(report, fp)
+        click.echo(f'差分を {report_path} に書き出しました。')
+    click.echo(
+        f"見積 {report.estimates_scanned} 件（明細 {report.items_scanned} 行）を確認 / "
+        f"変更 {report.estimates_changed} 件（明細 {report.items_changed} 行）/ 原価増減 {report.total_cost_delta:,.0f} 円"
+    )
+    status = '保存しました' if report.applied else '確認のみ（保存するには --apply）'
+    click.echo(f'{status}。所要時間 {report.elapsed_sec:.2f} 秒')
+
+
+@app.cli.command('export-estimates')
+@click.argument('output', type=click.Path(dir_okay=False, path_type=Path))
+@click.option('--q', default='', help='一覧画面と同じ検索語で絞り込む')
+@click.option('--no-costs', is_flag=True, help='原価・粗利などの列を出力しない')
+def export_estimates_command(output: Path, q: str, no_costs: bool):
+    """見積と明細を CSV / XLSX（拡張子で判定）に出力する"""
+    count = 0
+
+    def rows():
+        nonlocal count
+        for row in _export_rows(q.strip()):
+            count += 1
+            yield row
+
+    with output.open('wb') as fp:
+        if output.suffix.lower() == '.xlsx':
+            write_xlsx(rows(), fp, include_costs=not no_costs)
+        else:
+            for chunk in iter_csv(rows(), include_costs=not no_costs):
+                fp.write(chunk)
+    click.echo(f'{count} 行を {output} に出力しました。')
+
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """月次集計表（顧客別・商品種別）を全見積から作り直す"""
+    started = time.perf_counter()
+    try:
+        total = rebuild_rollups(db.session)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    click.echo(f'{total} 件の見積から月次集計を作り直しました（{time.perf_counter() - started:.2f} 秒）。')
+
+
+@app.cli.command('build-assets')
+@click.option('--prune', is_flag=True, help='今回のビルドに含まれないファイルを static/dist/ から削除する')
+def build_assets_command(prune: bool):
+    """CSS・JS を内容ハッシュ付きのファイル名と圧縮版（gzip・brotli）で static/dist/ に書き出す"""
+    manifest = assets.build_assets(prune=prune)
+    for name, entry in manifest.items():
+        encodings = '・'.join(entry['encodings']) or '圧縮なし'
+        click.echo(f"{name} → dist/{entry['file']}（{entry['size']:,} バイト、{encodings}）")
+    if assets.brotli is None:
+        click.echo('brotli が無いため .br は作成していません（pip install brotli）。')
+
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
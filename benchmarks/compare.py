@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+# --- ベンチマーク結果の比較 ---
+# python -m benchmarks.run の結果JSONを2つ比べ、指標（既定 p50）が閾値を超えて遅くなったパスを
+# 回帰として表示する。回帰があれば終了コード 1（デプロイ前のチェックに使う）。
+#
+#   python -m benchmarks.compare benchmarks/results/base.json benchmarks/results/new.json --threshold 0.2
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "mean_ms")
+
+
+def _load(path: Path) -> Dict[str, Any]:
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare_results(
+    base: Dict[str, Any], new: Dict[str, Any], metric: str = "p50_ms", threshold: float = 0.2, min_ms: float = 0.5
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    パスごとの比較行と、回帰したパス名の一覧を返す。
+    min_ms 未満の差は計測のぶれとして回帰に数えない。
+    """
+    rows: List[Dict[str, Any]] = []
+    regressions: List[str] = []
+    base_results = base.get("results", {})
+    new_results = new.get("results", {})
+    for name in list(base_results) + [n for n in new_results if n not in base_results]:
+        before = base_results.get(name, {}).get(metric)
+        after = new_results.get(name, {}).get(metric)
+        change = None
+        if before and after is not None:
+            change = (after - before) / before
+        regressed = (
+            change is not None and change > threshold and (after - before) >= min_ms
+        ) or bool(new_results.get(name, {}).get("errors"))
+        if regressed:
+            regressions.append(name)
+        rows.append({"name": name, "before": before, "after": after, "change": change, "regressed": regressed})
+    return rows, regressions
+
+
+def _params_differ(base: Dict[str, Any], new: Dict[str, Any]) -> bool:
+    return base.get("meta", {}).get("params") != new.get("meta", {}).get("params")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="ベンチマーク結果JSONを比較し、遅くなったパスを表示します。")
+    parser.add_argument("base", type=Path, help="基準の結果JSON（例: デプロイ中のコミット）")
+    parser.add_argument("new", type=Path, help="比較する結果JSON")
+    parser.add_argument("--metric", choices=METRICS, default="p50_ms", help="比較する指標（既定: p50_ms）")
+    parser.add_argument("--threshold", type=float, default=0.2, help="回帰とみなす悪化率（既定: 0.2 = 20%%）")
+    parser.add_argument("--min-ms", type=float, default=0.5, help="回帰とみなす最小の差（ミリ秒、既定: 0.5）")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    base, new = _load(args.base), _load(args.new)
+    rows, regressions = compare_results(base, new, args.metric, args.threshold, args.min_ms)
+    print(f"{args.metric}: {base['meta'].get('commit')} → {new['meta'].get('commit')}")
+    if _params_differ(base, new):
+        print("注意: 計測条件（見積数・明細数など）が異なります。")
+    for row in rows:
+        before = "-" if row["before"] is None else f"{row['before']:.2f}"
+        after = "-" if row["after"] is None else f"{row['after']:.2f}"
+        change = "" if row["change"] is None else f"{row['change']:+.1%}"
+        mark = "  ← 回帰" if row["regressed"] else ""
+        print(f"  {row['name']:<24} {before:>10} → {after:>10} ms  {change:>8}{mark}")
+    if regressions:
+        print(f"回帰: {', '.join(regressions)}")
+        raise SystemExit(1)
+    print("回帰なし")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.run import summarize
+
+# --- 見積アプリの負荷試験 ---
+# 起動中のアプリ（flask run / gunicorn）に対し、担当者の操作を模した一連の操作（セッション）を
+# N 人の仮想ユーザー（スレッド）で繰り返し、ルートごとのスループット・p50/p95/p99・エラー率を出す。
+#   閲覧: 一覧 → （検索）→ 詳細を数件
+#   見積作成: 一覧 → 入力画面（種別を選択）→ マスタ取得（初回のみ。ブラウザのキャッシュを模す）
+#             → 登録（POST /estimates）→ 登録後の詳細
+# 仮想ユーザーごとに Cookie を持ち、操作の間に考える時間（--think-ms）を置く。
+# ロックエラー（database is locked）はアプリが付ける X-Error: sqlite-locked ヘッダ（503）で判定する。
+# 登録の結果（詳細へ・書き込みキューの受付画面へ・入力画面へ戻る）は別に数える。
+#
+#   python -m benchmarks.load --base-url http://127.0.0.1:5000 --users 20 --duration 60
+
+# 入力画面の種別と、その種別の明細に使う商品コードの接頭辞
+ESTIMATE_TYPES = {
+    '太陽光': ('SOL',),
+    '蓄電池': ('BAT',),
+    '単機能V2H': ('V2H',),
+    'トライブリッドV2H': ('TVH',),
+    'パワコン交換': ('PWR',),
+    '撤去再設置': ('RRI', 'SOL'),
+}
+# 見積作成セッションで選ぶ種別の組み合わせと重み
+TYPE_MIX: List[Tuple[Tuple[str, ...], float]] = [
+    (('太陽光',), 35),
+    (('太陽光', '蓄電池'), 30),
+    (('蓄電池',), 10),
+    (('単機能V2H',), 8),
+    (('トライブリッドV2H',), 7),
+    (('パワコン交換',), 7),
+    (('撤去再設置',), 3),
+]
+SEARCH_WORDS = ('太陽光', '蓄電池', 'V2H', 'パワコン', '交換', '新築')
+
+_DETAIL_LINK = re.compile(r'href="/estimates/(\d+)"')
+_MASTER_URL = re.compile(r'/api/masters/[a-z]+\?v=[0-9a-f]+')
+_DETAIL_PATH = re.compile(r'/estimates/\d+$')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """リダイレクト先は呼び出し側で判定する（登録の 302 を計測するため）"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.sessions = {'browse': 0, 'quote': 0}
+        # 登録の結果: created（詳細へ）/ queued（書き込みキューの受付画面へ）/ rejected（入力画面へ戻された）
+        self.outcomes = {'created': 0, 'queued': 0, 'rejected': 0}
+
+    def record(self, route: str, elapsed: float, error: Optional[str]) -> None:
+        with self._lock:
+            self.latencies.setdefault(route, [])
+            errors = self.errors.setdefault(route, {})
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+            else:
+                self.latencies[route].append(elapsed * 1000)
+
+    def outcome(self, kind: str) -> None:
+        with self._lock:
+            self.outcomes[kind] += 1
+
+    def session_done(self, kind: str) -> None:
+        with self._lock:
+            self.sessions[kind] += 1
+
+
+class VirtualUser:
+    def __init__(self, base_url: str, recorder: Recorder, rng: random.Random, think_ms: float, timeout: float):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.rng = rng
+        self.think_ms = think_ms
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect)
+        self.master_cache: Dict[str, Any] = {}
+        self.estimate_ids: List[int] = []
+
+    def request(self, route: str, path: str, data: Optional[bytes] = None) -> Tuple[int, str, Dict[str, str]]:
+        """1回の要求を計測して (ステータス, 本文, ヘッダ) を返す。通信エラーはステータス 0"""
+        req = urllib.request.Request(self.base_url + path, data=data)
+        started = time.perf_counter()
+        status, body, headers = 0, '', {}
+        error: Optional[str] = None
+        try:
+            with self.opener.open(req, timeout=self.timeout) as resp:
+                status, body, headers = resp.status, resp.read().decode('utf-8', 'replace'), dict(resp.headers)
+        except urllib.error.HTTPError as e:
+            status, headers = e.code, dict(e.headers or {})
+            body = e.read().decode('utf-8', 'replace') if e.fp else ''
+        except (urllib.error.URLError, OSError) as e:
+            error = 'timeout' if 'timed out' in str(e) else 'connection'
+        elapsed = time.perf_counter() - started
+        if error is None and status >= 400:
+            if headers.get('X-Error') == 'sqlite-locked':
+                error = 'lock'
+            else:
+                error = f'http_{status // 100}xx'
+        self.recorder.record(route, elapsed, error)
+        return status, body, headers
+
+    def think(self) -> None:
+        if self.think_ms > 0:
+            time.sleep(self.rng.uniform(0, self.think_ms) / 1000)
+
+    def _remember_ids(self, html: str) -> None:
+        ids = [int(m) for m in _DETAIL_LINK.findall(html)]
+        if ids:
+            self.estimate_ids = ids
+
+    def browse(self) -> None:
+        _, body, _ = self.request('GET /', '/')
+        self._remember_ids(body)
+        self.think()
+        if self.rng.random() < 0.4:
+            q = urllib.parse.quote(self.rng.choice(SEARCH_WORDS))
+            _, body, _ = self.request('GET /?q=', f'/?q={q}')
+            self._remember_ids(body)
+            self.think()
+        for _ in range(self.rng.randint(1, 3)):
+            if not self.estimate_ids:
+                break
+            self.request('GET /estimates/<id>', f'/estimates/{self.rng.choice(self.estimate_ids)}')
+            self.think()
+        self.recorder.session_done('browse')
+
+    def _load_masters(self, form_html: str) -> None:
+        # 版付きURLはブラウザが長期キャッシュするため、同じ版は仮想ユーザーごとに1回だけ取得する
+        for url in _MASTER_URL.findall(form_html):
+            if url in self.master_cache:
+                continue
+            status, body, _ = self.request('GET /api/masters/<name>', url)
+            if status == 200:
+                self.master_cache[url] = json.loads(body)
+
+    def _masters(self) -> Tuple[List[Dict], Dict[str, List[Dict]], List[Dict]]:
+        products: List[Dict] = []
+        models: Dict[str, List[Dict]] = {}
+        customers: List[Dict] = []
+        for url, data in self.master_cache.items():
+            name = url.split('/api/masters/', 1)[1].split('?', 1)[0]
+            if name == 'products':
+                products = data
+            elif name == 'models':
+                models = data
+            elif name == 'customers':
+                customers = data
+        return products, models, customers
+
+    def _form(self, types: Tuple[str, ...]) -> List[Tuple[str, str]]:
+        products, models, customers = self._masters()
+        prefixes = {p for t in types for p in ESTIMATE_TYPES[t]} | {'FEE'}
+        candidates = [p for p in products if p['code'].split('-', 1)[0] in prefixes] or products
+        fields = [
+            ('title', f"負荷試験 {'・'.join(types)}"),
+            ('customer_id', self.rng.choice(customers)['id'] if customers else ''),
+            ('discount_amount', str(self.rng.choice((0, 0, 0, 10000)))),
+        ]
+        for product in self.rng.sample(candidates, min(len(candidates), self.rng.randint(5, 25))):
+            rows = models.get(product['code']) or []
+            source = self.rng.choice(rows) if rows else product
+            fields += [
+                ('item_product_code', product['code']),
+                ('item_model_code', source['code'] if rows else ''),
+                ('item_model_name', source['name'] if rows else ''),
+                ('item_quantity', str(self.rng.randint(1, 20))),
+                ('item_unit_price', f"{float(source.get('unit_price', 0) or 0):g}"),
+                ('item_unit_cost', f"{float(source.get('unit_cost', 0) or 0):g}"),
+            ]
+        return fields
+
+    def quote(self) -> None:
+        _, body, _ = self.request('GET /', '/')
+        self._remember_ids(body)
+        self.think()
+        types = self.rng.choices([t for t, _ in TYPE_MIX], weights=[w for _, w in TYPE_MIX])[0]
+        query = urllib.parse.urlencode([('type', t) for t in types])
+        status, body, _ = self.request('GET /estimates/new', f'/estimates/new?{query}')
+        if status != 200:
+            return
+        self._load_masters(body)
+        # 入力の時間（明細の選択など）は閲覧より長い
+        self.think()
+        self.think()
+        data = urllib.parse.urlencode(self._form(types)).encode('utf-8')
+        status, _, headers = self.request('POST /estimates', '/estimates', data=data)
+        location = urllib.parse.urlparse(headers.get('Location', '')).path
+        if status == 302 and _DETAIL_PATH.search(location):
+            self.recorder.outcome('created')
+            self.think()
+            self.request('GET /estimates/<id>', location)
+        elif status == 302 and '/estimates/pending/' in location:
+            self.recorder.outcome('queued')
+        elif status == 302:
+            self.recorder.outcome('rejected')
+        self.recorder.session_done('quote')
+
+
+def run_load(
+    base_url: str, users: int, duration: float, quote_ratio: float, think_ms: float, timeout: float, seed: int
+) -> Tuple[Recorder, float]:
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    def worker(n: int) -> None:
+        user = VirtualUser(base_url, recorder, random.Random(seed + n), think_ms, timeout)
+        # 全員が同時に始めないよう、開始をずらす
+        time.sleep(user.rng.uniform(0, min(think_ms, 1000)) / 1000)
+        while time.perf_counter() < deadline:
+            if user.rng.random() < quote_ratio:
+                user.quote()
+            else:
+                user.browse()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder, time.perf_counter() - started
+
+
+def build_report(recorder: Recorder, elapsed: float, params: Dict[str, Any]) -> Dict[str, Any]:
+    routes: Dict[str, Any] = {}
+    for route in sorted(set(recorder.latencies) | set(recorder.errors)):
+        samples = recorder.latencies.get(route, [])
+        errors = recorder.errors.get(route, {})
+        error_count = sum(errors.values())
+        total = len(samples) + error_count
+        routes[route] = {
+            **summarize(samples, error_count),
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 2) if elapsed > 0 else None,
+            'error_rate': round(error_count / total, 4) if total else None,
+            'errors_by_kind': errors,
+        }
+    total = sum(r['requests'] for r in routes.values())
+    return {
+        'params': params,
+        'elapsed_sec': round(elapsed, 2),
+        'sessions': dict(recorder.sessions),
+        'create_outcomes': dict(recorder.outcomes),
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 2) if elapsed > 0 else None,
+        'routes': routes,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='起動中の見積アプリに、閲覧・見積作成の操作を仮想ユーザーで並行に流して計測します。'
+    )
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000', help='アプリのURL（既定: http://127.0.0.1:5000）')
+    parser.add_argument('--users', type=int, default=10, help='仮想ユーザー数（スレッド数、既定: 10）')
+    parser.add_argument('--duration', type=float, default=30.0, help='計測時間（秒、既定: 30）')
+    parser.add_argument('--quote-ratio', type=float, default=0.3, help='見積作成セッションの割合（既定: 0.3。残りは閲覧）')
+    parser.add_argument('--think-ms', type=float, default=500.0, help='操作間の考える時間の上限（ミリ秒、既定: 500。0 で待たない）')
+    parser.add_argument('--timeout', type=float, default=30.0, help='1回の要求のタイムアウト（秒、既定: 30）')
+    parser.add_argument('--seed', type=int, default=0, help='乱数の種（既定: 0）')
+    parser.add_argument('--output', type=Path, default=None, help='結果をJSONで書き出すパス')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    params = {k: v for k, v in vars(args).items() if k != 'output'}
+    recorder, elapsed = run_load(
+        args.base_url, args.users, args.duration, args.quote_ratio, args.think_ms, args.timeout, args.seed
+    )
+    report = build_report(recorder, elapsed, params)
+    print(
+        f"{args.users} ユーザー / {report['elapsed_sec']:.1f} 秒 / セッション 閲覧 {report['sessions']['browse']}・"
+        f"見積作成 {report['sessions']['quote']} / {report['requests']:,} 要求（{report['throughput_rps']} req/s）"
+    )
+    outcomes = report['create_outcomes']
+    print(f"登録: 完了 {outcomes['created']} / 受付（キュー）{outcomes['queued']} / 入力画面へ戻る {outcomes['rejected']}")
+    for route, r in report['routes'].items():
+        errors = ', '.join(f'{k} {v}' for k, v in sorted(r['errors_by_kind'].items())) or '-'
+        if r['n']:
+            latency = f"p50 {r['p50_ms']:8.1f}  p95 {r['p95_ms']:8.1f}  p99 {r['p99_ms']:8.1f} ms"
+        else:
+            latency = f"{'（成功なし）':<40}"
+        print(
+            f"  {route:<28} {r['requests']:>6} 件 {r['throughput_rps']:>7} req/s  {latency}"
+            f"  エラー率 {r['error_rate']:.1%}（{errors}）"
+        )
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with args.output.open('w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks.synthetic import BASE_DIR, build_masters, build_workbook, form_payload, iter_estimates
+
+# --- 見積アプリのホットパスのベンチマーク ---
+# 使い捨ての instance フォルダ（DB）と合成マスタを作り、app を ESTIMATE_INSTANCE_PATH /
+# ESTIMATE_MASTERS_DIR で差し替えて読み込む。instance/app.db と data/ には触れない。
+# 各パスは Flask のテストクライアント経由で計測し、結果を JSON に書き出す
+# （コミット間の比較は python -m benchmarks.compare）。
+#
+#   python -m benchmarks.run --estimates 1000 --items 5-60 --output benchmarks/results/base.json
+
+RESULTS_DIR = BASE_DIR / "benchmarks" / "results"
+RESULT_FORMAT = 1
+
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def summarize(samples_ms: List[float], errors: int = 0) -> Dict[str, Any]:
+    ordered = sorted(samples_ms)
+    if not ordered:
+        return {"n": 0, "errors": errors}
+    return {
+        "n": len(ordered),
+        "errors": errors,
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "min_ms": round(ordered[0], 3),
+        "p50_ms": round(_percentile(ordered, 0.50), 3),
+        "p95_ms": round(_percentile(ordered, 0.95), 3),
+        "p99_ms": round(_percentile(ordered, 0.99), 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def measure(
+    fn: Callable[[int], bool],
+    repeat: int,
+    warmup: int = 3,
+    before: Optional[Callable[[int], None]] = None,
+) -> Dict[str, Any]:
+    """fn(i) を repeat 回計測する。fn は成功なら True。before(i) は計測に含めない準備処理"""
+    for i in range(warmup):
+        if before:
+            before(i)
+        fn(i)
+    samples: List[float] = []
+    errors = 0
+    for i in range(repeat):
+        if before:
+            before(i)
+        started = time.perf_counter()
+        ok = fn(i)
+        elapsed = (time.perf_counter() - started) * 1000
+        if ok:
+            samples.append(elapsed)
+        else:
+            errors += 1
+    return summarize(samples, errors)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def _parse_range(value: str) -> Tuple[int, int]:
+    low, _, high = value.partition("-")
+    low_n = int(low)
+    high_n = int(high) if high else low_n
+    if low_n < 1 or high_n < low_n:
+        raise argparse.ArgumentTypeError(f"明細数の範囲が不正です: {value}")
+    return low_n, high_n
+
+
+def seed_database(app_module, masters_dir: Path, estimates: int, items: Tuple[int, int], seed: int, chunk: int) -> Dict[str, Any]:
+    """取り込み処理（_import_estimates）で合成見積を登録する"""
+    from services.estimate_import import parse_json_estimates
+
+    started = time.perf_counter()
+    imported = 0
+    imported_items = 0
+    batch: List[Dict[str, Any]] = []
+    with app_module.app.app_context():
+
+        def flush() -> None:
+            nonlocal imported, imported_items
+            result = app_module._import_estimates(parse_json_estimates(batch))
+            if result["errors"]:
+                raise RuntimeError(f"合成見積の取り込みでエラー: {result['errors'][:3]}")
+            imported += result["imported"]
+            imported_items += result["imported_items"]
+            batch.clear()
+
+        for entry in iter_estimates(masters_dir, estimates, items, seed):
+            batch.append(entry)
+            if len(batch) >= chunk:
+                flush()
+        if batch:
+            flush()
+    seconds = time.perf_counter() - started
+    return {
+        "estimates": imported,
+        "items": imported_items,
+        "seconds": round(seconds, 3),
+        "estimates_per_sec": round(imported / seconds, 1) if seconds > 0 else None,
+    }
+
+
+def run_suite(args: argparse.Namespace, workdir: Path) -> Dict[str, Any]:
+    masters_dir = workdir / "data"
+    instance_dir = workdir / "instance"
+    master_counts = build_masters(masters_dir, args.customers, args.models_per_product, args.seed)
+
+    # app は import 時に instance フォルダとマスタを決めるため、環境変数を設定してから読み込む
+    if "app" in sys.modules:
+        raise RuntimeError("app が既に読み込まれています。ベンチマークは新しいプロセスで実行してください。")
+    os.environ["ESTIMATE_INSTANCE_PATH"] = str(instance_dir)
+    os.environ["ESTIMATE_MASTERS_DIR"] = str(masters_dir)
+    import app as app_module
+    from services import fragment_cache, masters
+    from services.xlsx_to_json import convert_workbooks
+
+    seeded = seed_database(app_module, masters_dir, args.estimates, args.items, args.seed, args.seed_chunk)
+    client = app_module.app.test_client()
+    rng = random.Random(args.seed)
+    repeat = args.repeat
+    results: Dict[str, Dict[str, Any]] = {}
+
+    def get_ok(url: str) -> bool:
+        return client.get(url).status_code == 200
+
+    results["estimate_list"] = measure(lambda i: get_ok("/"), repeat)
+    results["estimate_search"] = measure(lambda i: get_ok("/?q=太陽光"), repeat)
+
+    max_id = seeded["estimates"]
+    detail_ids = [rng.randint(1, max_id) for _ in range(repeat + 3)] if max_id else [1] * (repeat + 3)
+    # 描画済みHTMLのキャッシュに当たる場合（同じ見積を続けて開く）と、毎回描画する場合
+    results["estimate_detail_cached"] = measure(lambda i: get_ok(f"/estimates/{detail_ids[0]}"), repeat)
+    results["estimate_detail"] = measure(
+        lambda i: get_ok(f"/estimates/{detail_ids[i]}"), repeat, before=lambda i: fragment_cache.clear()
+    )
+    results["estimate_new"] = measure(lambda i: get_ok("/estimates/new?type=太陽光&type=蓄電池"), repeat)
+
+    forms = [form_payload(masters_dir, args.form_lines, seed=args.seed + i) for i in range(repeat + 3)]
+
+    def create(i: int) -> bool:
+        from werkzeug.datastructures import MultiDict
+
+        return client.post("/estimates", data=MultiDict(forms[i])).status_code == 302
+
+    results["estimate_create"] = measure(create, repeat)
+
+    # マスタ: JSON からの読み込み（キャッシュ破棄後）と、索引からの検索 1,000 回
+    results["masters_load"] = measure(lambda i: masters.preload() or True, repeat, before=lambda i: masters.clear_cache())
+    models = masters.get_models()
+    lookups = [(code, m["code"]) for code, rows in models.items() for m in rows] or [("", "")]
+    customer_ids = [c["id"] for c in masters.get_customers()] or [""]
+
+    def lookup(i: int) -> bool:
+        for n in range(1000):
+            product_code, model_code = lookups[n % len(lookups)]
+            masters.find_product_by_code(product_code)
+            masters.find_model(product_code, model_code)
+            masters.find_customer_by_id(customer_ids[n % len(customer_ids)])
+        return True
+
+    results["masters_lookup_x1000"] = measure(lookup, repeat)
+
+    workbook = workdir / "master.xlsx"
+    build_workbook(workbook, args.xlsx_rows, args.seed)
+    xlsx_out = workdir / "xlsx_out"
+    results["xlsx_to_json"] = measure(
+        lambda i: bool(convert_workbooks([workbook], xlsx_out, force=True)), args.xlsx_repeat, warmup=1
+    )
+
+    return {
+        "format": RESULT_FORMAT,
+        "meta": {
+            "commit": _git_commit(),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {
+                "estimates": args.estimates,
+                "items": list(args.items),
+                "customers": args.customers,
+                "models_per_product": args.models_per_product,
+                "form_lines": args.form_lines,
+                "repeat": repeat,
+                "xlsx_rows": args.xlsx_rows,
+                "seed": args.seed,
+            },
+            "masters": master_counts,
+            "seed": seeded,
+        },
+        "results": results,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="合成データを入れた使い捨てDBで、見積の登録・一覧・詳細・マスタ・xlsx_to_json を計測します。"
+    )
+    parser.add_argument("--estimates", type=int, default=1000, help="事前に登録する見積数（既定: 1000）")
+    parser.add_argument("--items", type=_parse_range, default=(5, 60), help="見積1件あたりの明細数の範囲（既定: 5-60）")
+    parser.add_argument("--customers", type=int, default=200, help="合成する顧客数（既定: 200）")
+    parser.add_argument("--models-per-product", type=int, default=0, help="商品ごとに足す派生型式の数（既定: 0）")
+    parser.add_argument("--form-lines", type=int, default=20, help="登録フォームで送る明細数（既定: 20）")
+    parser.add_argument("--repeat", type=int, default=50, help="各パスの計測回数（既定: 50）")
+    parser.add_argument("--xlsx-rows", type=int, default=5000, help="xlsx_to_json 計測用のブックの行数（既定: 5000）")
+    parser.add_argument("--xlsx-repeat", type=int, default=3, help="xlsx_to_json の計測回数（既定: 3）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数の種（既定: 0）")
+    parser.add_argument("--seed-chunk", type=int, default=1000, help="見積の投入で1回に取り込む件数（既定: 1000）")
+    parser.add_argument("--output", type=Path, default=None, help="結果JSONの出力先（既定: benchmarks/results/<日時>-<commit>.json）")
+    parser.add_argument("--keep", type=Path, default=None, help="使い捨てDB・合成マスタをこのディレクトリに残す")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.keep:
+        args.keep.mkdir(parents=True, exist_ok=True)
+        report = run_suite(args, args.keep)
+    else:
+        with tempfile.TemporaryDirectory(prefix="estimate-bench-") as tmp:
+            report = run_suite(args, Path(tmp))
+
+    output = args.output
+    if output is None:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = RESULTS_DIR / f"{stamp}-{report['meta']['commit'] or 'nogit'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open("w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    seeded = report["meta"]["seed"]
+    print(f"投入: 見積 {seeded['estimates']:,} 件 / 明細 {seeded['items']:,} 件 {seeded['seconds']:.1f} 秒")
+    for name, r in report["results"].items():
+        if not r["n"]:
+            print(f"  {name:<24} 成功なし（エラー {r['errors']}）")
+            continue
+        print(
+            f"  {name:<24} p50 {r['p50_ms']:9.2f} ms  p95 {r['p95_ms']:9.2f} ms"
+            f"  p99 {r['p99_ms']:9.2f} ms  ({r['n']} 回, エラー {r['errors']})"
+        )
+    print(f"結果: {output}")
+
+
+if __name__ == "__main__":
+    main()
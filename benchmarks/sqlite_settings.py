@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import argparse
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List
+
+from services.sqlite_tuning import apply_pragmas, index_statements
+
+# --- SQLite 設定の比較ベンチマーク ---
+# 見積一覧・詳細・顧客別の読み込みスレッドと、見積登録の書き込みスレッドを同時に動かし、
+# 既定設定（ロールバックジャーナル・索引なし）と調整後（WAL・PRAGMA・索引あり）の
+# 操作ごとのレイテンシ（p50/p95/p99）とロックエラー数を比較する。
+# 一時ディレクトリに使い捨てのDBを作るため、instance/app.db には触れない。
+#
+#   python -m benchmarks.sqlite_settings --seconds 5
+
+_SCHEMA = [
+    """
+    CREATE TABLE estimates (
+        id INTEGER PRIMARY KEY,
+        title VARCHAR(255) NOT NULL,
+        customer_id VARCHAR(64) NOT NULL,
+        customer_name VARCHAR(255) NOT NULL,
+        created_at DATETIME NOT NULL,
+        subtotal_price FLOAT NOT NULL,
+        total_price FLOAT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE estimate_items (
+        id INTEGER PRIMARY KEY,
+        estimate_id INTEGER NOT NULL REFERENCES estimates(id),
+        product_code VARCHAR(64) NOT NULL,
+        product_name VARCHAR(255) NOT NULL,
+        quantity INTEGER NOT NULL,
+        unit_price FLOAT NOT NULL,
+        line_total_price FLOAT NOT NULL
+    )
+    """,
+]
+_CUSTOMERS = [f'CUST{n:03d}' for n in range(1, 51)]
+
+_READS = {
+    'list': (
+        "SELECT id, created_at, title, customer_name, subtotal_price, total_price FROM estimates "
+        "ORDER BY created_at DESC, id DESC LIMIT 51"
+    ),
+    'detail': "SELECT * FROM estimate_items WHERE estimate_id = ?",
+    'customer': (
+        "SELECT id, created_at, title, total_price FROM estimates "
+        "WHERE customer_id = ? ORDER BY created_at DESC LIMIT 50"
+    ),
+}
+
+
+def _insert_estimate(conn: sqlite3.Connection, created_at: datetime, items_per_estimate: int) -> int:
+    customer = random.choice(_CUSTOMERS)
+    cur = conn.execute(
+        "INSERT INTO estimates (title, customer_id, customer_name, created_at, subtotal_price, total_price) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        ('ベンチマーク', customer, customer, created_at.isoformat(sep=' '), 100000.0, 100000.0),
+    )
+    estimate_id = cur.lastrowid
+    conn.executemany(
+        "INSERT INTO estimate_items (estimate_id, product_code, product_name, quantity, unit_price, line_total_price) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(estimate_id, 'SOL-001', 'モジュール', 1, 20000.0, 20000.0) for _ in range(items_per_estimate)],
+    )
+    return estimate_id
+
+
+def build_database(path: Path, tuned: bool, estimates: int, items_per_estimate: int) -> None:
+    conn = sqlite3.connect(path)
+    if tuned:
+        apply_pragmas(conn)
+    for statement in _SCHEMA:
+        conn.execute(statement)
+    if tuned:
+        for statement in index_statements():
+            conn.execute(statement)
+    started = datetime(2024, 1, 1)
+    with conn:
+        for i in range(estimates):
+            _insert_estimate(conn, started + timedelta(minutes=i), items_per_estimate)
+    conn.close()
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def run_workload(path: Path, tuned: bool, readers: int, writers: int, seconds: float, max_id: int, items_per_estimate: int):
+    latencies: Dict[str, List[float]] = {name: [] for name in list(_READS) + ['write']}
+    errors: Dict[str, int] = {name: 0 for name in latencies}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def record(name: str, elapsed: float, failed: bool) -> None:
+        with lock:
+            if failed:
+                errors[name] += 1
+            else:
+                latencies[name].append(elapsed * 1000)
+
+    def reader() -> None:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        if tuned:
+            apply_pragmas(conn)
+        while time.perf_counter() < deadline:
+            name = random.choice(list(_READS))
+            params = ()
+            if name == 'detail':
+                params = (random.randint(1, max_id),)
+            elif name == 'customer':
+                params = (random.choice(_CUSTOMERS),)
+            started = time.perf_counter()
+            try:
+                conn.execute(_READS[name], params).fetchall()
+                record(name, time.perf_counter() - started, False)
+            except sqlite3.OperationalError:
+                record(name, 0.0, True)
+        conn.close()
+
+    def writer() -> None:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        if tuned:
+            apply_pragmas(conn)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                with conn:
+                    _insert_estimate(conn, datetime.now(), items_per_estimate)
+                record('write', time.perf_counter() - started, False)
+            except sqlite3.OperationalError:
+                record('write', 0.0, True)
+        conn.close()
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="SQLite の既定設定と調整後設定（WAL・PRAGMA・索引）で、同時読み書きのレイテンシを比較します。"
+    )
+    parser.add_argument("--estimates", type=int, default=20000, help="事前に登録する見積数")
+    parser.add_argument("--items", type=int, default=5, help="見積1件あたりの明細数")
+    parser.add_argument("--readers", type=int, default=4, help="読み込みスレッド数")
+    parser.add_argument("--writers", type=int, default=1, help="書き込みスレッド数")
+    parser.add_argument("--seconds", type=float, default=5.0, help="各設定での計測時間（秒）")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, tuned in (("既定", False), ("調整後", True)):
+            path = Path(tmp) / f"bench_{'tuned' if tuned else 'default'}.db"
+            build_database(path, tuned, args.estimates, args.items)
+            latencies, errors = run_workload(
+                path, tuned, args.readers, args.writers, args.seconds, args.estimates, args.items
+            )
+            print(f"[{label}] 読み込み {args.readers} / 書き込み {args.writers} スレッド、{args.seconds:g} 秒")
+            for name, values in latencies.items():
+                print(
+                    f"  {name:<8} {len(values):>7} 回  p50 {_percentile(values, 0.50):8.2f} ms"
+                    f"  p95 {_percentile(values, 0.95):8.2f} ms  p99 {_percentile(values, 0.99):8.2f} ms"
+                    f"  エラー {errors[name]}"
+                )
+
+
+if __name__ == "__main__":
+    # python -m benchmarks.sqlite_settings --seconds 5
+    main()
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import json
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from openpyxl import Workbook
+
+# --- ベンチマーク用の合成データ ---
+# 実データの products.json / models.json を元に、件数だけを増やしたマスタと見積を作る。
+# 商品コード・型式コードは実データのものを先頭に残すため、原価ルール（data/pricing_rules.json）や
+# 材料費の区分はそのまま効く。乱数は seed で固定し、同じ引数なら同じデータになる。
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = BASE_DIR / "data"
+
+# 見積の作成日時を散らす期間（月次集計の月がばらけるように）
+_DATE_SPAN_DAYS = 730
+
+
+def _load(name: str) -> Any:
+    with (DATA_DIR / name).open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_masters(out_dir: Path, customers: int = 200, models_per_product: int = 0, seed: int = 0) -> Dict[str, int]:
+    """
+    合成マスタ（customers.json / products.json / models.json）を out_dir に書き出す。
+    型式は実データの後ろに、商品ごとに models_per_product 件の派生型式（単価・原価を揺らしたもの）を足す。
+    戻り値はマスタごとの件数。
+    """
+    rng = random.Random(seed)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    real_customers = _load("customers.json")
+    customer_rows = list(real_customers)
+    for n in range(len(customer_rows), customers):
+        customer_rows.append({"id": f"BENCH{n + 1:06d}", "name": f"ベンチマーク顧客{n + 1:06d}"})
+
+    products = _load("products.json")
+    models: Dict[str, List[Dict[str, Any]]] = _load("models.json")
+    synthetic_models: Dict[str, List[Dict[str, Any]]] = {}
+    for product_code, rows in models.items():
+        extended = list(rows)
+        for n in range(models_per_product if rows else 0):
+            base = rows[n % len(rows)]
+            factor = rng.uniform(0.8, 1.2)
+            extended.append({
+                **base,
+                "code": f"{base['code']}-B{n + 1:04d}",
+                "name": f"{base['name']}（派生{n + 1}）",
+                "unit_price": round(float(base.get("unit_price", 0) or 0) * factor),
+                "unit_cost": round(float(base.get("unit_cost", 0) or 0) * factor, 2),
+            })
+        synthetic_models[product_code] = extended
+
+    for name, data in (
+        ("customers.json", customer_rows),
+        ("products.json", products),
+        ("models.json", synthetic_models),
+    ):
+        with (out_dir / name).open("w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+    return {
+        "customers": len(customer_rows),
+        "products": len(products),
+        "models": sum(len(v) for v in synthetic_models.values()),
+    }
+
+
+def _item_choices(masters_dir: Path) -> List[Tuple[str, str, str, float, float]]:
+    """明細に使う (商品コード, 型式コード, 型式名, 単価, 原価)。型式の無い商品は型式コード空"""
+    with (masters_dir / "products.json").open("r", encoding="utf-8") as f:
+        products = json.load(f)
+    with (masters_dir / "models.json").open("r", encoding="utf-8") as f:
+        models = json.load(f)
+    choices: List[Tuple[str, str, str, float, float]] = []
+    for product in products:
+        rows = models.get(product["code"]) or []
+        for source in rows or [product]:
+            choices.append((
+                product["code"],
+                source["code"] if rows else "",
+                source["name"] if rows else "",
+                float(source.get("unit_price", 0) or 0),
+                float(source.get("unit_cost", 0) or 0),
+            ))
+    return choices
+
+
+def _customer_ids(masters_dir: Path) -> List[str]:
+    with (masters_dir / "customers.json").open("r", encoding="utf-8") as f:
+        return [c["id"] for c in json.load(f)]
+
+
+def iter_estimates(
+    masters_dir: Path,
+    count: int,
+    items: Tuple[int, int] = (5, 60),
+    seed: int = 0,
+) -> Iterator[Dict[str, Any]]:
+    """取り込みAPIの JSON 形式（services/estimate_import.py）の見積を count 件生成する"""
+    rng = random.Random(seed)
+    choices = _item_choices(masters_dir)
+    customer_ids = _customer_ids(masters_dir)
+    started = datetime(2024, 1, 1)
+    for n in range(count):
+        lines = []
+        for _ in range(rng.randint(*items)):
+            product_code, model_code, model_name, _, _ = rng.choice(choices)
+            lines.append({
+                "product_code": product_code,
+                "model_code": model_code,
+                "model_name": model_name,
+                "quantity": rng.randint(1, 20),
+            })
+        yield {
+            "estimate_key": f"bench-{n + 1}",
+            "title": f"ベンチマーク見積 {n + 1} 太陽光・蓄電池 {rng.choice(('新築', '既築', '増設', '交換'))}",
+            "customer_id": rng.choice(customer_ids),
+            "discount": rng.choice((0, 0, 0, 10000, 50000)),
+            "created_at": (started + timedelta(minutes=rng.randrange(_DATE_SPAN_DAYS * 24 * 60))).isoformat(),
+            "items": lines,
+        }
+
+
+def form_payload(masters_dir: Path, lines: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """見積登録フォーム（POST /estimates）の送信内容。複数値のキーがあるため (名前, 値) の並び"""
+    rng = random.Random(seed)
+    choices = _item_choices(masters_dir)
+    fields = [("title", "ベンチマーク登録"), ("customer_id", rng.choice(_customer_ids(masters_dir))), ("discount_amount", "0")]
+    for _ in range(lines):
+        product_code, model_code, model_name, unit_price, unit_cost = rng.choice(choices)
+        fields += [
+            ("item_product_code", product_code),
+            ("item_model_code", model_code),
+            ("item_model_name", model_name),
+            ("item_quantity", str(rng.randint(1, 20))),
+            ("item_unit_price", f"{unit_price:g}"),
+            ("item_unit_cost", f"{unit_cost:g}"),
+        ]
+    return fields
+
+
+def build_workbook(path: Path, rows: int, seed: int = 0) -> None:
+    """xlsx_to_json の計測用に、製品マスタと同じ列構成のブックを作る"""
+    rng = random.Random(seed)
+    with (DATA_DIR / "master.json").open("r", encoding="utf-8") as f:
+        sample = json.load(f)
+    headers = list(sample[0].keys()) if sample else ["商品ＣＤ", "商品名", "移動平均単価"]
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("製品マスタ")
+    ws.append(headers)
+    for n in range(rows):
+        base = sample[n % len(sample)] if sample else {}
+        row = [base.get(h) for h in headers]
+        if "移動平均単価" in headers:
+            row[headers.index("移動平均単価")] = round(rng.uniform(100, 200000), 2)
+        ws.append(row)
+    wb.save(path)
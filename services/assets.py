@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+try:
+    import brotli  # 任意（pip install brotli）。無ければ gzip のみ作る
+except ImportError:
+    brotli = None
+
+# --- 静的ファイル（CSS・JS）の配信用ビルド ---
+# static/ の元ファイルを、内容のハッシュを含むファイル名で static/dist/ に書き出す
+# （例: js/estimate_form.js → dist/js/estimate_form.3f2a9c1d0b7e.js）。
+# 内容が変われば URL が変わるため、ブラウザには1年・immutable でキャッシュさせられる。
+# 圧縮済みの .gz（brotli があれば .br も）を同時に作り、配信時は Accept-Encoding に応じて返す。
+# ビルドしていない環境（開発中など）では asset_url が元ファイルの URL にフォールバックする。
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+STATIC_DIR = BASE_DIR / 'static'
+DIST_DIR = STATIC_DIR / 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+# ビルド対象（static/ からの相対パス）
+ASSETS = (
+    'styles.css',
+    'js/estimate_form.js',
+    'js/outbox.js',
+)
+HASH_LENGTH = 12
+# これより小さいファイルは圧縮しても通信量がほとんど変わらない
+MIN_COMPRESS_BYTES = 512
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _hashed_name(name: str, digest: str) -> str:
+    path = Path(name)
+    return str(path.with_name(f'{path.stem}.{digest[:HASH_LENGTH]}{path.suffix}'))
+
+
+def _write_if_changed(path: Path, data: bytes) -> None:
+    if path.exists() and path.read_bytes() == data:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def build_assets(
+    assets: Iterable[str] = ASSETS,
+    static_dir: Path = STATIC_DIR,
+    dist_dir: Path = DIST_DIR,
+    prune: bool = False,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    内容ハッシュ付きのファイルと圧縮版、マニフェスト（元の名前 → 配信ファイル）を作る。
+    以前のビルドのファイルは、配信中の古いページから参照されるため既定では残す（prune=True で削除）。
+    """
+    manifest: Dict[str, Dict[str, Any]] = {}
+    for name in assets:
+        data = (static_dir / name).read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        hashed = _hashed_name(name, digest)
+        out_path = dist_dir / hashed
+        _write_if_changed(out_path, data)
+        encodings = []
+        if len(data) >= MIN_COMPRESS_BYTES:
+            if brotli is not None:
+                _write_if_changed(out_path.with_name(out_path.name + '.br'), brotli.compress(data, quality=11))
+                encodings.append('br')
+            # mtime=0 で、同じ内容からは同じバイト列になるようにする
+            _write_if_changed(out_path.with_name(out_path.name + '.gz'), gzip.compress(data, compresslevel=9, mtime=0))
+            encodings.append('gzip')
+        manifest[name] = {'file': hashed, 'sha256': digest, 'size': len(data), 'encodings': encodings}
+
+    _write_if_changed(
+        dist_dir / MANIFEST_NAME,
+        json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode('utf-8'),
+    )
+    if prune:
+        keep = {MANIFEST_NAME}
+        for entry in manifest.values():
+            keep.add(entry['file'])
+            keep.update(entry['file'] + suffix for _, suffix in ENCODINGS)
+        for path in dist_dir.rglob('*'):
+            if path.is_file() and str(path.relative_to(dist_dir)) not in keep:
+                path.unlink()
+    return manifest
+
+
+# --- 配信側 ---
+
+_lock = threading.Lock()
+_manifest: Dict[str, Dict[str, Any]] = {}
+_manifest_signature: Optional[Tuple[int, int]] = None
+
+
+def load_manifest(dist_dir: Path = DIST_DIR) -> Dict[str, Dict[str, Any]]:
+    """マニフェストを返す（ビルドし直されたら読み直す。未ビルドなら空）"""
+    global _manifest, _manifest_signature
+    path = dist_dir / MANIFEST_NAME
+    try:
+        st = path.stat()
+        signature: Optional[Tuple[int, int]] = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        signature = None
+    with _lock:
+        if signature != _manifest_signature:
+            if signature is None:
+                _manifest = {}
+            else:
+                with path.open('r', encoding='utf-8') as f:
+                    _manifest = json.load(f)
+            _manifest_signature = signature
+        return _manifest
+
+
+def hashed_file(name: str, dist_dir: Path = DIST_DIR) -> Optional[str]:
+    """元の名前に対応する配信ファイル名（dist/ からの相対パス）。未ビルドなら None"""
+    entry = load_manifest(dist_dir).get(name)
+    return entry['file'] if entry else None
+
+
+def choose_encoding(filename: str, accept_encoding: str, dist_dir: Path = DIST_DIR) -> Tuple[str, Optional[str]]:
+    """
+    Accept-Encoding に合う圧縮版があれば (圧縮版のパス, 'br'|'gzip')、無ければ (filename, None)。
+    q=0 で拒否されている形式は使わない。
+    """
+    accepted = set()
+    for part in (accept_encoding or '').lower().split(','):
+        token, _, params = part.strip().partition(';')
+        if not token:
+            continue
+        q = params.replace(' ', '')
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(token)
+    for encoding, suffix in ENCODINGS:
+        if (encoding in accepted or '*' in accepted) and (dist_dir / (filename + suffix)).is_file():
+            return filename + suffix, encoding
+    return filename, None
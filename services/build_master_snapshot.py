@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+from services.masters import SNAPSHOT_PATH, write_snapshot
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="顧客・商品・型式マスタをバイナリスナップショットに変換します（デプロイ時、マスタJSONの配置後に実行）。"
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=SNAPSHOT_PATH,
+        help="出力先（既定: data/masters.snapshot）",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    started = time.perf_counter()
+    sources = write_snapshot(args.output)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"スナップショットを作成しました: {args.output}（{elapsed_ms:.1f} ms）")
+    for name, info in sources.items():
+        print(f"- {name}: {info['size']:,} bytes sha256={info['sha256'][:12]}")
+
+
+if __name__ == "__main__":
+    # python -m services.build_master_snapshot
+    main()
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import csv
+import io
+from typing import Any, BinaryIO, Iterable, Iterator, List, Sequence, Tuple
+
+from openpyxl import Workbook
+
+# --- 見積・明細のエクスポート（CSV / XLSX） ---
+# 経理向けに、1行＝明細1行（見積の列は各行に繰り返す）の表を出力する。明細の無い見積は1行だけ出す。
+# 行はDBから順に受け取り、そのまま書き出すため、件数によらずメモリ使用量は一定。
+#
+# rows には EXPORT_FIELDS の順に値が並んだタプル（見積の列 → 明細の列）を渡す。
+# 原価を含めない場合（一般モード）は COST_FIELDS の列を出力しない。
+# 件名・顧客名などの文字列は、Excel で数式として実行されないよう _escape_text を通す。
+
+TAX_RATE = 0.10
+
+# (列名, 見出し)
+ESTIMATE_FIELDS: List[Tuple[str, str]] = [
+    ('estimate_id', '見積ID'),
+    ('created_at', '作成日時'),
+    ('title', '件名'),
+    ('customer_id', '顧客ID'),
+    ('customer_name', '顧客名'),
+    ('subtotal_price', '小計(税抜)'),
+    ('discount', '値引(税抜)'),
+    ('total_price', '合計(税抜)'),
+    ('subtotal_cost', '原価'),
+    ('gross_profit', '粗利'),
+    ('gross_margin_rate', '粗利率'),
+    ('operating_profit', '営業利益'),
+    ('material_cost', '材料費'),
+]
+ITEM_FIELDS: List[Tuple[str, str]] = [
+    ('product_code', '商品コード'),
+    ('product_name', '商品名'),
+    ('model_code', '型式コード'),
+    ('model_name', '型式名'),
+    ('quantity', '数量'),
+    ('unit_price', '単価'),
+    ('line_total_price', '金額'),
+    ('unit_cost', '原価単価'),
+    ('line_total_cost', '原価金額'),
+]
+EXPORT_FIELDS = [name for name, _ in ESTIMATE_FIELDS + ITEM_FIELDS]
+COST_FIELDS = frozenset({
+    'subtotal_cost',
+    'gross_profit',
+    'gross_margin_rate',
+    'operating_profit',
+    'material_cost',
+    'unit_cost',
+    'line_total_cost',
+})
+# 合計(税込) は保存値ではないため、合計(税抜) の直後に計算して出力する
+_TOTAL_INDEX = EXPORT_FIELDS.index('total_price')
+_CREATED_AT_INDEX = EXPORT_FIELDS.index('created_at')
+
+CSV_CHUNK_ROWS = 500
+
+# Excel で開いたときに数式として実行される先頭文字（CSV/数式インジェクション対策）
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _escape_text(value: Any) -> Any:
+    """数式として解釈される文字列の先頭に ' を付ける（文字列以外はそのまま）"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _layout(include_costs: bool) -> Tuple[List[str], List[int]]:
+    """(見出し, rows から取り出す列の位置)。合計(税込) の位置は -1"""
+    headers: List[str] = []
+    positions: List[int] = []
+    for i, (name, label) in enumerate(ESTIMATE_FIELDS + ITEM_FIELDS):
+        if not include_costs and name in COST_FIELDS:
+            continue
+        headers.append(label)
+        positions.append(i)
+        if i == _TOTAL_INDEX:
+            headers.append('合計(税込)')
+            positions.append(-1)
+    return headers, positions
+
+
+def _project(row: Sequence[Any], positions: List[int]) -> List[Any]:
+    values = []
+    for pos in positions:
+        if pos == -1:
+            values.append(round((row[_TOTAL_INDEX] or 0.0) * (1 + TAX_RATE)))
+        elif pos == _CREATED_AT_INDEX and row[pos] is not None:
+            values.append(row[pos].replace(microsecond=0))
+        else:
+            values.append(_escape_text(row[pos]))
+    return values
+
+
+def iter_csv(rows: Iterable[Sequence[Any]], include_costs: bool = False) -> Iterator[bytes]:
+    """CSV（UTF-8 BOM付き、Excel でそのまま開ける）を数百行ずつのバイト列として返す"""
+    headers, positions = _layout(include_costs)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(headers)
+    yield '\ufeff'.encode('utf-8') + buf.getvalue().encode('utf-8')
+    buf.seek(0)
+    buf.truncate()
+    pending = 0
+    for row in rows:
+        writer.writerow(_project(row, positions))
+        pending += 1
+        if pending >= CSV_CHUNK_ROWS:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+            pending = 0
+    if pending:
+        yield buf.getvalue().encode('utf-8')
+
+
+def write_xlsx(rows: Iterable[Sequence[Any]], fp: BinaryIO, include_costs: bool = False) -> int:
+    """XLSX を書き出す（write-only モードのため行はメモリに保持しない）。書き出した行数を返す"""
+    headers, positions = _layout(include_costs)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('見積明細')
+    ws.freeze_panes = 'A2'
+    ws.append(headers)
+    count = 0
+    for row in rows:
+        ws.append(_project(row, positions))
+        count += 1
+    wb.save(fp)
+    return count
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import csv
+import io
+import math
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.calculator import calculate_line_totals
+from services.masters import find_customer_by_id, find_model, find_product_by_code, get_models
+from services.material_cost import MATERIAL_CATEGORIES, calculate_material_breakdown
+from services.pricing_rules import price_estimate
+
+# --- 見積の一括取り込み ---
+# 過去の見積（Excel からの移行分など）を JSON / CSV から読み込み、マスタで検証したうえで
+# 画面からの登録（estimate_create）と同じ明細・合計計算を行う。DB への書き込みは app.py 側で行う。
+#
+# JSON: [{"title", "customer_id", "discount", "created_at", "items": [{"product_code", "model_code",
+#         "model_name", "quantity", "unit_price", "unit_cost"}, ...]}, ...]
+#       （{"estimates": [...]} 形式も可）
+# CSV : 1行＝明細1行。estimate_key が同じ行を1件の見積にまとめる（見積の列は先頭行の値を使う）
+#       estimate_key,title,customer_id,discount,created_at,product_code,model_code,model_name,quantity,unit_price,unit_cost
+# created_at は ISO 8601。時差付きの値は UTC に直して保存する（時差の無い値は UTC とみなす）。
+
+CSV_COLUMNS = [
+    'estimate_key',
+    'title',
+    'customer_id',
+    'discount',
+    'created_at',
+    'product_code',
+    'model_code',
+    'model_name',
+    'quantity',
+    'unit_price',
+    'unit_cost',
+]
+
+
+class ImportValidationError(ValueError):
+    pass
+
+
+@dataclass
+class RawEstimate:
+    row: int  # エラー報告用の位置（CSV は先頭行の行番号、JSON は1始まりの件番号）
+    key: str
+    data: Dict[str, Any]
+    items: List[Dict[str, Any]] = field(default_factory=list)
+
+
+@dataclass
+class PreparedEstimate:
+    row: int
+    key: str
+    values: Dict[str, Any]  # estimates の列
+    items: List[Dict[str, Any]]  # estimate_items の列（estimate_id を除く）
+
+
+def parse_json_estimates(payload: Any) -> List[RawEstimate]:
+    if isinstance(payload, dict):
+        payload = payload.get('estimates', [])
+    if not isinstance(payload, list):
+        raise ImportValidationError('JSON は見積の配列、または {"estimates": [...]} 形式で指定してください。')
+    raws = []
+    for i, entry in enumerate(payload, start=1):
+        if not isinstance(entry, dict):
+            entry = {}
+        items = entry.get('items') if isinstance(entry.get('items'), list) else []
+        raws.append(RawEstimate(row=i, key=str(entry.get('estimate_key') or i), data=entry, items=items))
+    return raws
+
+
+def parse_csv_estimates(text: str) -> List[RawEstimate]:
+    reader = csv.DictReader(io.StringIO(text.lstrip('\ufeff')))
+    missing = {'estimate_key', 'product_code'} - set(reader.fieldnames or [])
+    if missing:
+        raise ImportValidationError(f"CSV に必須の列がありません: {', '.join(sorted(missing))}")
+    by_key: Dict[str, RawEstimate] = {}
+    # 1行目は見出しのため、データ行は2行目から
+    for line_no, row in enumerate(reader, start=2):
+        key = (row.get('estimate_key') or '').strip()
+        raw = by_key.get(key)
+        if raw is None:
+            raw = by_key[key] = RawEstimate(row=line_no, key=key, data=row)
+        raw.items.append(row)
+    return list(by_key.values())
+
+
+def _to_float(value: Any, default: float, label: str) -> float:
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return default
+    try:
+        number = float(str(value).replace(',', ''))
+    except ValueError:
+        raise ImportValidationError(f'{label}が数値ではありません: {value}')
+    # nan / inf は合計・月次集計に入ると以降の計算がすべて壊れるため受け付けない
+    if not math.isfinite(number):
+        raise ImportValidationError(f'{label}が数値ではありません: {value}')
+    return number
+
+
+def _to_int(value: Any, default: int, label: str) -> int:
+    number = _to_float(value, float(default), label)
+    if not number.is_integer():
+        raise ImportValidationError(f'{label}が整数ではありません: {value}')
+    return int(number)
+
+
+def _to_datetime(value: Any) -> datetime:
+    """作成日時（UTC の naive datetime。画面からの登録の datetime.utcnow() と揃える）"""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return datetime.utcnow()
+    try:
+        created_at = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ImportValidationError(f'作成日時が ISO 8601 形式ではありません: {value}')
+    # 時差付き（例: +09:00）は UTC に直す。時差の無い値はそのまま（UTC とみなす）
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return created_at
+
+
+def _prepare_item(row: Any, position: int) -> Dict[str, Any]:
+    if not isinstance(row, dict):
+        raise ImportValidationError(f'明細{position}が明細の形式（オブジェクト）ではありません: {row!r}')
+    code = str(row.get('product_code') or '').strip()
+    product = find_product_by_code(code)
+    if not product:
+        raise ImportValidationError(f'明細{position}: 商品コードがマスタにありません: {code or "(空)"}')
+    model_code = str(row.get('model_code') or '').strip() or None
+    model = find_model(code, model_code) if model_code else None
+    # 型式マスタが定義されている商品は型式コードも検証する（安全対策費の足場種別など、定義の無い商品は自由入力）
+    if model_code and model is None and get_models().get(code):
+        raise ImportValidationError(f'明細{position}: 型式コードがマスタにありません: {code} / {model_code}')
+    source = model or product
+    quantity = _to_int(row.get('quantity'), 1, f'明細{position}の数量')
+    unit_price = _to_float(row.get('unit_price'), float(source.get('unit_price', 0.0)), f'明細{position}の単価')
+    unit_cost = _to_float(row.get('unit_cost'), float(source.get('unit_cost', 0.0)), f'明細{position}の原価')
+    line_total_price, line_total_cost = calculate_line_totals(quantity, unit_price, unit_cost)
+    return {
+        'product_code': product['code'],
+        'product_name': product['name'],
+        'model_code': model_code,
+        'model_name': (str(row.get('model_name') or '').strip() or (model or {}).get('name')) if model_code else None,
+        'quantity': quantity,
+        'unit_price': unit_price,
+        'unit_cost': unit_cost,
+        'line_total_price': line_total_price,
+        'line_total_cost': line_total_cost,
+    }
+
+
+def prepare_estimate(raw: RawEstimate) -> PreparedEstimate:
+    """
+    1件の見積を検証し、登録する列の値を計算する。不正な場合は ImportValidationError。
+    取り込みは過去見積の移行のため、値引は管理モードと同じく上限なしで扱う。
+    """
+    data = raw.data
+    title = str(data.get('title') or '').strip()
+    customer_id = str(data.get('customer_id') or '').strip()
+    if not title or not customer_id:
+        raise ImportValidationError('件名と顧客は必須です。')
+    customer = find_customer_by_id(customer_id)
+    if not customer:
+        raise ImportValidationError(f'顧客がマスタにありません: {customer_id}')
+    if not raw.items:
+        raise ImportValidationError('明細がありません。')
+
+    item_rows = [_prepare_item(row, i) for i, row in enumerate(raw.items, start=1)]
+    items = [SimpleNamespace(**row) for row in item_rows]
+    discount = _to_float(data.get('discount'), 0.0, '値引額')
+    pricing = price_estimate(items, discount=discount, is_admin_mode=True)
+    breakdown = calculate_material_breakdown(items)
+
+    values: Dict[str, Any] = {
+        'title': title,
+        'customer_id': customer['id'],
+        'customer_name': customer['name'],
+        'created_at': _to_datetime(data.get('created_at')),
+        'subtotal_price': pricing.subtotal_price,
+        'subtotal_cost': pricing.subtotal_cost,
+        'discount': pricing.discount,
+        'total_price': pricing.total_price,
+        'gross_profit': pricing.gross_profit,
+        'gross_margin_rate': pricing.gross_margin_rate,
+        'operating_profit': pricing.operating_profit,
+        'material_cost': breakdown['total'],
+    }
+    for key in MATERIAL_CATEGORIES:
+        values[f'material_{key}'] = breakdown[key]
+    # ルール適用後の原価を明細に反映
+    rows = [{**row, 'unit_cost': it.unit_cost, 'line_total_cost': it.line_total_cost} for row, it in zip(item_rows, items)]
+    return PreparedEstimate(row=raw.row, key=raw.key, values=values, items=rows)
+
+
+def prepare_estimates(raws: List[RawEstimate]) -> Tuple[List[PreparedEstimate], List[Dict[str, Any]]]:
+    """全件を検証し、(登録可能な見積, 行ごとのエラー) を返す"""
+    prepared: List[PreparedEstimate] = []
+    errors: List[Dict[str, Any]] = []
+    for raw in raws:
+        try:
+            prepared.append(prepare_estimate(raw))
+        except ImportValidationError as e:
+            errors.append({'row': raw.row, 'key': raw.key, 'error': str(e)})
+    return prepared, errors
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str]) -> str:
+    name = (filename or '').lower()
+    ctype = (content_type or '').lower()
+    if name.endswith('.csv') or 'csv' in ctype:
+        return 'csv'
+    return 'json'
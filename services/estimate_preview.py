@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import time
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from services.calculator import calculate_line_totals
+from services.masters import find_product_by_code, get_masters_version
+from services.material_cost import MATERIAL_CATEGORIES, calculate_material_breakdown
+from services.pricing_rules import get_pricing_rules, price_estimate
+
+# --- 入力中の見積のプレビュー計算 ---
+# 見積作成画面から明細の下書きを受け取り、保存時（estimate_create）と同じ計算で
+# 合計・粗利・営業利益・材料費を返す。DB には書き込まない。
+# 行の計算結果は (商品, 型式, 数量, 単価, 原価, マスタの版) をキーにメモ化する。
+# 入力のたびに送られる明細はほとんどが前回と同じ行なので、変わった行だけが計算される。
+
+LINE_CACHE_SIZE = 4096
+
+_LineKey = Tuple[str, str, int, float, float]
+
+
+@lru_cache(maxsize=LINE_CACHE_SIZE)
+def _line(product_code: str, model_code: str, quantity: int, unit_price: float, unit_cost: float, version: str):
+    """1行分の計算結果（マスタに無い商品は None）。version はキャッシュの無効化のためだけに使う"""
+    if not find_product_by_code(product_code):
+        return None
+    line_total_price, line_total_cost = calculate_line_totals(quantity, unit_price, unit_cost)
+    return (product_code, model_code or None, quantity, unit_price, unit_cost, line_total_price, line_total_cost)
+
+
+def _to_number(value: Any, cast, default):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def line_key(row: Dict[str, Any]) -> _LineKey:
+    """
+    JSON の明細を正規化したキーにする。数値に変換できない値は保存時（estimate_create）と同じく、
+    数量は 1、単価・原価は商品マスタの値にする（マスタに無い商品は 0.0。_line が None を返す）
+    """
+    code = str(row.get('product_code') or '').strip()
+    product = find_product_by_code(code) or {}
+    return (
+        code,
+        str(row.get('model_code') or '').strip(),
+        _to_number(row.get('quantity'), int, 1),
+        _to_number(row.get('unit_price'), float, float(product.get('unit_price', 0.0))),
+        _to_number(row.get('unit_cost'), float, float(product.get('unit_cost', 0.0))),
+    )
+
+
+def preview_estimate(rows: Sequence[Dict[str, Any]], discount: Any = 0.0, is_admin_mode: bool = False) -> Dict[str, Any]:
+    """明細の下書きから合計・利益・材料費を計算して JSON 化できる dict で返す"""
+    started = time.perf_counter()
+    version = f'{get_masters_version()}:{get_pricing_rules().version}'
+
+    items: List[SimpleNamespace] = []
+    positions: List[int] = []  # items の添字 → 受け取った明細の添字
+    for idx, row in enumerate(rows):
+        if not isinstance(row, dict):
+            continue
+        key = line_key(row)
+        if not key[0]:
+            continue
+        line = _line(*key, version)
+        if line is None:
+            continue
+        code, model_code, quantity, unit_price, unit_cost, line_total_price, line_total_cost = line
+        items.append(
+            SimpleNamespace(
+                product_code=code,
+                model_code=model_code,
+                quantity=quantity,
+                unit_price=unit_price,
+                unit_cost=unit_cost,
+                line_total_price=line_total_price,
+                line_total_cost=line_total_cost,
+            )
+        )
+        positions.append(idx)
+
+    pricing = price_estimate(items, discount=_to_number(discount, float, 0.0), is_admin_mode=is_admin_mode)
+    breakdown = calculate_material_breakdown(items)
+
+    total_price = pricing.total_price
+    subtotal_price = pricing.subtotal_price
+
+    def rate(value: float, base: float) -> float:
+        return value / base * 100.0 if base > 0 else 0.0
+
+    return {
+        'subtotal_price': subtotal_price,
+        'subtotal_cost': pricing.subtotal_cost,
+        'other_cost': pricing.other_cost,
+        'discount': pricing.discount,
+        'discount_capped': pricing.discount_capped,
+        'max_discount': pricing.max_discount,
+        'total_price': total_price,
+        'gross_profit': pricing.gross_profit,
+        'selling_expense': pricing.selling_expense,
+        'operating_profit': pricing.operating_profit,
+        'material_cost': breakdown['total'],
+        'material_breakdown': {key: breakdown[key] for key in MATERIAL_CATEGORIES},
+        # 率(%)：見積詳細画面と同じ分母（販管費率は小計、それ以外は合計(税抜)）
+        'rates': {
+            'discount': rate(pricing.discount, subtotal_price),
+            'material': rate(breakdown['total'], total_price),
+            'cost': rate(pricing.subtotal_cost, total_price),
+            'gross_margin': rate(pricing.gross_profit, total_price),
+            'selling_expense': rate(pricing.selling_expense, subtotal_price),
+            'operating_margin': rate(pricing.operating_profit, total_price),
+        },
+        # 価格ルールで原価単価が決まった行（受け取った明細の添字 → 原価単価）
+        'line_costs': {str(positions[i]): cost for i, cost in pricing.line_costs.items()},
+        'ignored_lines': len(rows) - len(items),
+        'version': version,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+def get_line_cache_stats() -> Dict[str, Optional[int]]:
+    info = _line.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'maxsize': info.maxsize}
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+from typing import Iterable, List, Optional
+
+from markupsafe import Markup, escape
+from sqlalchemy import bindparam, text
+
+# 見積の全文検索（SQLite FTS5 / trigram トークナイザ）
+# estimates_fts の rowid は estimates.id と一致させ、件名・顧客名・明細（商品/型式のコードと名称）を索引する。
+# 件名・顧客名と削除はトリガで同期する。明細はトリガで1行ずつ追記すると、そのたびに FTS の行全体を
+# 書き直すため（明細数の2乗の手間）、見積の明細を書き込んだ後に index_estimate_items でまとめて索引する。
+
+FTS_TABLE = 'estimates_fts'
+
+# trigram は3文字未満の語を MATCH できないため、その場合は LIKE 検索に切り替える
+MIN_TERM_LENGTH = 3
+
+# highlight()/snippet() の強調マーカー（HTMLエスケープ後に <mark> へ置換する）
+MARK_OPEN = '\x02'
+MARK_CLOSE = '\x03'
+
+# 1見積分の明細テキスト（estimate_items の列から作る）
+_ITEMS_TEXT = (
+    "group_concat(product_code || ' ' || product_name || ' ' || "
+    "coalesce(model_code, '') || ' ' || coalesce(model_name, ''), ' ')"
+)
+
+# 一度に索引する見積数（IN 句のパラメータ数の上限より小さくする）
+INDEX_CHUNK_SIZE = 500
+
+_DDL = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(title, customer_name, items, tokenize='trigram')",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS estimates_fts_ai AFTER INSERT ON estimates BEGIN
+      INSERT INTO {FTS_TABLE}(rowid, title, customer_name, items)
+      VALUES (new.id, new.title, new.customer_name, '');
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS estimates_fts_au AFTER UPDATE OF title, customer_name ON estimates BEGIN
+      UPDATE {FTS_TABLE} SET title = new.title, customer_name = new.customer_name WHERE rowid = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS estimates_fts_ad AFTER DELETE ON estimates BEGIN
+      DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    # 旧版の明細追記トリガ（index_estimate_items に置き換え）
+    "DROP TRIGGER IF EXISTS estimate_items_fts_ai",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS estimate_items_fts_ad AFTER DELETE ON estimate_items BEGIN
+      UPDATE {FTS_TABLE} SET items = coalesce((
+        SELECT {_ITEMS_TEXT} FROM estimate_items WHERE estimate_id = old.estimate_id
+      ), '') WHERE rowid = old.estimate_id;
+    END
+    """,
+]
+
+# 索引作成前から存在する見積を取り込む
+_BACKFILL = f"""
+INSERT INTO {FTS_TABLE}(rowid, title, customer_name, items)
+SELECT e.id, e.title, e.customer_name, coalesce((
+  SELECT {_ITEMS_TEXT} FROM estimate_items WHERE estimate_id = e.id
+), '')
+FROM estimates e
+"""
+
+_INDEX_ITEMS = text(f"""
+UPDATE {FTS_TABLE} SET items = coalesce((
+  SELECT {_ITEMS_TEXT} FROM estimate_items WHERE estimate_id = {FTS_TABLE}.rowid
+), '')
+WHERE rowid IN :ids
+""").bindparams(bindparam('ids', expanding=True))
+
+
+def ensure_search_index(session) -> bool:
+    """
+    FTS5 索引と同期トリガを作成する（既にあれば何もしない）。
+    SQLite が FTS5/trigram に対応していない場合は False を返す。
+    """
+    exists = session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': FTS_TABLE},
+    ).first()
+    try:
+        for i, ddl in enumerate(_DDL):
+            if i == 0 and exists:
+                continue
+            session.execute(text(ddl))
+        if not exists:
+            session.execute(text(_BACKFILL))
+        session.commit()
+    except Exception:
+        session.rollback()
+        return False
+    return True
+
+
+def index_estimate_items(session, estimate_ids: Iterable[int]) -> None:
+    """
+    見積の明細を索引に書き込む（見積1件につき1回。明細を INSERT した後、コミット前に呼ぶ）。
+    索引が無い（FTS5 非対応）場合は呼ばない。
+    """
+    ids = list(estimate_ids)
+    for start in range(0, len(ids), INDEX_CHUNK_SIZE):
+        session.execute(_INDEX_ITEMS, {'ids': ids[start:start + INDEX_CHUNK_SIZE]})
+
+
+def build_match_query(q: str) -> Optional[str]:
+    """
+    検索語を FTS5 の MATCH 式（語ごとのフレーズを AND 結合）に変換する。
+    trigram で扱えない短い語を含む場合は None を返す。
+    """
+    terms: List[str] = q.split()
+    if not terms or any(len(t) < MIN_TERM_LENGTH for t in terms):
+        return None
+    return ' AND '.join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def has_highlight(value: Optional[str]) -> bool:
+    """一致箇所を含むかどうか"""
+    return bool(value) and MARK_OPEN in value
+
+
+def render_highlight(value: Optional[str]) -> Markup:
+    """highlight()/snippet() の結果をエスケープし、一致箇所を <mark> で囲む"""
+    if not value:
+        return Markup('')
+    escaped = str(escape(value))
+    return Markup(escaped.replace(MARK_OPEN, '<mark>').replace(MARK_CLOSE, '</mark>'))
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, Optional
+
+# --- 描画済みHTML断片のキャッシュ ---
+# 見積は保存後に変更されないため、見積詳細の本文（明細表・サマリ）は一度描画すれば使い回せる。
+# プロセス内の LRU に (見積ID, 管理モード, テンプレートの版, 世代) をキーとして保持する。
+#
+# 世代：recost-estimates --apply のように保存済み見積を書き換える処理は、別プロセス（flask CLI）
+# から実行されるため、世代ファイルの mtime を更新して全プロセスのキャッシュを無効にする。
+# 世代の確認は stat 1回だけで、DB には問い合わせない。
+
+DEFAULT_MAXSIZE = 512
+
+_lock = threading.Lock()
+_fragments: 'OrderedDict[Hashable, str]' = OrderedDict()
+_maxsize = DEFAULT_MAXSIZE
+_generation_path: Optional[Path] = None
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+
+def configure(maxsize: int = DEFAULT_MAXSIZE, generation_path: Optional[Path] = None) -> None:
+    """上限件数と世代ファイルを設定する（アプリ起動時に1回）"""
+    global _maxsize, _generation_path
+    with _lock:
+        _maxsize = max(0, int(maxsize))
+        _generation_path = generation_path
+        while len(_fragments) > _maxsize:
+            _fragments.popitem(last=False)
+            _stats['evictions'] += 1
+
+
+def current_generation() -> int:
+    """世代（世代ファイルの mtime_ns。ファイルが無ければ 0）"""
+    if _generation_path is None:
+        return 0
+    try:
+        return _generation_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def bump_generation() -> None:
+    """全プロセスの断片キャッシュを無効にする（保存済み見積を書き換えた後に呼ぶ）"""
+    clear()
+    if _generation_path is not None:
+        _generation_path.parent.mkdir(parents=True, exist_ok=True)
+        _generation_path.touch()
+
+
+def get(key: Hashable) -> Optional[str]:
+    with _lock:
+        html = _fragments.get(key)
+        if html is None:
+            _stats['misses'] += 1
+            return None
+        _fragments.move_to_end(key)
+        _stats['hits'] += 1
+        return html
+
+
+def put(key: Hashable, html: str) -> None:
+    with _lock:
+        if _maxsize == 0:
+            return
+        _fragments[key] = html
+        _fragments.move_to_end(key)
+        while len(_fragments) > _maxsize:
+            _fragments.popitem(last=False)
+            _stats['evictions'] += 1
+
+
+def clear() -> None:
+    with _lock:
+        _fragments.clear()
+        _stats['invalidations'] += 1
+
+
+def get_stats() -> Dict[str, Any]:
+    with _lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return {
+            **_stats,
+            'size': len(_fragments),
+            'maxsize': _maxsize,
+            'hit_rate': round(_stats['hits'] / lookups, 4) if lookups else None,
+        }
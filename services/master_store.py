@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# --- 原価マスタの SQLite ストア ---
+# 原価マスタ（master.xlsx の製品マスタ、約1.4万行）を JSON 配列のまま読み込んで線形探索する代わりに、
+# 索引付きの SQLite DB に格納する（xlsx_to_json.py --sqlite で作成）。
+#   - 商品ＣＤ → B-tree 索引で検索
+#   - 商品名の部分一致 → FTS5 trigram 索引で候補を絞り、instr で大文字小文字まで一致を確認
+#     （FTS5 trigram が使えない SQLite では全件の instr にフォールバック）
+# 行の順序（row_no）は元のシート・行の順序。「最初に一致した行」は row_no の小さい行。
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_STORE_PATH = BASE_DIR / "data" / "cost_master.sqlite3"
+
+CODE_HEADER = "商品ＣＤ"
+NAME_HEADER = "商品名"
+COST_HEADER = "移動平均単価"
+
+_SCHEMA = [
+    """
+    CREATE TABLE cost_master (
+        row_no INTEGER PRIMARY KEY,
+        sheet TEXT NOT NULL,
+        code TEXT,
+        name TEXT NOT NULL DEFAULT '',
+        moving_avg_cost REAL,
+        data TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX ix_cost_master_code ON cost_master (code)",
+    "CREATE TABLE store_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+]
+_FTS_SCHEMA = (
+    "CREATE VIRTUAL TABLE cost_master_fts USING fts5("
+    "name, content='cost_master', content_rowid='row_no', tokenize='trigram')"
+)
+_INSERT = "INSERT INTO cost_master (sheet, code, name, moving_avg_cost, data) VALUES (?, ?, ?, ?, ?)"
+_BATCH_ROWS = 5000
+
+
+def parse_cost(value: Any) -> Optional[float]:
+    """移動平均単価を数値にする（"1,234" のようなカンマ付き文字列も可）。数値でなければ None"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    s = str(value).strip().replace(",", "")
+    if not s:
+        return None
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _row(sheet: str, record: Dict[str, Any]) -> Tuple[Any, ...]:
+    code = record.get(CODE_HEADER)
+    return (
+        sheet,
+        None if code is None else str(code).strip(),
+        str(record.get(NAME_HEADER) or ""),
+        parse_cost(record.get(COST_HEADER)),
+        json.dumps(record, ensure_ascii=False, separators=(",", ":")),
+    )
+
+
+def build_store(sheets: Iterable[Tuple[str, Iterable[Dict[str, Any]]]], path: Path = DEFAULT_STORE_PATH) -> Dict[str, int]:
+    """
+    (シート名, レコードの並び) からストアを作り直す。レコードは1件ずつ受け取って書き込む。
+    一時ファイルに作ってから置き換えるため、作成中も既存のストアはそのまま読める。
+    戻り値はシートごとの件数。
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.unlink(missing_ok=True)
+    counts: Dict[str, int] = {}
+    conn = sqlite3.connect(tmp_path)
+    try:
+        # 使い捨ての一時ファイルのため、作成中はジャーナル・同期を省く
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        for sheet, records in sheets:
+            batch: List[Tuple[Any, ...]] = []
+            counts[sheet] = 0
+            for record in records:
+                batch.append(_row(sheet, record))
+                if len(batch) >= _BATCH_ROWS:
+                    conn.executemany(_INSERT, batch)
+                    counts[sheet] += len(batch)
+                    batch.clear()
+            if batch:
+                conn.executemany(_INSERT, batch)
+                counts[sheet] += len(batch)
+        fts = True
+        try:
+            conn.execute(_FTS_SCHEMA)
+            conn.execute("INSERT INTO cost_master_fts (cost_master_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            # FTS5 / trigram 非対応の SQLite
+            fts = False
+        conn.execute("INSERT INTO store_meta (key, value) VALUES ('fts', ?)", ("1" if fts else "0",))
+        conn.commit()
+        conn.execute("VACUUM")
+    except BaseException:
+        conn.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    conn.close()
+    os.replace(tmp_path, path)
+    return counts
+
+
+@dataclass
+class CostMasterRow:
+    row_no: int
+    sheet: str
+    code: Optional[str]
+    name: str
+    moving_avg_cost: Optional[float]
+
+    def record(self, store: "MasterStore") -> Dict[str, Any]:
+        """元のレコード（全列）"""
+        return store.record(self.row_no)
+
+
+_SELECT = "SELECT row_no, sheet, code, name, moving_avg_cost FROM cost_master"
+
+
+class MasterStore:
+    """読み取り専用で開いた原価マスタストア"""
+
+    def __init__(self, path: Path = DEFAULT_STORE_PATH):
+        if not path.exists():
+            raise FileNotFoundError(f"原価マスタのDBが見つかりません: {path}（xlsx_to_json.py --sqlite で作成）")
+        self.path = path
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        meta = dict(self._conn.execute("SELECT key, value FROM store_meta"))
+        self.fts_enabled = meta.get("fts") == "1"
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "MasterStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def find_by_code(self, code: str) -> Optional[CostMasterRow]:
+        row = self._conn.execute(f"{_SELECT} WHERE code = ? ORDER BY row_no LIMIT 1", (str(code).strip(),)).fetchone()
+        return CostMasterRow(*row) if row else None
+
+    def _name_filter(self, text: str) -> Tuple[str, Tuple[Any, ...]]:
+        # trigram は3文字以上の語のみ索引を使える。大文字小文字を区別した一致は instr で確認する
+        if self.fts_enabled and len(text) >= 3:
+            phrase = '"' + text.replace('"', '""') + '"'
+            return (
+                "row_no IN (SELECT rowid FROM cost_master_fts WHERE cost_master_fts MATCH ?) AND instr(name, ?) > 0",
+                (phrase, text),
+            )
+        return "instr(name, ?) > 0", (text,)
+
+    def search_name(self, text: str, limit: int = 50) -> List[CostMasterRow]:
+        """商品名に text を含む行（元の行順）"""
+        if not text:
+            return []
+        where, params = self._name_filter(text)
+        rows = self._conn.execute(f"{_SELECT} WHERE {where} ORDER BY row_no LIMIT ?", (*params, limit)).fetchall()
+        return [CostMasterRow(*row) for row in rows]
+
+    def iter_name_costs(self) -> Iterator[Tuple[str, Optional[float]]]:
+        """(商品名, 移動平均単価) を元の行順に1件ずつ返す"""
+        yield from self._conn.execute("SELECT name, moving_avg_cost FROM cost_master ORDER BY row_no")
+
+    def record(self, row_no: int) -> Dict[str, Any]:
+        row = self._conn.execute("SELECT data FROM cost_master WHERE row_no = ?", (row_no,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def sheets(self) -> List[str]:
+        """格納したシート名（複数ブックの場合は '<ファイル名>/<シート名>'）を元の順に返す"""
+        rows = self._conn.execute("SELECT sheet FROM cost_master GROUP BY sheet ORDER BY min(row_no)")
+        return [row[0] for row in rows]
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT count(*) FROM cost_master").fetchone()[0]
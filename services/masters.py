@@ -1,11 +1,20 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import marshal
+import os
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 _BASE = Path(__file__).resolve().parent.parent
-_DATA = _BASE / 'data'
+# ESTIMATE_MASTERS_DIR でマスタJSONの置き場所を差し替えられる（ベンチマーク用の合成マスタなど）
+_DATA = Path(os.environ.get('ESTIMATE_MASTERS_DIR') or _BASE / 'data')
+SNAPSHOT_PATH = _DATA / 'masters.snapshot'
 
 
 def _read_json(path: Path):
@@ -15,26 +24,228 @@ def _read_json(path: Path):
         return json.load(f)
 
 
+# --- プロセス内キャッシュ ---
+# マスタJSONはプロセスごとに1回だけ読み込み、ファイルの mtime/サイズが
+# 変わったときだけ再読み込みする。戻り値はキャッシュ本体を共有するため、
+# 呼び出し側で変更しないこと。
+
+@dataclass
+class _CacheEntry:
+    signature: Optional[Tuple[int, int]]  # (mtime_ns, size)。ファイルが無い場合は None
+    data: Any
+    index: Dict[Any, Any] = field(default_factory=dict)
+    version: str = ''  # 元JSONの sha256（HTTPキャッシュの ETag に使う）
+    body: Optional[bytes] = None  # API 応答用のJSON（初回要求時に生成）
+
+
+_lock = threading.Lock()
+_entries: Dict[str, _CacheEntry] = {}
+_stats = {'hits': 0, 'misses': 0, 'reloads': 0, 'snapshot_loads': 0}
+# 読み込み（キャッシュのミス・再読み込み）ごとに (ファイル名, 秒) で呼ぶ関数（計測用）
+_load_listeners: List[Callable[[str, float], None]] = []
+
+
+def add_load_listener(callback: Callable[[str, float], None]) -> None:
+    """マスタを読み込むたびに callback(ファイル名, 秒) を呼ぶ（services/request_metrics.py 用）"""
+    _load_listeners.append(callback)
+
+
+def _signature(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _index_list_by(data: Any, key: str) -> Dict[str, Dict]:
+    index: Dict[str, Dict] = {}
+    if not isinstance(data, list):
+        return index
+    for row in data:
+        value = row.get(key) if isinstance(row, dict) else None
+        # 同じキーが複数ある場合は従来の線形探索と同じく先頭を優先
+        if value is not None and value not in index:
+            index[value] = row
+    return index
+
+
+def _index_models(data: Any) -> Dict[str, Dict[str, Dict]]:
+    index: Dict[str, Dict[str, Dict]] = {}
+    if not isinstance(data, dict):
+        return index
+    for product_code, models in data.items():
+        if isinstance(models, list):
+            index[product_code] = _index_list_by(models, 'code')
+    return index
+
+
+_INDEXERS = {
+    'customers.json': lambda data: _index_list_by(data, 'id'),
+    'products.json': lambda data: _index_list_by(data, 'code'),
+    'models.json': _index_models,
+}
+
+
+def _get_entry(filename: str) -> _CacheEntry:
+    path = _DATA / filename
+    signature = _signature(path)
+    with _lock:
+        entry = _entries.get(filename)
+        if entry is not None and entry.signature == signature:
+            _stats['hits'] += 1
+            return entry
+        _stats['misses' if entry is None else 'reloads'] += 1
+        started = time.perf_counter()
+        cached = _from_snapshot(filename, signature) if signature is not None else None
+        if cached is not None:
+            _stats['snapshot_loads'] += 1
+            data, index, version = cached
+        else:
+            raw = path.read_bytes() if signature is not None else b'[]'
+            data = json.loads(raw)
+            index = _INDEXERS[filename](data)
+            version = hashlib.sha256(raw).hexdigest()
+        entry = _CacheEntry(signature=signature, data=data, index=index, version=version)
+        _entries[filename] = entry
+        elapsed = time.perf_counter() - started
+        for callback in _load_listeners:
+            callback(filename, elapsed)
+        return entry
+
+
+# --- バイナリスナップショット ---
+# services/build_master_snapshot.py で各マスタを marshal 形式に変換したファイルを作っておくと、
+# JSON の解析を省いて読み込める（索引は読み込み後に作る）。marshal は dict/list/str/数値だけを
+# 復元する形式で、pickle と違い読み込み時に任意のコードが実行されることはない。
+# 書式: MAGIC(4) + 版数(uint16) + ヘッダ長(uint32) + ヘッダJSON + marshal本体
+# ヘッダには元JSONの (サイズ, mtime_ns) と sha256 を記録し、(サイズ, mtime_ns) が一致するマスタだけ
+# スナップショットから読む（元JSONは読み直さない。sha256 は版としてそのまま使う）。
+# チェックアウトなどで元JSONの mtime が変わると JSON から読むため、デプロイ時に作り直すこと。
+
+SNAPSHOT_MAGIC = b'QFMS'
+SNAPSHOT_VERSION = 2
+_SNAPSHOT_PREFIX = struct.Struct('<4sHI')
+# marshal の書式の版（4 は Python 3.4 以降で読める）
+_MARSHAL_VERSION = 4
+
+_snapshot_signature: Optional[Tuple[int, int]] = None
+_snapshot_sources: Dict[str, Dict[str, Any]] = {}
+_snapshot_payload: Optional[Dict[str, Any]] = None
+
+
+def write_snapshot(path: Path = SNAPSHOT_PATH) -> Dict[str, Dict[str, Any]]:
+    """
+    全マスタを JSON から読み込み、スナップショットに書き出す。
+    一時ファイルに書いてから置き換えるため、稼働中のワーカーが壊れたファイルを読むことはない。
+    戻り値は元JSONごとの {size, mtime_ns, sha256}。
+    """
+    sources: Dict[str, Dict[str, Any]] = {}
+    payload: Dict[str, Any] = {}
+    for filename in _INDEXERS:
+        src = _DATA / filename
+        signature = _signature(src)
+        if signature is None:
+            continue
+        raw = src.read_bytes()
+        sources[filename] = {
+            'size': signature[1],
+            'mtime_ns': signature[0],
+            'sha256': hashlib.sha256(raw).hexdigest(),
+        }
+        payload[filename] = json.loads(raw)
+
+    header = json.dumps({'sources': sources}, ensure_ascii=False).encode('utf-8')
+    body = marshal.dumps(payload, _MARSHAL_VERSION)
+    tmp = path.with_name(path.name + '.tmp')
+    with tmp.open('wb') as f:
+        f.write(_SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)))
+        f.write(header)
+        f.write(body)
+    tmp.replace(path)
+    return sources
+
+
+def _read_snapshot(path: Path) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+    raw = path.read_bytes()
+    magic, version, header_len = _SNAPSHOT_PREFIX.unpack_from(raw, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(f'未対応のスナップショットです: {path}')
+    offset = _SNAPSHOT_PREFIX.size
+    header = json.loads(raw[offset:offset + header_len].decode('utf-8'))
+    payload = marshal.loads(raw[offset + header_len:])
+    if not isinstance(payload, dict):
+        raise ValueError(f'スナップショットの内容が不正です: {path}')
+    return header.get('sources', {}), payload
+
+
+def _from_snapshot(filename: str, signature: Tuple[int, int]) -> Optional[Tuple[Any, Dict, str]]:
+    """
+    スナップショットの元JSONが signature（元JSONの (mtime_ns, サイズ)）と一致していれば
+    (data, index, sha256) を返す（_lock 内で呼ぶこと）
+    """
+    global _snapshot_signature, _snapshot_sources, _snapshot_payload
+    snapshot_signature = _signature(SNAPSHOT_PATH)
+    if snapshot_signature is None:
+        return None
+    if snapshot_signature != _snapshot_signature:
+        try:
+            _snapshot_sources, _snapshot_payload = _read_snapshot(SNAPSHOT_PATH)
+        except Exception:
+            # 壊れている・版数違いのスナップショットは使わずに JSON へフォールバック
+            _snapshot_sources, _snapshot_payload = {}, None
+        _snapshot_signature = snapshot_signature
+    source = _snapshot_sources.get(filename)
+    if not source or _snapshot_payload is None or filename not in _snapshot_payload:
+        return None
+    if (source.get('mtime_ns'), source.get('size')) != signature:
+        return None
+    data = _snapshot_payload[filename]
+    return data, _INDEXERS[filename](data), source['sha256']
+
+
+def preload() -> None:
+    """
+    全マスタをキャッシュに読み込んでおく。
+    gunicorn の --preload と組み合わせると、fork 前の親プロセスで一度だけ読み込み、
+    各ワーカーはそのメモリを copy-on-write で共有する。
+    """
+    for filename in _INDEXERS:
+        _get_entry(filename)
+
+
+def get_cache_stats() -> Dict[str, int]:
+    """キャッシュのヒット・ミス・再読み込み回数を返す（負荷時の確認用）"""
+    with _lock:
+        stats = dict(_stats)
+        stats['entries'] = len(_entries)
+    return stats
+
+
+def clear_cache() -> None:
+    """キャッシュと統計をすべて破棄する"""
+    global _snapshot_signature, _snapshot_sources, _snapshot_payload
+    with _lock:
+        _entries.clear()
+        _snapshot_signature, _snapshot_sources, _snapshot_payload = None, {}, None
+        for k in _stats:
+            _stats[k] = 0
+
+
 def get_customers() -> List[Dict]:
-    return _read_json(_DATA / 'customers.json')
+    return _get_entry('customers.json').data
 
 
 def get_products() -> List[Dict]:
-    return _read_json(_DATA / 'products.json')
+    return _get_entry('products.json').data
 
 
 def find_customer_by_id(customer_id: str) -> Optional[Dict]:
-    for c in get_customers():
-        if c.get('id') == customer_id:
-            return c
-    return None
+    return _get_entry('customers.json').index.get(customer_id)
 
 
 def find_product_by_code(code: str) -> Optional[Dict]:
-    for p in get_products():
-        if p.get('code') == code:
-            return p
-    return None
+    return _get_entry('products.json').index.get(code)
 
 
 def get_models() -> Dict[str, List[Dict]]:
@@ -42,7 +253,39 @@ def get_models() -> Dict[str, List[Dict]]:
     商品コードごとの型式配列を返す。
     戻り値は {product_code: [{code,name,unit_price,unit_cost}, ...], ...}
     """
-    path = _DATA / 'models.json'
-    data = _read_json(path)
+    data = _get_entry('models.json').data
     # models.jsonはdictを期待。存在しない/空の場合は空dictを返す
-    return data if isinstance(data, dict) else {}
\ No newline at end of file
+    return data if isinstance(data, dict) else {}
+
+
+def find_model(product_code: str, model_code: str) -> Optional[Dict]:
+    """商品コードと型式コードから型式を1件返す"""
+    return _get_entry('models.json').index.get(product_code, {}).get(model_code)
+
+
+# --- HTTP 配信用 ---
+# /api/masters/<name> で返すマスタ名と元ファイルの対応
+MASTER_FILES = {
+    'customers': 'customers.json',
+    'products': 'products.json',
+    'models': 'models.json',
+}
+
+
+def get_master_version(name: str) -> str:
+    """マスタの版（元JSONの sha256）を返す。未知の name は KeyError"""
+    return _get_entry(MASTER_FILES[name]).version
+
+
+def get_masters_version() -> str:
+    """全マスタをまとめた版。いずれかのマスタが変わると変わる"""
+    joined = ':'.join(get_master_version(name) for name in sorted(MASTER_FILES))
+    return hashlib.sha256(joined.encode('ascii')).hexdigest()
+
+
+def get_master_payload(name: str) -> Tuple[str, bytes]:
+    """(版, 圧縮形式のJSONバイト列) を返す。未知の name は KeyError"""
+    entry = _get_entry(MASTER_FILES[name])
+    if entry.body is None:
+        entry.body = json.dumps(entry.data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return entry.version, entry.body
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, Optional
+
+from services.pricing_rules import PricingRules, get_pricing_rules
+
+# --- 材料費の算出 ---
+# 見積は作成後に変更されないため、作成時に1回だけ計算して estimates の material_* 列に保存する。
+
+# 太陽光の部材品目（取付架台は SOL-007 / SOL-007R の両方を対象とする）
+SOLAR_MATERIAL_PRODUCT_CODES = frozenset({
+    'SOL-001',  # 太陽電池モジュール
+    'SOL-002',  # パワーコンディショナ
+    'SOL-003',  # カラーモニター
+    'SOL-004',  # 漏電遮断器
+    'SOL-005',  # 配線用遮断器
+    'SOL-006',  # 接続ユニット
+    'SOL-007',  # 取付架台
+    'SOL-007R',  # 取付架台（陸屋根）
+})
+
+# 蓄電池：パワーコンディショナ、漏電遮断器、配線用遮断器、蓄電池ユニット、自動切替開閉器、その他部材
+BATTERY_MATERIAL_PRODUCT_CODES = frozenset({
+    'BAT-001',  # パワーコンディショナ
+    'BAT-002',  # 漏電遮断器
+    'BAT-003',  # 配線用遮断器
+    'BAT-004',  # 蓄電池ユニット
+    'BAT-005',  # 自動切替開閉器
+    'BAT-006',  # その他部材
+})
+
+# 単機能V2H：本体搬入費、電気工事労務費、取付工事費、現場雑費、現場管理費 以外
+V2H_SINGLE_MATERIAL_PRODUCT_CODES = frozenset({
+    'V2H-001',  # V2H本体
+    'V2H-002',  # 設置部材セット
+    'V2H-003',  # 施工ケーブルセット
+    'V2H-005',  # その他部材費
+    'V2H-010',  # リモコンセット
+    'V2H-011',  # ケーブルカバー
+    'V2H-012',  # AC_CTケーブルセット
+    'V2H-013',  # CTセンサ（内径θ24）
+})
+
+# トライブリッドV2H：V2H本体、V2H通信ケーブル、その他部材、V2Hポッド用ポール
+V2H_HYBRID_MATERIAL_PRODUCT_CODES = frozenset({
+    'TVH-001',  # V2H本体
+    'TVH-002',  # V2H通信ケーブル
+    'TVH-004',  # その他部材
+    'TVH-007',  # V2Hポッド用ポール
+})
+
+SOLAR_ELECTRIC_PRODUCT_CODE = 'SOL-009'  # 電気工事費（電材費部分が材料費）
+SOLAR_POWERCON_PRODUCT_CODE = 'SOL-002'
+POWERCON_EXCHANGE_PRODUCT_CODE = 'PWR-001'
+# 電材費はSOL-009の原価ルールと同じ式（システム容量(kW)×単価 + 基本額）で求める
+SOLAR_ELECTRIC_RULE_ID = 'solar_electric_cost'
+# パワコン交換：設置工事費（PWR-003）・電気工事費（PWR-004）のうち、パワコン1台あたりの材料部分
+POWERCON_EXCHANGE_INSTALLATION_MATERIAL = 10600.0
+POWERCON_EXCHANGE_ELECTRIC_MATERIAL = 5000.0
+
+# 材料費対象として詳細画面で強調表示する商品コード
+MATERIAL_PRODUCT_CODES = (
+    SOLAR_MATERIAL_PRODUCT_CODES
+    | BATTERY_MATERIAL_PRODUCT_CODES
+    | V2H_SINGLE_MATERIAL_PRODUCT_CODES
+    | V2H_HYBRID_MATERIAL_PRODUCT_CODES
+    | {SOLAR_ELECTRIC_PRODUCT_CODE, POWERCON_EXCHANGE_PRODUCT_CODE}
+)
+
+_CATEGORY_BY_CODE: Dict[str, str] = {}
+for _codes, _category in (
+    (SOLAR_MATERIAL_PRODUCT_CODES, 'solar'),
+    (BATTERY_MATERIAL_PRODUCT_CODES, 'battery'),
+    (V2H_SINGLE_MATERIAL_PRODUCT_CODES, 'v2h_single'),
+    (V2H_HYBRID_MATERIAL_PRODUCT_CODES, 'v2h_hybrid'),
+    ({POWERCON_EXCHANGE_PRODUCT_CODE}, 'powercon_exchange'),
+):
+    for _code in _codes:
+        _CATEGORY_BY_CODE[_code] = _category
+
+# 内訳のキーと表示名（estimates の material_<key> 列に対応）
+MATERIAL_CATEGORIES = {
+    'solar': '太陽光',
+    'battery': '蓄電池',
+    'v2h_single': '単機能V2H',
+    'v2h_hybrid': 'トライブリッドV2H',
+    'powercon_exchange': 'パワコン交換',
+}
+
+
+def calculate_material_breakdown(items: Iterable[Any], rules: Optional[PricingRules] = None) -> Dict[str, float]:
+    """
+    明細から材料費の内訳を1回の走査で計算する。
+    戻り値は {'solar', 'battery', 'v2h_single', 'v2h_hybrid', 'powercon_exchange', 'total'}。
+    """
+    rules = rules or get_pricing_rules()
+    electric_rule = rules.get_rule(SOLAR_ELECTRIC_RULE_ID)
+    capacity = electric_rule.aggregate if electric_rule else None
+    capacity_kw = capacity.initial if capacity else 0.0
+
+    breakdown = {key: 0.0 for key in MATERIAL_CATEGORIES}
+    solar_powercon_count = 0
+    electric_line_qty = 0
+    powercon_exchange_count = 0
+    for it in items:
+        code = it.product_code
+        category = _CATEGORY_BY_CODE.get(code)
+        if category:
+            breakdown[category] += float(it.line_total_cost or 0.0)
+        if capacity and code == capacity.product_code:
+            capacity_kw = capacity.feed(capacity_kw, it)
+        if code == SOLAR_POWERCON_PRODUCT_CODE:
+            solar_powercon_count += int(it.quantity or 0)
+        elif code == SOLAR_ELECTRIC_PRODUCT_CODE:
+            electric_line_qty += int(it.quantity or 0)
+        elif code == POWERCON_EXCHANGE_PRODUCT_CODE:
+            powercon_exchange_count += int(it.quantity or 0)
+
+    # 電材費（電気工事費 SOL-009 のうち、電材部分）：システム容量(kW)×単価 + 基本額（見積単位）に行数（数量）を掛ける
+    if electric_rule and electric_line_qty > 0 and (capacity_kw > 0 or solar_powercon_count > 0):
+        per_kw = float(electric_rule.params.get('per_kw', 0.0))
+        base = float(electric_rule.params.get('base', 0.0))
+        breakdown['solar'] += (float(capacity_kw) * per_kw + base) * float(electric_line_qty)
+
+    # パワコン交換：設置工事費・電気工事費の材料部分（パワコン台数に比例）
+    if powercon_exchange_count > 0:
+        breakdown['powercon_exchange'] += powercon_exchange_count * POWERCON_EXCHANGE_INSTALLATION_MATERIAL
+        breakdown['powercon_exchange'] += powercon_exchange_count * POWERCON_EXCHANGE_ELECTRIC_MATERIAL
+
+    breakdown['total'] = sum(breakdown[key] for key in MATERIAL_CATEGORIES)
+    return breakdown
@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from services.calculator import calculate_line_totals
+from services.masters import get_master_version, get_models
+
+_BASE = Path(__file__).resolve().parent.parent
+RULES_PATH = _BASE / 'data' / 'pricing_rules.json'
+
+
+# --- 価格ルールエンジン ---
+# data/pricing_rules.json のルールを「マスタの版」ごとに1回だけコンパイルし、
+# 明細を1回走査するだけで全ルールの判定に必要な値を集計する。
+# 明細は product_code / model_code / quantity / line_total_price / line_total_cost /
+# unit_cost 属性を持つオブジェクト（EstimateItem など）を想定する。
+
+
+@dataclass(frozen=True)
+class _Aggregate:
+    """明細の走査中に product_code の行から値を集める集計器"""
+    key: Tuple[str, str]
+    product_code: str
+    initial: Any
+    feed: Callable[[Any, Any], Any]
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    id: str
+    description: str
+    target: str
+    aggregate: _Aggregate
+    # 集計値 → 対象行の原価単価。ルールが成立しない場合は None
+    unit_cost: Callable[[Any], Optional[float]]
+    params: Dict[str, Any] = field(default_factory=dict)  # ルールファイルの定義そのもの
+
+
+@dataclass(frozen=True)
+class PricingRules:
+    version: str
+    line_rules: Tuple[CompiledRule, ...]
+    aggregates: Tuple[_Aggregate, ...]
+    aggregates_by_product: Dict[str, Tuple[_Aggregate, ...]]
+    target_products: frozenset
+    other_cost_rate: float
+    selling_expense_rate: float
+    general_discount_cap_rate: float
+
+    def get_rule(self, rule_id: str) -> Optional[CompiledRule]:
+        for rule in self.line_rules:
+            if rule.id == rule_id:
+                return rule
+        return None
+
+
+@dataclass
+class RuleResult:
+    rule_id: str
+    fired: bool  # 条件が成立したか
+    applied_lines: int  # 原価を書き換えた行数
+    unit_cost: Optional[float]
+    elapsed_us: float
+
+
+@dataclass
+class PricingResult:
+    subtotal_price: float
+    subtotal_cost: float  # 「その他」原価を含む
+    other_cost: float
+    discount: float
+    discount_capped: bool
+    max_discount: Optional[int]  # 一般モードの値引上限（管理モードは None）
+    total_price: float
+    gross_profit: float
+    gross_margin_rate: float
+    selling_expense: float
+    operating_profit: float
+    # 明細の添字 → ルール適用後の原価単価（dry_run では明細を書き換えずここにだけ返す）
+    line_costs: Dict[int, float] = field(default_factory=dict)
+    rules: List[RuleResult] = field(default_factory=list)
+    elapsed_us: float = 0.0
+
+
+# --- ルール種別ごとのコンパイル ---
+
+def _first_model_aggregate(product_code: str) -> _Aggregate:
+    def feed(acc, it):
+        # 最初に型式が入力されている行を採用する
+        return acc or (it.model_code or '').strip() or None
+    return _Aggregate(('first_model', product_code), product_code, None, feed)
+
+
+def _capacity_aggregate(product_code: str) -> _Aggregate:
+    kw_by_model = {
+        m.get('code'): float(m.get('kw') or 0.0)
+        for m in get_models().get(product_code, [])
+        if isinstance(m, dict)
+    }
+
+    def feed(acc, it):
+        return acc + kw_by_model.get(it.model_code or '', 0.0) * float(it.quantity or 0)
+    return _Aggregate(('capacity_kw', product_code), product_code, 0.0, feed)
+
+
+def _compile_capacity_linear(spec: Dict[str, Any]) -> Tuple[_Aggregate, Callable[[Any], Optional[float]]]:
+    per_kw = float(spec['per_kw'])
+    base = float(spec.get('base', 0.0))
+    return _capacity_aggregate(spec['source_product']), (
+        lambda kw: kw * per_kw + base if kw > 0 else None
+    )
+
+
+def _compile_model_lookup(spec: Dict[str, Any]) -> Tuple[_Aggregate, Callable[[Any], Optional[float]]]:
+    table = {str(k): float(v) for k, v in spec['table'].items()}
+
+    def unit_cost(model_code):
+        value = table.get(model_code or '', 0.0)
+        return value if value > 0 else None
+    return _first_model_aggregate(spec['source_product']), unit_cost
+
+
+_RULE_TYPES = {
+    'capacity_linear': _compile_capacity_linear,
+    'model_lookup': _compile_model_lookup,
+}
+
+
+def compile_rules(config: Dict[str, Any], version: str = '') -> PricingRules:
+    line_rules: List[CompiledRule] = []
+    aggregates: Dict[Tuple[str, str], _Aggregate] = {}
+    for spec in config.get('line_rules', []):
+        compiler = _RULE_TYPES.get(spec.get('type'))
+        if compiler is None:
+            raise ValueError(f"未対応のルール種別です: {spec.get('type')}（{spec.get('id')}）")
+        aggregate, unit_cost = compiler(spec)
+        # 同じ集計（例：BAT-004 の型式）を使うルール同士で集計器を共有する
+        aggregate = aggregates.setdefault(aggregate.key, aggregate)
+        line_rules.append(
+            CompiledRule(
+                id=spec['id'],
+                description=spec.get('description', ''),
+                target=spec['target'],
+                aggregate=aggregate,
+                unit_cost=unit_cost,
+                params=dict(spec),
+            )
+        )
+
+    by_product: Dict[str, List[_Aggregate]] = {}
+    for aggregate in aggregates.values():
+        by_product.setdefault(aggregate.product_code, []).append(aggregate)
+
+    estimate_rules = config.get('estimate_rules', {})
+    return PricingRules(
+        version=version,
+        line_rules=tuple(line_rules),
+        aggregates=tuple(aggregates.values()),
+        aggregates_by_product={k: tuple(v) for k, v in by_product.items()},
+        target_products=frozenset(r.target for r in line_rules),
+        other_cost_rate=float(estimate_rules.get('other_cost_rate', 0.0)),
+        selling_expense_rate=float(estimate_rules.get('selling_expense_rate', 0.0)),
+        general_discount_cap_rate=float(estimate_rules.get('general_discount_cap_rate', 1.0)),
+    )
+
+
+_lock = threading.Lock()
+_compiled: Optional[PricingRules] = None
+
+
+def get_pricing_rules() -> PricingRules:
+    """
+    コンパイル済みルールを返す。ルールファイルか型式マスタが変わったときだけ再コンパイルする。
+    """
+    global _compiled
+    st = RULES_PATH.stat()
+    version = f"{st.st_mtime_ns}-{st.st_size}-{get_master_version('models')[:12]}"
+    with _lock:
+        if _compiled is None or _compiled.version != version:
+            with RULES_PATH.open('r', encoding='utf-8') as f:
+                _compiled = compile_rules(json.load(f), version=version)
+        return _compiled
+
+
+# --- 評価 ---
+
+def price_estimate(
+    items: Sequence[Any],
+    discount: float = 0.0,
+    is_admin_mode: bool = False,
+    dry_run: bool = False,
+    rules: Optional[PricingRules] = None,
+) -> PricingResult:
+    """
+    明細に原価ルールを適用し、小計・値引・粗利・営業利益を計算する。
+    dry_run=True の場合は明細を書き換えず、適用後の原価単価を line_costs に返す。
+    """
+    started = time.perf_counter()
+    rules = rules or get_pricing_rules()
+
+    # 1回の走査で：小計（売価）・行原価・ルールの集計値・ルール対象行を集める
+    state = {a.key: a.initial for a in rules.aggregates}
+    targets: Dict[str, List[int]] = {}
+    line_totals_cost: List[float] = []
+    subtotal_price = 0.0
+    for idx, it in enumerate(items):
+        code = it.product_code
+        subtotal_price += float(it.line_total_price or 0.0)
+        line_totals_cost.append(float(it.line_total_cost or 0.0))
+        for aggregate in rules.aggregates_by_product.get(code, ()):
+            state[aggregate.key] = aggregate.feed(state[aggregate.key], it)
+        if code in rules.target_products:
+            targets.setdefault(code, []).append(idx)
+
+    line_costs: Dict[int, float] = {}
+    results: List[RuleResult] = []
+    for rule in rules.line_rules:
+        rule_started = time.perf_counter()
+        unit_cost = rule.unit_cost(state[rule.aggregate.key])
+        applied = 0
+        if unit_cost is not None:
+            for idx in targets.get(rule.target, ()):
+                it = items[idx]
+                line_costs[idx] = unit_cost
+                # 数量は通常 1 だが、念のため数量を掛けて行原価を再計算
+                line_totals_cost[idx] = float(it.quantity or 0) * unit_cost
+                if not dry_run:
+                    it.unit_cost = unit_cost
+                    it.line_total_cost = line_totals_cost[idx]
+                applied += 1
+        results.append(
+            RuleResult(
+                rule_id=rule.id,
+                fired=unit_cost is not None,
+                applied_lines=applied,
+                unit_cost=unit_cost,
+                elapsed_us=(time.perf_counter() - rule_started) * 1e6,
+            )
+        )
+
+    # 「その他」原価（全見積タイプ共通）：① 小計(税抜) × 率 を原価に加算
+    other_cost = subtotal_price * rules.other_cost_rate
+    subtotal_cost = sum(line_totals_cost) + other_cost
+
+    discount = max(0.0, float(discount))
+    max_discount = None
+    discount_capped = False
+    # 一般モードの場合、値引額の上限は小計×上限率
+    if not is_admin_mode:
+        max_discount = int(subtotal_price * rules.general_discount_cap_rate)
+        if discount > max_discount:
+            discount = float(max_discount)
+            discount_capped = True
+
+    # 合計＝小計 − 値引（マイナスにはしない）
+    total_price = max(0.0, subtotal_price - discount)
+    # 粗利 = 合計税抜 − 原価、販管費 = 小計 × 率、営業利益 = 粗利 − 販管費
+    gross_profit = total_price - subtotal_cost
+    gross_margin_rate = gross_profit / total_price if total_price > 0 else 0.0
+    selling_expense = subtotal_price * rules.selling_expense_rate
+    operating_profit = gross_profit - selling_expense
+
+    return PricingResult(
+        subtotal_price=subtotal_price,
+        subtotal_cost=subtotal_cost,
+        other_cost=other_cost,
+        discount=discount,
+        discount_capped=discount_capped,
+        max_discount=max_discount,
+        total_price=total_price,
+        gross_profit=gross_profit,
+        gross_margin_rate=gross_margin_rate,
+        selling_expense=selling_expense,
+        operating_profit=operating_profit,
+        line_costs=line_costs,
+        rules=results,
+        elapsed_us=(time.perf_counter() - started) * 1e6,
+    )
+
+
+def items_from_dicts(rows: Sequence[Dict[str, Any]]) -> List[SimpleNamespace]:
+    """JSON の明細（product_code, model_code, quantity, unit_price, unit_cost）を評価用の行に変換する"""
+    items = []
+    for row in rows:
+        quantity = int(row.get('quantity') or 0)
+        unit_price = float(row.get('unit_price') or 0.0)
+        unit_cost = float(row.get('unit_cost') or 0.0)
+        line_total_price, line_total_cost = calculate_line_totals(quantity, unit_price, unit_cost)
+        items.append(
+            SimpleNamespace(
+                product_code=row.get('product_code', ''),
+                model_code=row.get('model_code') or None,
+                quantity=quantity,
+                unit_price=unit_price,
+                unit_cost=unit_cost,
+                line_total_price=line_total_price,
+                line_total_cost=line_total_cost,
+            )
+        )
+    return items
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="明細JSONに価格ルールを dry-run で適用し、成立したルールと所要時間を表示します。"
+    )
+    parser.add_argument(
+        "input",
+        type=Path,
+        help='{"items": [{"product_code", "model_code", "quantity", "unit_price", "unit_cost"}, ...], "discount": 0}',
+    )
+    parser.add_argument("--admin", action="store_true", help="管理モードとして計算する（値引上限なし）")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    with args.input.open("r", encoding="utf-8") as f:
+        payload = json.load(f)
+    items = items_from_dicts(payload.get("items", []))
+    result = price_estimate(items, payload.get("discount", 0.0), is_admin_mode=args.admin, dry_run=True)
+
+    print(f"ルール版: {get_pricing_rules().version}")
+    for r in result.rules:
+        mark = "成立" if r.fired else "不成立"
+        cost = f" 原価単価={r.unit_cost:,.0f}" if r.unit_cost is not None else ""
+        print(f"- {r.rule_id}: {mark} 適用行={r.applied_lines}{cost} ({r.elapsed_us:.1f} µs)")
+    print(f"小計 {result.subtotal_price:,.0f} / 原価 {result.subtotal_cost:,.0f} / 値引 {result.discount:,.0f}")
+    print(f"粗利 {result.gross_profit:,.0f}（{result.gross_margin_rate:.2%}） / 営業利益 {result.operating_profit:,.0f}")
+    print(f"評価時間: {result.elapsed_us:.1f} µs")
+
+
+if __name__ == "__main__":
+    # python -m services.pricing_rules items.json
+    main()
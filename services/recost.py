@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import csv
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from services.masters import get_models
+from services.material_cost import MATERIAL_CATEGORIES, _CATEGORY_BY_CODE
+from services.pricing_rules import get_pricing_rules
+
+# --- 保存済み見積の原価再計算 ---
+# update_models_unit_cost.py で models.json の unit_cost が更新された後、保存済みの見積明細に
+# 新しい型式原価を反映し、原価小計・粗利・粗利率・営業利益（と材料費内訳）を再計算する。
+# 明細は見積ID順に列単位でまとめて読み込み、NumPy の配列演算で一括計算する。
+#
+# 対象：型式が選択され、型式マスタに原価（> 0）がある明細のみ。
+#       価格ルールで原価が決まる商品（SOL-009・BAT-006/007 など）は対象外。
+#       型式の原価を画面で手入力した明細もマスタの原価で置き換わるため、先に差分（--report）を確認すること。
+# 粗利・営業利益は「原価の増減分」だけを差し引く（売価・値引・販管費は変わらないため）。
+
+_CATEGORY_KEYS = list(MATERIAL_CATEGORIES)
+
+_ESTIMATE_COLUMNS = (
+    ['id', 'title', 'subtotal_cost', 'total_price', 'gross_profit', 'gross_margin_rate', 'operating_profit']
+    + [f'material_{key}' for key in _CATEGORY_KEYS]
+    + ['material_cost']
+)
+
+
+@dataclass
+class EstimateDiff:
+    estimate_id: int
+    title: str
+    old_subtotal_cost: float
+    new_subtotal_cost: float
+    old_gross_profit: float
+    new_gross_profit: float
+    old_gross_margin_rate: float
+    new_gross_margin_rate: float
+    old_operating_profit: float
+    new_operating_profit: float
+    changed_items: int
+
+
+@dataclass
+class RecostReport:
+    applied: bool
+    estimates_scanned: int = 0
+    items_scanned: int = 0
+    estimates_changed: int = 0
+    items_changed: int = 0
+    total_cost_delta: float = 0.0
+    elapsed_sec: float = 0.0
+    diffs: List[EstimateDiff] = field(default_factory=list)
+
+
+def current_model_costs() -> Dict[Tuple[str, str], float]:
+    """(商品コード, 型式コード) → 型式マスタの原価。ルールで原価が決まる商品と原価0は除く"""
+    excluded = get_pricing_rules().target_products
+    costs: Dict[Tuple[str, str], float] = {}
+    for product_code, models in get_models().items():
+        if product_code in excluded or not isinstance(models, list):
+            continue
+        for m in models:
+            try:
+                cost = float(m.get('unit_cost') or 0.0)
+            except (TypeError, ValueError):
+                continue
+            if m.get('code') and cost > 0:
+                costs[(product_code, m['code'])] = cost
+    return costs
+
+
+def _lookup(keys: np.ndarray, table: Dict[Any, float], default: float) -> np.ndarray:
+    """keys の各要素を table で引く。重複の多い列なので一意な値だけを辞書で引いて展開する"""
+    if keys.size == 0:
+        return np.zeros(0)
+    uniques, inverse = np.unique(keys, return_inverse=True)
+    values = np.array([table.get(k, default) for k in uniques.tolist()], dtype=np.float64)
+    return values[inverse]
+
+
+def _recost_batch(session, estimates: List[Any], costs: Dict[str, float], report: RecostReport):
+    """見積1バッチ分の明細を読み込み、変更される明細と見積の新しい値を返す"""
+    first_id, last_id = estimates[0][0], estimates[-1][0]
+    rows = session.execute(
+        text(
+            "SELECT id, estimate_id, product_code, coalesce(model_code, ''), quantity, unit_cost, line_total_cost "
+            "FROM estimate_items WHERE estimate_id BETWEEN :first AND :last ORDER BY estimate_id"
+        ),
+        {'first': first_id, 'last': last_id},
+    ).all()
+    report.items_scanned += len(rows)
+    if not rows:
+        return [], []
+
+    item_ids, item_est_ids, product_codes, model_codes, qty, old_unit, old_line = zip(*rows)
+    item_ids = np.asarray(item_ids, dtype=np.int64)
+    item_est_ids = np.asarray(item_est_ids, dtype=np.int64)
+    product_codes = np.asarray(product_codes, dtype=str)
+    # calculate_line_totals と同じく、数量は整数に切り捨てて 0 未満は 0 として計算する
+    qty = np.maximum(np.trunc(np.asarray(qty, dtype=np.float64)), 0.0)
+    old_unit = np.asarray(old_unit, dtype=np.float64)
+    old_line = np.asarray(old_line, dtype=np.float64)
+    keys = np.char.add(np.char.add(product_codes, '\t'), np.asarray(model_codes, dtype=str))
+
+    # 新しい原価単価（対象外の明細は NaN）→ 変更される明細
+    new_unit = _lookup(keys, costs, np.nan)
+    changed = ~np.isnan(new_unit) & (new_unit != old_unit)
+    new_line = np.where(changed, qty * np.maximum(np.nan_to_num(new_unit), 0.0), old_line)
+    delta = new_line - old_line
+
+    # 見積ごと・材料費区分ごとに増減を集計
+    est_ids = np.asarray([e[0] for e in estimates], dtype=np.int64)
+    est_pos = np.searchsorted(est_ids, item_est_ids)
+    n = len(estimates)
+    cost_delta = np.bincount(est_pos, weights=delta, minlength=n)
+    changed_count = np.bincount(est_pos, weights=changed.astype(np.int64), minlength=n)
+    category = _lookup(product_codes, {c: _CATEGORY_KEYS.index(k) for c, k in _CATEGORY_BY_CODE.items()}, -1).astype(np.int64)
+    in_category = category >= 0
+    material_delta = np.bincount(
+        est_pos[in_category] * len(_CATEGORY_KEYS) + category[in_category],
+        weights=delta[in_category],
+        minlength=n * len(_CATEGORY_KEYS),
+    ).reshape(n, len(_CATEGORY_KEYS))
+
+    old = {col: np.asarray([e[i] if e[i] is not None else np.nan for e in estimates], dtype=np.float64)
+           for i, col in enumerate(_ESTIMATE_COLUMNS) if i >= 2}
+    new_subtotal_cost = old['subtotal_cost'] + cost_delta
+    new_gross_profit = old['gross_profit'] - cost_delta
+    new_margin = np.divide(
+        new_gross_profit, old['total_price'], out=np.zeros(n), where=old['total_price'] > 0
+    )
+    new_operating = old['operating_profit'] - cost_delta
+    new_material = {
+        key: old[f'material_{key}'] + material_delta[:, i] for i, key in enumerate(_CATEGORY_KEYS)
+    }
+    new_material_total = old['material_cost'] + material_delta.sum(axis=1)
+
+    item_updates = [
+        {'id': int(i), 'unit_cost': float(u), 'line_total_cost': float(l)}
+        for i, u, l in zip(item_ids[changed], new_unit[changed], new_line[changed])
+    ]
+    estimate_updates = []
+    for pos in np.flatnonzero(changed_count):
+        est = estimates[pos]
+        report.diffs.append(
+            EstimateDiff(
+                estimate_id=int(est[0]),
+                title=est[1],
+                old_subtotal_cost=float(old['subtotal_cost'][pos]),
+                new_subtotal_cost=float(new_subtotal_cost[pos]),
+                old_gross_profit=float(old['gross_profit'][pos]),
+                new_gross_profit=float(new_gross_profit[pos]),
+                old_gross_margin_rate=float(old['gross_margin_rate'][pos]),
+                new_gross_margin_rate=float(new_margin[pos]),
+                old_operating_profit=float(old['operating_profit'][pos]),
+                new_operating_profit=float(new_operating[pos]),
+                changed_items=int(changed_count[pos]),
+            )
+        )
+        values: Dict[str, Optional[float]] = {
+            'id': int(est[0]),
+            'subtotal_cost': float(new_subtotal_cost[pos]),
+            'gross_profit': float(new_gross_profit[pos]),
+            'gross_margin_rate': float(new_margin[pos]),
+            'operating_profit': float(new_operating[pos]),
+        }
+        # 材料費が未計算（NULL）の見積は NULL のまま（backfill-material-cost で再計算される）
+        for key in _CATEGORY_KEYS:
+            value = new_material[key][pos]
+            values[f'material_{key}'] = None if np.isnan(value) else float(value)
+        values['material_cost'] = None if np.isnan(new_material_total[pos]) else float(new_material_total[pos])
+        estimate_updates.append(values)
+
+    report.items_changed += len(item_updates)
+    report.estimates_changed += len(estimate_updates)
+    report.total_cost_delta += float(cost_delta.sum())
+    return item_updates, estimate_updates
+
+
+def recost_estimates(session, apply: bool = False, batch_size: int = 2000) -> RecostReport:
+    """
+    保存済みの全見積を型式マスタの現在の原価で再計算する。
+    apply=False は差分レポートのみ。apply=True は全件を1トランザクションで更新する。
+    """
+    started = time.perf_counter()
+    report = RecostReport(applied=apply)
+    costs = {f'{p}\t{m}': c for (p, m), c in current_model_costs().items()}
+    last_id = 0
+    try:
+        while True:
+            estimates = session.execute(
+                text(
+                    f"SELECT {', '.join(_ESTIMATE_COLUMNS)} FROM estimates "
+                    "WHERE id > :last ORDER BY id LIMIT :limit"
+                ),
+                {'last': last_id, 'limit': batch_size},
+            ).all()
+            if not estimates:
+                break
+            last_id = estimates[-1][0]
+            report.estimates_scanned += len(estimates)
+            item_updates, estimate_updates = _recost_batch(session, estimates, costs, report)
+            if apply and item_updates:
+                session.execute(
+                    text("UPDATE estimate_items SET unit_cost = :unit_cost, line_total_cost = :line_total_cost WHERE id = :id"),
+                    item_updates,
+                )
+                columns = [c for c in estimate_updates[0] if c != 'id']
+                session.execute(
+                    text(f"UPDATE estimates SET {', '.join(f'{c} = :{c}' for c in columns)} WHERE id = :id"),
+                    estimate_updates,
+                )
+        if apply:
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    report.elapsed_sec = time.perf_counter() - started
+    return report
+
+
+REPORT_COLUMNS = [
+    'estimate_id',
+    'title',
+    'changed_items',
+    'old_subtotal_cost',
+    'new_subtotal_cost',
+    'old_gross_profit',
+    'new_gross_profit',
+    'old_gross_margin_rate',
+    'new_gross_margin_rate',
+    'old_operating_profit',
+    'new_operating_profit',
+]
+
+
+def write_report_csv(report: RecostReport, fp) -> None:
+    """見積ごとの差分を CSV で書き出す（適用前の確認用）"""
+    writer = csv.writer(fp)
+    writer.writerow(REPORT_COLUMNS)
+    for diff in report.diffs:
+        writer.writerow([getattr(diff, col) for col in REPORT_COLUMNS])
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from flask import Flask, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+
+# --- リクエストごとの計測 ---
+# iPad で画面が遅いときに、時間がマスタJSONの読み込み・SQL・Jinja の描画のどこに掛かったかを見るため、
+#   - ルートごとの応答時間（ヒストグラム）
+#   - SQL の文数と時間（SQLAlchemy のエンジンイベント）
+#   - テンプレートごとの描画時間（Flask のシグナル）
+#   - マスタの読み込み時間（services/masters.py の読み込み通知）
+# をプロセス内に集計し、/admin/metrics で Prometheus のテキスト形式で返す。
+# SLOW_REQUEST_MS を設定すると、それを超えたリクエストを内訳付きでログに出す。
+# 集計はプロセスごと（gunicorn の複数ワーカーではワーカーごとの値になる）。
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+# 1リクエストあたりの SQL 文数
+SQL_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# url_rule に一致しない要求（404 など）はまとめて1系列にする（系列数が増え続けないように）
+UNMATCHED_ROUTE = '(unmatched)'
+
+
+class Histogram:
+    """Prometheus のヒストグラム（ラベルの組ごとに累積前のバケット件数・合計・件数）"""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        # 呼び出し側（RequestMetrics）のロック内で呼ぶ
+        series = self._series.get(labels)
+        if series is None:
+            # [バケット..., +Inf, 合計]
+            series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self._series.items()):
+            base = _format_labels(self.label_names, labels)
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names + ("le",), labels + (le,))} {cumulative:g}')
+            lines.append(f'{self.name}_sum{base} {series[-1]:.6f}')
+            lines.append(f'{self.name}_count{base} {cumulative:g}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], value: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.label_names, labels)} {value:g}')
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)) + '}'
+
+
+def format_gauges(prefix: str, help_text: str, values: Dict[str, Any]) -> List[str]:
+    """数値の dict（キャッシュの統計など）を {prefix}_{key} のゲージにする。数値以外は飛ばす"""
+    lines: List[str] = []
+    for key, value in values.items():
+        if isinstance(value, bool):
+            value = int(value)
+        if not isinstance(value, (int, float)):
+            continue
+        name = f'{prefix}_{key}'
+        lines += [f'# HELP {name} {help_text} ({key})', f'# TYPE {name} gauge', f'{name} {value:g}']
+    return lines
+
+
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.requests = Histogram(
+            'estimate_http_request_duration_seconds', 'Request latency by route', ('route', 'method', 'status')
+        )
+        self.sql_per_request = Histogram(
+            'estimate_http_request_sql_statements', 'SQL statements per request', ('route',), SQL_COUNT_BUCKETS
+        )
+        self.sql_statements = Counter('estimate_sql_statements_total', 'SQL statements executed', ('route',))
+        self.sql_seconds = Counter('estimate_sql_duration_seconds_total', 'Time spent in SQL statements', ('route',))
+        self.sql_duration = Histogram(
+            'estimate_sql_statement_duration_seconds', 'SQL statement latency', (), SQL_BUCKETS
+        )
+        self.templates = Histogram(
+            'estimate_template_render_duration_seconds', 'Jinja template render time', ('template',)
+        )
+        self.master_loads = Histogram(
+            'estimate_master_load_duration_seconds', 'Master JSON load time (cache miss or reload)', ('master',)
+        )
+        self.sqlite_locks = Counter(
+            'estimate_sqlite_lock_errors_total', 'Requests failed with "database is locked"', ('route',)
+        )
+
+    def observe_request(self, route: str, method: str, status: int, seconds: float, breakdown: Dict[str, float]) -> None:
+        with self._lock:
+            self.requests.observe((route, method, str(status)), seconds)
+            self.sql_per_request.observe((route,), breakdown['sql_count'])
+            self.sql_statements.inc((route,), breakdown['sql_count'])
+            self.sql_seconds.inc((route,), breakdown['sql_seconds'])
+
+    def observe_sql(self, seconds: float) -> None:
+        with self._lock:
+            self.sql_duration.observe((), seconds)
+
+    def observe_template(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.templates.observe((name,), seconds)
+
+    def observe_master_load(self, filename: str, seconds: float) -> None:
+        with self._lock:
+            self.master_loads.observe((filename,), seconds)
+
+    def observe_lock_error(self, route: str) -> None:
+        with self._lock:
+            self.sqlite_locks.inc((route,))
+
+    def render(self, extra: Iterable[str] = ()) -> str:
+        with self._lock:
+            lines = [
+                '# HELP estimate_process_start_time_seconds Start time of the metrics collector',
+                '# TYPE estimate_process_start_time_seconds gauge',
+                f'estimate_process_start_time_seconds {self.started_at:.3f}',
+            ]
+            for metric in (
+                self.requests,
+                self.sql_per_request,
+                self.sql_statements,
+                self.sql_seconds,
+                self.sql_duration,
+                self.templates,
+                self.master_loads,
+                self.sqlite_locks,
+            ):
+                lines += metric.render()
+        lines += list(extra)
+        return '\n'.join(lines) + '\n'
+
+
+metrics = RequestMetrics()
+
+
+def _breakdown() -> Optional[Dict[str, float]]:
+    """現在のリクエストの内訳（計測対象外の文脈では None）"""
+    if not has_request_context():
+        return None
+    return g.get('_request_metrics')
+
+
+def record_master_load(filename: str, seconds: float) -> None:
+    """services/masters.py の読み込み通知"""
+    metrics.observe_master_load(filename, seconds)
+    current = _breakdown()
+    if current is not None:
+        current['master_seconds'] += seconds
+
+
+def install(app: Flask, engine) -> None:
+    """リクエスト・SQL・テンプレートの計測を登録する（アプリ起動時に1回）"""
+
+    @app.before_request
+    def _start_request_metrics():
+        g._request_metrics = {
+            'started': time.perf_counter(),
+            'sql_count': 0,
+            'sql_seconds': 0.0,
+            'template_seconds': 0.0,
+            'master_seconds': 0.0,
+        }
+
+    @app.after_request
+    def _finish_request_metrics(response):
+        current = _breakdown()
+        if current is None:
+            return response
+        seconds = time.perf_counter() - current['started']
+        route = request.url_rule.rule if request.url_rule is not None else UNMATCHED_ROUTE
+        metrics.observe_request(route, request.method, response.status_code, seconds, current)
+        slow_ms = app.config.get('SLOW_REQUEST_MS')
+        if slow_ms is not None and seconds * 1000 >= float(slow_ms):
+            app.logger.warning(
+                '遅いリクエスト: %s %s %d %.1fms（SQL %d文 %.1fms / テンプレート %.1fms / マスタ読込 %.1fms）',
+                request.method,
+                request.full_path.rstrip('?'),
+                response.status_code,
+                seconds * 1000,
+                current['sql_count'],
+                current['sql_seconds'] * 1000,
+                current['template_seconds'] * 1000,
+                current['master_seconds'] * 1000,
+            )
+        return response
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_metrics_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('_metrics_started')
+        if not started:
+            return
+        seconds = time.perf_counter() - started.pop()
+        metrics.observe_sql(seconds)
+        current = _breakdown()
+        if current is not None:
+            current['sql_count'] += 1
+            current['sql_seconds'] += seconds
+
+    @event.listens_for(engine, 'handle_error')
+    def _handle_error(context):
+        # 失敗した文は after_cursor_execute が呼ばれないため、開始時刻だけ捨てる
+        if context.connection is not None:
+            started = context.connection.info.get('_metrics_started')
+            if started:
+                started.pop()
+
+    def _before_render(sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault('_template_started', []).append(time.perf_counter())
+
+    def _rendered(sender, template, context, **extra):
+        stack = g.get('_template_started') if has_request_context() else None
+        if not stack:
+            return
+        seconds = time.perf_counter() - stack.pop()
+        metrics.observe_template(template.name or '(string)', seconds)
+        current = _breakdown()
+        if current is not None:
+            current['template_seconds'] += seconds
+
+    before_render_template.connect(_before_render, app, weak=False)
+    template_rendered.connect(_rendered, app, weak=False)
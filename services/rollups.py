@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import text
+
+# --- 売上・利益の月次集計（ロールアップ） ---
+# 見積の登録と同じトランザクションで、月×顧客・月×商品種別の集計表に加算する。
+# ダッシュボードは集計表だけを読むため、見積の件数によらず一定の時間で表示できる。
+#
+# 商品種別の金額は、見積の合計(税抜)・粗利・営業利益を明細の売価（金額）の比率で按分する。
+# （例：小計のうち太陽光の明細が 60% なら、合計・粗利・営業利益の 60% を太陽光に計上）
+# 件数は、その種別の明細を含む見積の数。
+#
+# 月は created_at（UTC で保存）で区切る。日本時間では毎月1日 09:00 が月の境目になる
+# （1日 0:00〜8:59 に作成した見積は前月に入る）。
+
+CUSTOMER_TABLE = 'estimate_rollup_customer_monthly'
+PRODUCT_TYPE_TABLE = 'estimate_rollup_product_type_monthly'
+
+# 商品コードの接頭辞 → 商品種別
+PRODUCT_TYPES = {
+    'solar': '太陽光',
+    'battery': '蓄電池',
+    'v2h': 'V2H',
+    'powercon': 'パワコン交換',
+    'other': 'その他',
+}
+_TYPE_BY_PREFIX = {
+    'SOL': 'solar',
+    'BAT': 'battery',
+    'V2H': 'v2h',
+    'TVH': 'v2h',
+    'PWR': 'powercon',
+}
+MEASURES = ('total_price', 'gross_profit', 'operating_profit')
+
+_SCHEMA = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {CUSTOMER_TABLE} (
+        month VARCHAR(7) NOT NULL,
+        customer_id VARCHAR(64) NOT NULL,
+        customer_name VARCHAR(255) NOT NULL,
+        estimate_count INTEGER NOT NULL DEFAULT 0,
+        total_price FLOAT NOT NULL DEFAULT 0.0,
+        gross_profit FLOAT NOT NULL DEFAULT 0.0,
+        operating_profit FLOAT NOT NULL DEFAULT 0.0,
+        PRIMARY KEY (month, customer_id)
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {PRODUCT_TYPE_TABLE} (
+        month VARCHAR(7) NOT NULL,
+        product_type VARCHAR(16) NOT NULL,
+        estimate_count INTEGER NOT NULL DEFAULT 0,
+        total_price FLOAT NOT NULL DEFAULT 0.0,
+        gross_profit FLOAT NOT NULL DEFAULT 0.0,
+        operating_profit FLOAT NOT NULL DEFAULT 0.0,
+        PRIMARY KEY (month, product_type)
+    )
+    """,
+]
+
+_UPSERT_CUSTOMER = text(
+    f"""
+    INSERT INTO {CUSTOMER_TABLE}
+        (month, customer_id, customer_name, estimate_count, total_price, gross_profit, operating_profit)
+    VALUES (:month, :customer_id, :customer_name, :estimate_count, :total_price, :gross_profit, :operating_profit)
+    ON CONFLICT (month, customer_id) DO UPDATE SET
+        customer_name = excluded.customer_name,
+        estimate_count = estimate_count + excluded.estimate_count,
+        total_price = total_price + excluded.total_price,
+        gross_profit = gross_profit + excluded.gross_profit,
+        operating_profit = operating_profit + excluded.operating_profit
+    """
+)
+_UPSERT_PRODUCT_TYPE = text(
+    f"""
+    INSERT INTO {PRODUCT_TYPE_TABLE}
+        (month, product_type, estimate_count, total_price, gross_profit, operating_profit)
+    VALUES (:month, :product_type, :estimate_count, :total_price, :gross_profit, :operating_profit)
+    ON CONFLICT (month, product_type) DO UPDATE SET
+        estimate_count = estimate_count + excluded.estimate_count,
+        total_price = total_price + excluded.total_price,
+        gross_profit = gross_profit + excluded.gross_profit,
+        operating_profit = operating_profit + excluded.operating_profit
+    """
+)
+
+
+@dataclass
+class EstimateFacts:
+    """集計に必要な見積の値（Estimate・取り込みの列の dict のどちらからでも作る）"""
+    created_at: datetime
+    customer_id: str
+    customer_name: str
+    total_price: float
+    gross_profit: float
+    operating_profit: float
+    # (商品コード, 明細の金額)
+    lines: List[Tuple[str, float]] = field(default_factory=list)
+
+
+def product_type_of(product_code: str) -> str:
+    return _TYPE_BY_PREFIX.get((product_code or '').split('-', 1)[0], 'other')
+
+
+def facts_from_estimate(est: Any, items: Iterable[Any] = None) -> EstimateFacts:
+    items = est.items if items is None else items
+    return EstimateFacts(
+        created_at=est.created_at or datetime.utcnow(),
+        customer_id=est.customer_id,
+        customer_name=est.customer_name,
+        total_price=float(est.total_price or 0.0),
+        gross_profit=float(est.gross_profit or 0.0),
+        operating_profit=float(est.operating_profit or 0.0),
+        lines=[(it.product_code, float(it.line_total_price or 0.0)) for it in items],
+    )
+
+
+def facts_from_values(values: Dict[str, Any], items: Sequence[Dict[str, Any]]) -> EstimateFacts:
+    return EstimateFacts(
+        created_at=values['created_at'],
+        customer_id=values['customer_id'],
+        customer_name=values['customer_name'],
+        total_price=float(values['total_price'] or 0.0),
+        gross_profit=float(values['gross_profit'] or 0.0),
+        operating_profit=float(values['operating_profit'] or 0.0),
+        lines=[(it['product_code'], float(it['line_total_price'] or 0.0)) for it in items],
+    )
+
+
+def _type_shares(facts: EstimateFacts) -> Dict[str, float]:
+    """商品種別 → 売価の比率。売価の無い見積は種別ごとに均等に按分する（明細が無ければ「その他」）"""
+    by_type: Dict[str, float] = {}
+    for code, price in facts.lines:
+        ptype = product_type_of(code)
+        by_type[ptype] = by_type.get(ptype, 0.0) + price
+    if not by_type:
+        return {'other': 1.0}
+    total = sum(by_type.values())
+    if total <= 0:
+        return {ptype: 1.0 / len(by_type) for ptype in by_type}
+    return {ptype: price / total for ptype, price in by_type.items()}
+
+
+def _accumulate(facts_list: Iterable[EstimateFacts]):
+    """見積の並びを (月, 顧客)・(月, 種別) ごとに合算する（1件ずつ UPSERT しないため）"""
+    customers: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    types: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for facts in facts_list:
+        month = facts.created_at.strftime('%Y-%m')  # UTC の月
+        row = customers.setdefault(
+            (month, facts.customer_id),
+            {'month': month, 'customer_id': facts.customer_id, 'estimate_count': 0, **{m: 0.0 for m in MEASURES}},
+        )
+        row['customer_name'] = facts.customer_name
+        row['estimate_count'] += 1
+        for m in MEASURES:
+            row[m] += getattr(facts, m)
+        for ptype, share in _type_shares(facts).items():
+            row = types.setdefault(
+                (month, ptype),
+                {'month': month, 'product_type': ptype, 'estimate_count': 0, **{m: 0.0 for m in MEASURES}},
+            )
+            row['estimate_count'] += 1
+            for m in MEASURES:
+                row[m] += getattr(facts, m) * share
+    return list(customers.values()), list(types.values())
+
+
+def ensure_rollup_tables(session) -> bool:
+    """集計表が無ければ作る。新しく作った場合は True（既存の見積を rebuild_rollups で集計すること）"""
+    existing = {
+        r[0]
+        for r in session.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN (:a, :b)"),
+            {'a': CUSTOMER_TABLE, 'b': PRODUCT_TYPE_TABLE},
+        )
+    }
+    for statement in _SCHEMA:
+        session.execute(text(statement))
+    return len(existing) < 2
+
+
+def add_to_rollups(session, facts_list: Iterable[EstimateFacts]) -> None:
+    """集計表に加算する。コミットは呼び出し側（見積の登録と同じトランザクション）"""
+    customer_rows, type_rows = _accumulate(facts_list)
+    if customer_rows:
+        session.execute(_UPSERT_CUSTOMER, customer_rows)
+    if type_rows:
+        session.execute(_UPSERT_PRODUCT_TYPE, type_rows)
+
+
+def rebuild_rollups(session, batch_size: int = 2000) -> int:
+    """集計表を全見積から作り直す（コミットは呼び出し側）。処理した見積数を返す"""
+    session.execute(text(f'DELETE FROM {CUSTOMER_TABLE}'))
+    session.execute(text(f'DELETE FROM {PRODUCT_TYPE_TABLE}'))
+    total = 0
+    last_id = 0
+    while True:
+        estimates = session.execute(
+            text(
+                "SELECT id, created_at, customer_id, customer_name, total_price, "
+                "gross_profit, operating_profit FROM estimates WHERE id > :last ORDER BY id LIMIT :limit"
+            ),
+            {'last': last_id, 'limit': batch_size},
+        ).all()
+        if not estimates:
+            break
+        first_id, last_id = estimates[0][0], estimates[-1][0]
+        lines: Dict[int, List[Tuple[str, float]]] = {}
+        for estimate_id, code, price in session.execute(
+            text(
+                "SELECT estimate_id, product_code, line_total_price FROM estimate_items "
+                "WHERE estimate_id BETWEEN :first AND :last"
+            ),
+            {'first': first_id, 'last': last_id},
+        ):
+            lines.setdefault(estimate_id, []).append((code, float(price or 0.0)))
+        add_to_rollups(
+            session,
+            (
+                EstimateFacts(
+                    created_at=_to_datetime(row[1]),
+                    customer_id=row[2],
+                    customer_name=row[3],
+                    total_price=float(row[4] or 0.0),
+                    gross_profit=float(row[5] or 0.0),
+                    operating_profit=float(row[6] or 0.0),
+                    lines=lines.get(row[0], []),
+                )
+                for row in estimates
+            ),
+        )
+        total += len(estimates)
+    return total
+
+
+def _to_datetime(value: Any) -> datetime:
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def _last_months(n: int, now: datetime = None) -> List[str]:
+    """今月（UTC）までの直近 n か月（'YYYY-MM'、古い順）"""
+    now = now or datetime.utcnow()
+    index = now.year * 12 + now.month - 1
+    return [f'{i // 12:04d}-{i % 12 + 1:02d}' for i in range(index - n + 1, index + 1)]
+
+
+def load_dashboard(session, months: int = 12) -> Dict[str, Any]:
+    """直近 months か月分の集計（月ごとの合計・種別ごと・顧客ごとの上位）を集計表から読む。
+    見積の無い月も 0 件の行として返す"""
+    month_list = _last_months(months)
+    window = {'since': month_list[0], 'until': month_list[-1]}
+
+    by_month = {
+        r.month: dict(r._mapping)
+        for r in session.execute(
+            text(
+                f"SELECT month, sum(estimate_count) AS estimate_count, sum(total_price) AS total_price, "
+                f"sum(gross_profit) AS gross_profit, sum(operating_profit) AS operating_profit "
+                f"FROM {CUSTOMER_TABLE} WHERE month BETWEEN :since AND :until GROUP BY month ORDER BY month"
+            ),
+            window,
+        )
+    }
+    monthly = [
+        by_month.get(month) or {'month': month, 'estimate_count': 0, **{m: 0.0 for m in MEASURES}}
+        for month in month_list
+    ]
+    product_types: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for r in session.execute(
+        text(
+            f"SELECT month, product_type, estimate_count, total_price, gross_profit, operating_profit "
+            f"FROM {PRODUCT_TYPE_TABLE} WHERE month BETWEEN :since AND :until ORDER BY month"
+        ),
+        window,
+    ):
+        product_types.setdefault(r.product_type, {})[r.month] = dict(r._mapping)
+    top_customers = [
+        dict(r._mapping)
+        for r in session.execute(
+            text(
+                f"SELECT customer_id, max(customer_name) AS customer_name, sum(estimate_count) AS estimate_count, "
+                f"sum(total_price) AS total_price, sum(gross_profit) AS gross_profit, "
+                f"sum(operating_profit) AS operating_profit "
+                f"FROM {CUSTOMER_TABLE} WHERE month BETWEEN :since AND :until "
+                f"GROUP BY customer_id ORDER BY total_price DESC LIMIT 20"
+            ),
+            window,
+        )
+    ]
+    return {'months': month_list, 'monthly': monthly, 'product_types': product_types, 'top_customers': top_customers}
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Mapping, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# --- SQLite の接続設定 ---
+# 既定の SQLite はロールバックジャーナル（書き込み中は読み込みも待たされる）で、
+# ビジータイムアウトも無いため、同時アクセス時に "database is locked" になりやすい。
+# 接続ごとに以下の PRAGMA を設定する（app.config['SQLITE_PRAGMAS'] で上書き可）。
+#
+#   journal_mode=WAL      … 書き込み中も読み込みを止めない（DBファイル単位で永続）
+#   synchronous=NORMAL    … WAL では NORMAL でも破損しない（電源断時に直近のコミットを失う可能性のみ）
+#   busy_timeout          … ロック待ちの上限(ms)。超えると "database is locked"
+#   cache_size            … 負の値は KiB 単位（-16000 ≒ 16MB）
+#   mmap_size             … 読み込みをメモリマップで行う上限(バイト)
+#   temp_store=MEMORY     … ソート・一時テーブルをメモリ上で行う
+
+DEFAULT_PRAGMAS: Dict[str, Any] = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -16000,
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# 一覧・詳細・検索・集計で使う索引（名前, テーブル, 列）
+HOT_PATH_INDEXES = [
+    # 一覧のキーセットページング（created_at DESC, id DESC）
+    ('ix_estimates_created_at_id', 'estimates', ('created_at', 'id')),
+    # 顧客ごとの見積（顧客別の集計・絞り込み）
+    ('ix_estimates_customer_id_created_at', 'estimates', ('customer_id', 'created_at')),
+    # 詳細・エクスポート・FTS トリガでの明細の取得
+    ('ix_estimate_items_estimate_id', 'estimate_items', ('estimate_id',)),
+]
+
+
+def pragma_statements(pragmas: Optional[Mapping[str, Any]] = None) -> List[str]:
+    pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+    return [f'PRAGMA {name}={value}' for name, value in pragmas.items()]
+
+
+def index_statements() -> List[str]:
+    return [
+        f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+        for name, table, columns in HOT_PATH_INDEXES
+    ]
+
+
+def apply_pragmas(dbapi_connection, pragmas: Optional[Mapping[str, Any]] = None) -> None:
+    """sqlite3 の接続に PRAGMA を設定する"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for statement in pragma_statements(pragmas):
+            cursor.execute(statement)
+    finally:
+        cursor.close()
+
+
+def install(engine: Engine, pragmas: Optional[Mapping[str, Any]] = None) -> bool:
+    """
+    engine の新しい接続すべてに PRAGMA を設定する。SQLite 以外の engine では何もしない。
+    既に確立済みのプール内の接続には効かないため、最初の接続より前に呼ぶこと。
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+    pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+
+    return True
@@ -1,9 +1,15 @@
 from __future__ import annotations
 
+import argparse
 import json
+import time
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
+from services.master_store import MasterStore, parse_cost as _parse_cost
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / "data"
@@ -16,46 +22,147 @@ def _load_json(path: Path) -> Any:
         return json.load(f)
 
 
-def _parse_cost(value: Any) -> Optional[float]:
-    if value is None:
-        return None
-    if isinstance(value, (int, float)):
-        return float(value)
-    s = str(value).strip().replace(",", "")
-    if not s:
-        return None
-    try:
-        return float(s)
-    except ValueError:
-        return None
+def _normalize(text: str) -> str:
+    # 原価マスタの商品名は全角・半角が混在する（例: ＣＶ・ＣＶＴ）ため NFKC で揃えてから照合する
+    return unicodedata.normalize("NFKC", text)
+
+
+@dataclass
+class _Automaton:
+    """Aho-Corasick のオートマトン（ノード番号で表した遷移・失敗リンク・出力）"""
+    goto: List[Dict[str, int]]
+    fail: List[int]
+    out: List[List[int]]
+    patterns: List[str]
+
+
+def _build_automaton(patterns: List[str]) -> _Automaton:
+    goto: List[Dict[str, int]] = [{}]
+    out: List[List[int]] = [[]]
+    for index, pattern in enumerate(patterns):
+        node = 0
+        for ch in pattern:
+            nxt = goto[node].get(ch)
+            if nxt is None:
+                nxt = len(goto)
+                goto[node][ch] = nxt
+                goto.append({})
+                out.append([])
+            node = nxt
+        out[node].append(index)
+
+    fail = [0] * len(goto)
+    queue = deque(goto[0].values())
+    while queue:
+        node = queue.popleft()
+        for ch, nxt in goto[node].items():
+            queue.append(nxt)
+            f = fail[node]
+            while f and ch not in goto[f]:
+                f = fail[f]
+            fail[nxt] = goto[f].get(ch, 0)
+            # 失敗先で終わるパターンもこのノードで一致している
+            out[nxt].extend(out[fail[nxt]])
+    return _Automaton(goto, fail, out, patterns)
+
+
+def _iter_matches(automaton: _Automaton, text: str) -> Iterator[int]:
+    """text に含まれるパターンの番号（重複あり）"""
+    goto, fail, out = automaton.goto, automaton.fail, automaton.out
+    node = 0
+    for ch in text:
+        while node and ch not in goto[node]:
+            node = fail[node]
+        node = goto[node].get(ch, 0)
+        if out[node]:
+            yield from out[node]
+
+
+@dataclass
+class MatchStats:
+    codes: int = 0
+    matched: int = 0
+    rows_scanned: int = 0
+    # NFKC で揃えたことで初めて一致した code の数
+    matched_by_normalization: int = 0
+    seconds: float = 0.0
+
+
+def find_costs_for_codes(
+    codes: Iterable[str], master_rows: Iterable[Tuple[str, Any]]
+) -> Tuple[Dict[str, float], MatchStats]:
+    """
+    各 code について、商品名に code を含む最初の行（移動平均単価が数値の行）の単価を返す。
+    全 code のオートマトンを1回作り、原価マスタ（(商品名, 移動平均単価) の並び）を1回だけ走査する。
+    全 code が見つかった時点で走査をやめる。
+    """
+    started = time.perf_counter()
+    by_pattern: Dict[str, List[str]] = {}
+    for code in codes:
+        if code:
+            by_pattern.setdefault(_normalize(code), []).append(code)
+    patterns = [p for p in by_pattern if p]
+    automaton = _build_automaton(patterns)
+    stats = MatchStats(codes=sum(len(v) for v in by_pattern.values()))
+
+    costs: Dict[str, float] = {}
+    found = [False] * len(patterns)
+    remaining = len(patterns)
+    for name, raw_cost in master_rows:
+        if not remaining:
+            break
+        stats.rows_scanned += 1
+        if not name:
+            continue
+        cost = _parse_cost(raw_cost)
+        if cost is None:
+            continue
+        for index in _iter_matches(automaton, _normalize(name)):
+            if found[index]:
+                continue
+            found[index] = True
+            remaining -= 1
+            for code in by_pattern[patterns[index]]:
+                costs[code] = cost
+                stats.matched += 1
+                if code not in name:
+                    stats.matched_by_normalization += 1
+    stats.seconds = time.perf_counter() - started
+    return costs, stats
+
+
+def _iter_json_rows(rows: List[Dict[str, Any]]) -> Iterator[Tuple[str, Any]]:
+    for row in rows:
+        yield row.get("商品名") or "", row.get("移動平均単価")
+
+
+def _iter_store_rows(store: MasterStore, sheet_name: str) -> Iterator[Tuple[str, Any]]:
+    """
+    ストアの (商品名, 移動平均単価) を行順に返す。最初に一致した行の単価を使うため、
+    JSON と同じシートだけを格納したストアでなければ結果が変わる（その場合はエラー）。
+    """
+    sheets = store.sheets()
+    if [s.rsplit("/", 1)[-1] for s in sheets] != [sheet_name]:
+        raise ValueError(
+            f"{store.path} には {sheet_name} シートだけを格納してください（格納済み: {', '.join(sheets) or 'なし'}）。"
+            f"python -m services.xlsx_to_json --sheet {sheet_name} --sqlite {store.path} で作り直せます。"
+        )
+    return store.iter_name_costs()
 
 
-def _find_cost_for_code(code: str, master_rows: List[Dict[str, Any]]) -> Optional[float]:
+def update_models_unit_cost(store_path: Optional[Path] = None) -> None:
     """
-    商品codeが商品名に含まれる行を探し、その移動平均単価を返す。
-    最初にマッチした1件のみを使用する。
+    models.json の unit_cost（0 または未設定）を原価マスタの移動平均単価で埋める。
+    原価マスタは data/原価マスタ.json を読む。store_path を指定した場合は、同じシートを
+    格納した原価マスタDBから読む（どちらも全行を行順に走査する。結果は同じ）。
     """
-    if not code:
-        return None
-    for row in master_rows:
-        name = row.get("商品名") or ""
-        if code in name:
-            cost = _parse_cost(row.get("移動平均単価"))
-            if cost is not None:
-                return cost
-    return None
-
-
-def update_models_unit_cost() -> None:
     models_path = DATA_DIR / "models.json"
     master_path = DATA_DIR / "原価マスタ.json"
 
     models: Dict[str, List[Dict[str, Any]]] = _load_json(models_path)
-    master_rows: List[Dict[str, Any]] = _load_json(master_path)
-
-    updated_count = 0
-    missing_codes = []
 
+    # 原価を埋める対象（0 または未設定）の item
+    targets: List[Dict[str, Any]] = []
     for product_code, items in models.items():
         if not isinstance(items, list):
             continue
@@ -68,27 +175,59 @@ def update_models_unit_cost() -> None:
             current_cost = item.get("unit_cost")
             if isinstance(current_cost, (int, float)) and current_cost not in (0, 0.0):
                 continue
+            targets.append(item)
 
-            cost = _find_cost_for_code(code, master_rows)
-            if cost is None:
-                missing_codes.append(code)
-                continue
+    codes = [item["code"] for item in targets]
+    if store_path is not None:
+        with MasterStore(store_path) as store:
+            costs, stats = find_costs_for_codes(codes, _iter_store_rows(store, master_path.stem))
+        source = store_path.name
+    else:
+        costs, stats = find_costs_for_codes(codes, _iter_json_rows(_load_json(master_path)))
+        source = master_path.name
 
-            item["unit_cost"] = cost
-            updated_count += 1
+    updated_count = 0
+    missing_codes = []
+    for item in targets:
+        cost = costs.get(item["code"])
+        if cost is None:
+            missing_codes.append(item["code"])
+            continue
+        item["unit_cost"] = cost
+        updated_count += 1
 
     with models_path.open("w", encoding="utf-8") as f:
         json.dump(models, f, ensure_ascii=False, indent=2)
 
     print(f"更新完了: {updated_count} 件の unit_cost を更新しました。")
+    print(
+        f"照合: {source} の {stats.rows_scanned:,} 行を走査、"
+        f"code {stats.codes} 件中 {stats.matched} 件が一致"
+        f"（うち全角・半角の正規化で一致 {stats.matched_by_normalization} 件）、{stats.seconds * 1000:.1f} ms"
+    )
     if missing_codes:
         unique_missing = sorted(set(missing_codes))
-        print("原価マスタ.json で移動平均単価が見つからなかった code:")
+        print(f"{source} で移動平均単価が見つからなかった code:")
         for c in unique_missing:
             print(f"- {c}")
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="models.json の原価（0 または未設定）を原価マスタの移動平均単価で埋めます。"
+    )
+    parser.add_argument(
+        "--store",
+        type=Path,
+        default=None,
+        metavar="DB_PATH",
+        help="data/原価マスタ.json の代わりに原価マスタDB（xlsx_to_json --sheet 原価マスタ --sqlite で作成）を読む",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    update_models_unit_cost()
+    # python -m services.update_models_unit_cost [--store data/cost_master.sqlite3]
+    update_models_unit_cost(parse_args().store)
 
 
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import atexit
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+# --- 書き込みキュー（write-behind） ---
+# SQLite は同時に1つしか書き込めないため、月末などに登録が集中すると
+# "database is locked" やリダイレクトの遅れが起きる。キューを有効にすると、登録は
+# 1本の書き込みスレッドに渡され、短い間に溜まった分をまとめて1トランザクションで書き込む。
+#
+# 呼び出し側は submit() の Future で ID を待つ（同期）か、ticket で後から状態を問い合わせる（ポーリング）。
+# キューはプロセスごとに1つ（gunicorn の複数ワーカーではワーカー数だけ書き込みスレッドがある）。
+# status() が答えられるのは、このプロセスで受け付けた直近の ticket だけ。別のワーカー・再起動後の
+# 問い合わせには、呼び出し側が書き込み先（DB）から答えること（app.py では ticket に重複防止キーを含める）。
+
+DEFAULT_MAX_BATCH = 50
+DEFAULT_MAX_WAIT_MS = 5.0
+TICKET_HISTORY = 1000  # 状態を問い合わせられる直近の ticket 数
+
+
+@dataclass
+class _Job:
+    ticket: str
+    payload: Any
+    future: Future
+    enqueued_at: float
+
+
+class WriteQueue:
+    """
+    write_batch(payloads) -> 結果のリスト（payloads と同じ順）を1本のスレッドで呼び出す。
+    write_batch は呼び出しごとに1トランザクションで書き込むこと。失敗した場合はバッチを1件ずつに
+    分けてやり直すため、不正な1件が同じバッチの他の登録を巻き込まない。
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[Sequence[Any]], List[Any]],
+        max_batch: int = DEFAULT_MAX_BATCH,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+        name: str = 'write-queue',
+    ):
+        self._write_batch = write_batch
+        self._max_batch = max(1, int(max_batch))
+        self._max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: 'queue.Queue[Optional[_Job]]' = queue.Queue()
+        self._tickets: 'OrderedDict[str, Future]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {
+            'submitted': 0,
+            'committed': 0,
+            'failed': 0,
+            'batches': 0,
+            'retried_batches': 0,
+            'max_batch_size': 0,
+            'commit_ms_total': 0.0,
+            'commit_ms_max': 0.0,
+            'last_commit_ms': None,
+            'wait_ms_max': 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # --- 呼び出し側 ---
+
+    def submit(self, payload: Any, ticket: Optional[str] = None) -> Future:
+        """書き込みを予約する。Future.ticket（省略時は新しく作る）で後から状態を問い合わせられる"""
+        job = _Job(ticket=ticket or uuid.uuid4().hex, payload=payload, future=Future(), enqueued_at=time.perf_counter())
+        job.future.ticket = job.ticket
+        with self._lock:
+            self._tickets[job.ticket] = job.future
+            while len(self._tickets) > TICKET_HISTORY:
+                self._tickets.popitem(last=False)
+            self._metrics['submitted'] += 1
+        self._queue.put(job)
+        return job.future
+
+    def status(self, ticket: str) -> Optional[Dict[str, Any]]:
+        """ticket の状態。{'status': 'pending'|'done'|'error', 'result'|'error'}。不明な ticket は None"""
+        with self._lock:
+            future = self._tickets.get(ticket)
+        if future is None:
+            return None
+        if not future.done():
+            return {'status': 'pending'}
+        error = future.exception()
+        if error is not None:
+            return {'status': 'error', 'error': str(error)}
+        return {'status': 'done', 'result': future.result()}
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._metrics)
+        data['depth'] = self._queue.qsize()
+        data['commit_ms_avg'] = round(data['commit_ms_total'] / data['batches'], 3) if data['batches'] else None
+        data['alive'] = self._thread.is_alive()
+        return data
+
+    def close(self, timeout: float = 5.0) -> None:
+        """溜まっている分を書き込んでから書き込みスレッドを止める"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    # --- 書き込みスレッド ---
+
+    def _next_batch(self) -> Optional[List[_Job]]:
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self._max_wait
+        while len(batch) < self._max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # 停止要求は今のバッチを書き込んだ後に処理する
+                self._queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _commit(self, batch: List[_Job]) -> None:
+        started = time.perf_counter()
+        results = self._write_batch([job.payload for job in batch])
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for job, result in zip(batch, results):
+            job.future.set_result(result)
+        with self._lock:
+            m = self._metrics
+            m['committed'] += len(batch)
+            m['batches'] += 1
+            m['max_batch_size'] = max(m['max_batch_size'], len(batch))
+            m['commit_ms_total'] += elapsed_ms
+            m['commit_ms_max'] = max(m['commit_ms_max'], elapsed_ms)
+            m['last_commit_ms'] = round(elapsed_ms, 3)
+            m['wait_ms_max'] = max(m['wait_ms_max'], (started - batch[0].enqueued_at) * 1000)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._commit(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    self._fail(batch[0], e)
+                    continue
+                with self._lock:
+                    self._metrics['retried_batches'] += 1
+                for job in batch:
+                    try:
+                        self._commit([job])
+                    except Exception as job_error:
+                        self._fail(job, job_error)
+
+    def _fail(self, job: _Job, error: Exception) -> None:
+        job.future.set_exception(error)
+        with self._lock:
+            self._metrics['failed'] += 1
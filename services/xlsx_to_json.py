@@ -1,10 +1,18 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
+import os
+import posixpath
+import time as _time
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from datetime import date, datetime, time
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple
 
 from openpyxl import load_workbook
 
@@ -36,6 +44,9 @@ EXCLUDED_HEADERS = {
     "単位CD",
     "活動区分",
 }
+# Output formats: "json" (indented array, same as before), "compact" (array without
+# indentation) and "jsonl" (one record per line).
+OUTPUT_FORMATS = ("json", "compact", "jsonl")
 
 
 def convert_cell_value(value: Any) -> Any:
@@ -74,66 +85,483 @@ def normalize_headers(headers: Iterable[Any]) -> List[str]:
     return normalized
 
 
-def sheet_to_records(ws) -> List[Dict[str, Any]]:
-    """Convert a worksheet to list of dict records using row 1 as headers."""
+def column_plan(headers: List[str]) -> List[Tuple[int, str]]:
+    """(column index, header) pairs to output, computed once per sheet."""
+    return [(idx, header) for idx, header in enumerate(headers) if header and header not in EXCLUDED_HEADERS]
+
+
+def _is_blank(cell: Any) -> bool:
+    return cell is None or (isinstance(cell, str) and cell.strip() == "")
+
+
+def iter_sheet_records(ws) -> Iterator[Dict[str, Any]]:
+    """Yield dict records one row at a time using row 1 as headers."""
     header_rows = ws.iter_rows(min_row=1, max_row=1, values_only=True)
     try:
         raw_headers = next(header_rows)
     except StopIteration:
-        return []
+        return
 
     headers = normalize_headers(raw_headers or [])
-    if not any(h for h in headers):
-        # No usable headers
-        return []
+    plan = column_plan(headers)
+    if not plan:
+        # No usable headers (or only excluded ones)
+        return
 
-    records: List[Dict[str, Any]] = []
     for row in ws.iter_rows(min_row=2, values_only=True):
         if row is None:
             continue
         # Skip completely empty rows
-        if all(cell is None or (isinstance(cell, str) and cell.strip() == "") for cell in row):
+        if all(_is_blank(cell) for cell in row):
             continue
+        width = len(row)
+        yield {
+            header: convert_cell_value(row[idx]) if idx < width else None
+            for idx, header in plan
+        }
+
+
+def sheet_to_records(ws) -> List[Dict[str, Any]]:
+    """Convert a worksheet to list of dict records using row 1 as headers."""
+    return list(iter_sheet_records(ws))
+
+
+def write_records(records: Iterable[Dict[str, Any]], f: IO[str], fmt: str = "json") -> int:
+    """
+    Write records to f as they arrive, without holding the whole sheet in memory.
+    The "json" format is byte-for-byte what json.dump(list, indent=2) produced.
+    Returns the number of records written.
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"未対応の出力形式です: {fmt}")
+    count = 0
+    if fmt == "jsonl":
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+            f.write("\n")
+            count += 1
+        return count
+
+    f.write("[")
+    for record in records:
+        if fmt == "compact":
+            f.write("," if count else "")
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        else:
+            f.write(",\n  " if count else "\n  ")
+            f.write(json.dumps(record, ensure_ascii=False, indent=2).replace("\n", "\n  "))
+        count += 1
+    f.write("\n]" if count and fmt == "json" else "]")
+    return count
+
+
+MANIFEST_NAME = ".xlsx_to_json.manifest.json"
+# Bump when the conversion logic changes so that every sheet is converted again.
+CONVERTER_VERSION = 2
+
+
+@dataclass
+class SheetTask:
+    input_path: Path
+    sheet_name: str
+    output_path: Path
+    fmt: str
+    source_sha256: str
+
+
+@dataclass
+class SheetResult:
+    input_path: Path
+    sheet_name: str
+    output_path: Path
+    records: int
+    seconds: float
+    # converted / unchanged (converted, same bytes, file left as is) / skipped (source unchanged)
+    # --check only: new / changed / up-to-date
+    status: str = "converted"
+    output_sha256: str = ""
+    source_sha256: str = ""
+
+
+STATUS_LABELS = {
+    "converted": "更新",
+    "unchanged": "変換済み・内容変更なし",
+    "skipped": "スキップ（元シート未変更）",
+    "new": "新規",
+    "changed": "変更あり",
+    "up-to-date": "変更なし",
+}
+
+
+class _HashingWriter:
+    """Text writer that encodes to UTF-8 and hashes everything it writes."""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.sha256 = hashlib.sha256()
+
+    def write(self, text: str) -> int:
+        data = text.encode("utf-8")
+        self.sha256.update(data)
+        self._raw.write(data)
+        return len(text)
+
+
+def file_sha256(path: Path) -> Optional[str]:
+    try:
+        h = hashlib.sha256()
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def convert_sheet(task: SheetTask) -> SheetResult:
+    """
+    Convert one worksheet. Opens its own read-only workbook so that it can run in a
+    worker process independently of other sheets. The output is written to a temporary
+    file next to the target and renamed over it only when the bytes differ, so readers
+    never see a half-written file and unchanged outputs keep their mtime.
+    """
+    started = _time.perf_counter()
+    out_path = task.output_path
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_name(f".{out_path.name}.{os.getpid()}.tmp")
+    wb = load_workbook(filename=task.input_path, data_only=True, read_only=True)
+    try:
+        with tmp_path.open("wb") as raw:
+            writer = _HashingWriter(raw)
+            count = write_records(iter_sheet_records(wb[task.sheet_name]), writer, task.fmt)
+        digest = writer.sha256.hexdigest()
+        if file_sha256(out_path) == digest:
+            tmp_path.unlink()
+            status = "unchanged"
+        else:
+            os.replace(tmp_path, out_path)
+            status = "converted"
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        # read_only workbooks keep the file handle open until closed
+        wb.close()
+    return SheetResult(
+        task.input_path,
+        task.sheet_name,
+        out_path,
+        count,
+        _time.perf_counter() - started,
+        status=status,
+        output_sha256=digest,
+        source_sha256=task.source_sha256,
+    )
+
+
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_PKG_RELS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_NS_DOC_RELS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+
+def _read_rels(archive: zipfile.ZipFile, part: str) -> Dict[str, Tuple[str, str]]:
+    """Relationship id -> (type, absolute part name) for the given part."""
+    folder, name = posixpath.split(part)
+    rels_part = posixpath.join(folder, "_rels", f"{name}.rels")
+    root = ET.fromstring(archive.read(rels_part))
+    rels: Dict[str, Tuple[str, str]] = {}
+    for rel in root.iter(f"{_NS_PKG_RELS}Relationship"):
+        target = rel.get("Target", "")
+        if target.startswith("/"):
+            path = target.lstrip("/")
+        else:
+            path = posixpath.normpath(posixpath.join(folder, target))
+        rels[rel.get("Id", "")] = (rel.get("Type", ""), path)
+    return rels
+
+
+def worksheet_parts(archive: zipfile.ZipFile) -> List[Tuple[str, str]]:
+    """
+    (sheet name, worksheet part name) for every worksheet in workbook order, read from
+    the package itself (workbook.xml and its relationships). Chartsheets are skipped,
+    matching openpyxl's Workbook.worksheets.
+    """
+    workbook_part = next(
+        (path for rel_type, path in _read_rels(archive, "").values() if rel_type.endswith("/officeDocument")),
+        "xl/workbook.xml",
+    )
+    rels = _read_rels(archive, workbook_part)
+    root = ET.fromstring(archive.read(workbook_part))
+    sheets: List[Tuple[str, str]] = []
+    for sheet in root.iter(f"{_NS_MAIN}sheet"):
+        rel_type, path = rels[sheet.get(f"{_NS_DOC_RELS}id", "")]
+        if rel_type.endswith("/worksheet"):
+            sheets.append((sheet.get("name", ""), path))
+    return sheets
+
+
+def _source_sha256(archive: zipfile.ZipFile, worksheet_path: Optional[str], fmt: str) -> str:
+    """
+    Hash of everything the converted output of one sheet depends on: the sheet XML,
+    the shared string table, styles (number formats decide dates), the output format
+    and the converter settings. Without a worksheet part (the package could not be
+    mapped) every part of the workbook is hashed, so any change re-converts the sheet.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps([CONVERTER_VERSION, fmt, sorted(EXCLUDED_HEADERS)], ensure_ascii=False).encode("utf-8"))
+    names = set(archive.namelist())
+    if worksheet_path is None:
+        parts: Iterable[str] = sorted(names)
+    else:
+        parts = (worksheet_path, "xl/sharedStrings.xml", "xl/styles.xml")
+    for part in parts:
+        if part in names:
+            h.update(part.encode("utf-8"))
+            with archive.open(part) as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+    return h.hexdigest()
 
-        record: Dict[str, Any] = {}
-        for idx, header in enumerate(headers):
-            if not header or header in EXCLUDED_HEADERS:
-                # Ignore columns with empty header
-                continue
-            value = row[idx] if idx < len(row) else None
-            record[header] = convert_cell_value(value)
-        # Skip rows that produced no fields (e.g., all headers empty)
-        if record:
-            records.append(record)
-    return records
+
+def check_unique_stems(input_paths: List[Path]) -> None:
+    """
+    With several workbooks, outputs and store labels are named after the file stem,
+    so two inputs with the same stem (e.g. a/原価.xlsx and b/原価.xlsx) would overwrite
+    each other. Reject them up front.
+    """
+    if len(input_paths) < 2:
+        return
+    seen: Dict[str, Path] = {}
+    for input_path in input_paths:
+        other = seen.setdefault(input_path.stem, input_path)
+        if other is not input_path:
+            raise ValueError(
+                f"ファイル名（拡張子なし）が同じExcelファイルは同時に変換できません: {other} と {input_path}"
+            )
+
+
+def plan_sheets(
+    input_paths: List[Path],
+    output_dir: Path,
+    target_sheets: Optional[List[str]] = None,
+    fmt: str = "json",
+) -> List[SheetTask]:
+    """
+    List every sheet to convert with its output path and source hash.
+    With several workbooks, each one gets its own subdirectory named after the file
+    so that sheets with the same name do not overwrite each other (the file stems must
+    therefore differ; see check_unique_stems).
+    """
+    check_unique_stems(input_paths)
+    suffix = ".jsonl" if fmt == "jsonl" else ".json"
+    tasks: List[SheetTask] = []
+    for input_path in input_paths:
+        if not input_path.exists():
+            raise FileNotFoundError(f"Excelファイルが見つかりません: {input_path}")
+        sheet_dir = output_dir / input_path.stem if len(input_paths) > 1 else output_dir
+        with zipfile.ZipFile(input_path) as archive:
+            try:
+                sheets: List[Tuple[str, Optional[str]]] = list(worksheet_parts(archive))
+            except (KeyError, ET.ParseError):
+                # Unusual package layout: fall back to openpyxl for the sheet names and
+                # hash the whole workbook for each sheet.
+                wb = load_workbook(filename=input_path, read_only=True)
+                try:
+                    sheets = [(ws.title, None) for ws in wb.worksheets]
+                finally:
+                    wb.close()
+            for sheet_name, worksheet_path in sheets:
+                if target_sheets and sheet_name not in target_sheets:
+                    continue
+                tasks.append(
+                    SheetTask(
+                        input_path,
+                        sheet_name,
+                        sheet_dir / f"{sheet_name}{suffix}",
+                        fmt,
+                        _source_sha256(archive, worksheet_path, fmt),
+                    )
+                )
+    return tasks
+
+
+def load_manifest(output_dir: Path) -> Dict[str, Any]:
+    path = output_dir / MANIFEST_NAME
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"version": 1, "entries": {}}
+    manifest.setdefault("entries", {})
+    return manifest
+
+
+def save_manifest(output_dir: Path, manifest: Dict[str, Any]) -> None:
+    path = output_dir / MANIFEST_NAME
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _manifest_key(output_dir: Path, path: Path) -> str:
+    return path.relative_to(output_dir).as_posix()
+
+
+def _is_up_to_date(task: SheetTask, entry: Optional[Dict[str, Any]]) -> bool:
+    return (
+        entry is not None
+        and entry.get("source_sha256") == task.source_sha256
+        and file_sha256(task.output_path) == entry.get("output_sha256")
+    )
+
+
+def convert_workbooks(
+    input_paths: List[Path],
+    output_dir: Path,
+    target_sheets: Optional[List[str]] = None,
+    fmt: str = "json",
+    jobs: int = 1,
+    check: bool = False,
+    force: bool = False,
+) -> List[SheetResult]:
+    """
+    Convert every sheet of every workbook whose source changed since the last run
+    (according to the manifest in output_dir). With jobs > 1 the sheets are spread over
+    a process pool (one sheet per task). check=True only reports what would change.
+    Results are returned in workbook/sheet order.
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"未対応の出力形式です: {fmt}")
+    manifest = load_manifest(output_dir)
+    entries = manifest["entries"]
+    tasks = plan_sheets(input_paths, output_dir, target_sheets, fmt)
+
+    results: Dict[int, SheetResult] = {}
+    pending: List[Tuple[int, SheetTask]] = []
+    for i, task in enumerate(tasks):
+        entry = entries.get(_manifest_key(output_dir, task.output_path))
+        if not force and _is_up_to_date(task, entry):
+            status = "up-to-date" if check else "skipped"
+            results[i] = SheetResult(
+                task.input_path, task.sheet_name, task.output_path, entry.get("records", 0), 0.0,
+                status=status, output_sha256=entry["output_sha256"], source_sha256=task.source_sha256,
+            )
+        elif check:
+            status = "changed" if task.output_path.exists() else "new"
+            results[i] = SheetResult(
+                task.input_path, task.sheet_name, task.output_path, 0, 0.0,
+                status=status, source_sha256=task.source_sha256,
+            )
+        else:
+            pending.append((i, task))
+
+    if pending:
+        jobs = max(1, min(int(jobs), len(pending)))
+        if jobs == 1:
+            converted = [convert_sheet(task) for _, task in pending]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                converted = list(pool.map(convert_sheet, [task for _, task in pending]))
+        for (i, _), result in zip(pending, converted):
+            results[i] = result
+            entries[_manifest_key(output_dir, result.output_path)] = {
+                "input": result.input_path.name,
+                "sheet": result.sheet_name,
+                "format": fmt,
+                "records": result.records,
+                "source_sha256": result.source_sha256,
+                "output_sha256": result.output_sha256,
+            }
+        save_manifest(output_dir, manifest)
+    return [results[i] for i in range(len(tasks))]
 
 
 def convert_workbook_to_json(
     input_path: Path,
     output_dir: Path,
     target_sheets: Optional[List[str]] = None,
+    fmt: str = "json",
+    jobs: int = 1,
 ) -> Dict[str, Path]:
     """
-    Convert each worksheet to a JSON file named '<sheet>.json' in output_dir.
+    Convert each worksheet to a JSON file named '<sheet>.json' ('<sheet>.jsonl' for
+    JSON Lines) in output_dir, streaming rows straight from the workbook.
+    Sheets unchanged since the last run are skipped.
     Returns a mapping of sheet name to output file path.
     """
-    if not input_path.exists():
-        raise FileNotFoundError(f"Excelファイルが見つかりません: {input_path}")
-    output_dir.mkdir(parents=True, exist_ok=True)
+    results = convert_workbooks([input_path], output_dir, target_sheets, fmt, jobs)
+    return {r.sheet_name: r.output_path for r in results}
 
-    wb = load_workbook(filename=input_path, data_only=True, read_only=True)
 
-    written: Dict[str, Path] = {}
-    for sheet_name in wb.sheetnames:
-        if target_sheets and sheet_name not in target_sheets:
-            continue
-        ws = wb[sheet_name]
-        records = sheet_to_records(ws)
-        out_path = output_dir / f"{sheet_name}.json"
-        with out_path.open("w", encoding="utf-8") as f:
-            json.dump(records, f, ensure_ascii=False, indent=2)
-        written[sheet_name] = out_path
-    return written
+def convert_workbooks_to_sqlite(
+    input_paths: List[Path],
+    db_path: Path,
+    target_sheets: Optional[List[str]] = None,
+) -> List[SheetResult]:
+    """
+    Load the selected sheets straight into the indexed cost master database
+    (services.master_store) instead of writing JSON files. Rows are streamed from the
+    workbook into the database, which is rebuilt in a temporary file and swapped in
+    atomically. With several workbooks the sheet is stored as '<file stem>/<sheet>'.
+    """
+    from services.master_store import build_store
+
+    check_unique_stems(input_paths)
+    sheets: List[Tuple[Path, str, str]] = []
+    for input_path in input_paths:
+        if not input_path.exists():
+            raise FileNotFoundError(f"Excelファイルが見つかりません: {input_path}")
+        wb = load_workbook(filename=input_path, read_only=True)
+        try:
+            names = [ws.title for ws in wb.worksheets]
+        finally:
+            wb.close()
+        for sheet_name in names:
+            if target_sheets and sheet_name not in target_sheets:
+                continue
+            label = f"{input_path.stem}/{sheet_name}" if len(input_paths) > 1 else sheet_name
+            sheets.append((input_path, sheet_name, label))
+
+    seconds: Dict[str, float] = {}
+
+    def timed_records(input_path: Path, sheet_name: str, label: str) -> Iterator[Dict[str, Any]]:
+        started = _time.perf_counter()
+        wb = load_workbook(filename=input_path, data_only=True, read_only=True)
+        try:
+            yield from iter_sheet_records(wb[sheet_name])
+        finally:
+            wb.close()
+            seconds[label] = _time.perf_counter() - started
+
+    counts = build_store(
+        ((label, timed_records(input_path, sheet_name, label)) for input_path, sheet_name, label in sheets),
+        db_path,
+    )
+    return [
+        SheetResult(input_path, sheet_name, db_path, counts.get(label, 0), seconds.get(label, 0.0), status="converted")
+        for input_path, sheet_name, label in sheets
+    ]
+
+
+def format_timing_summary(results: List[SheetResult], wall_seconds: float) -> List[str]:
+    """Per-sheet status and timing lines, slowest first, followed by the totals."""
+    lines = []
+    for r in sorted(results, key=lambda r: r.seconds, reverse=True):
+        label = STATUS_LABELS.get(r.status, r.status)
+        if r.status in ("converted", "unchanged"):
+            rate = r.records / r.seconds if r.seconds > 0 else 0.0
+            detail = f"{r.records:,} 件 {r.seconds:.2f} 秒（{rate:,.0f} 件/秒） "
+        else:
+            detail = f"{r.records:,} 件 " if r.records else ""
+        lines.append(f"- [{label}] {r.input_path.name} / {r.sheet_name}: {detail}→ {r.output_path}")
+    total = sum(r.seconds for r in results)
+    converted = sum(1 for r in results if r.status in ("converted", "unchanged"))
+    lines.append(
+        f"合計 {len(results)} シート（変換 {converted}）/ シート処理時間の合計 {total:.2f} 秒"
+        f" / 経過時間 {wall_seconds:.2f} 秒"
+    )
+    return lines
 
 
 def parse_args() -> argparse.Namespace:
@@ -141,8 +569,9 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--input",
         type=Path,
-        default=DEFAULT_INPUT,
-        help="入力のExcelファイルパス（既定: data/master.xlsx）",
+        nargs="+",
+        default=[DEFAULT_INPUT],
+        help="入力のExcelファイルパス（複数指定可。既定: data/master.xlsx）。複数の場合はファイル名ごとのサブディレクトリに出力",
     )
     parser.add_argument(
         "--output-dir",
@@ -156,18 +585,62 @@ def parse_args() -> argparse.Namespace:
         default=None,
         help="変換対象シート名（複数指定可）。未指定なら全シートを変換。",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="json",
+        help="出力形式: json（インデント付き・既定）/ compact（インデントなし）/ jsonl（1行1レコード）",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="並列に変換するプロセス数（シート単位で分担。既定: 1）",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="書き込まずに、変換が必要なシート（新規・変更あり）を表示する。変更があれば終了コード 1",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="マニフェストを無視して全シートを変換する",
+    )
+    parser.add_argument(
+        "--sqlite",
+        type=Path,
+        default=None,
+        metavar="DB_PATH",
+        help="JSONの代わりに、索引付きの原価マスタDB（例: data/cost_master.sqlite3）へ読み込む",
+    )
+    args = parser.parse_args()
+    if args.sqlite is not None and args.check:
+        parser.error("--check は --sqlite と同時に指定できません")
+    try:
+        check_unique_stems(args.input)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
 
 
 def main() -> None:
     args = parse_args()
-    written = convert_workbook_to_json(args.input, args.output_dir, args.sheet)
-    if not written:
+    started = _time.perf_counter()
+    if args.sqlite is not None:
+        results = convert_workbooks_to_sqlite(args.input, args.sqlite, args.sheet)
+    else:
+        results = convert_workbooks(
+            args.input, args.output_dir, args.sheet, args.format, args.jobs, check=args.check, force=args.force
+        )
+    if not results:
         print("変換対象がありませんでした。見出し行やシート指定をご確認ください。")
         return
-    print("変換完了:")
-    for name, path in written.items():
-        print(f"- {name}: {path}")
+    print("確認結果（書き込みなし）:" if args.check else "変換完了:")
+    for line in format_timing_summary(results, _time.perf_counter() - started):
+        print(line)
+    if args.check and any(r.status in ("new", "changed") for r in results):
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
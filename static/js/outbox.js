@@ -0,0 +1,211 @@
+// オフライン時の見積登録の送信待ち（IndexedDB）。
+// 画面（base.html）とサービスワーカー（/sw.js の importScripts）の両方から読み込む。
+//   - サービスワーカー: 入力画面からの登録（POST /estimates）が通信エラーになったら、入力内容をここに保存する
+//   - 画面: 読み込み時・通信の回復時に、保存した登録を順に再送する（Accept: application/json）
+// 再送には入力画面ごとの重複防止キー（idempotency_key）を付けるため、同じ登録が2件作られることはない。
+(function (root) {
+  'use strict';
+
+  const DB_NAME = 'estimate-outbox';
+  const STORE = 'submissions';
+  const SYNC_TAG = 'estimate-outbox';
+
+  function openDb() {
+    return new Promise((resolve, reject) => {
+      const req = root.indexedDB.open(DB_NAME, 1);
+      req.onupgradeneeded = () => {
+        req.result.createObjectStore(STORE, { keyPath: 'key' });
+      };
+      req.onsuccess = () => resolve(req.result);
+      req.onerror = () => reject(req.error);
+    });
+  }
+
+  function withStore(mode, fn) {
+    return openDb().then(db => new Promise((resolve, reject) => {
+      const tx = db.transaction(STORE, mode);
+      const result = fn(tx.objectStore(STORE));
+      tx.oncomplete = () => { db.close(); resolve(result && 'result' in result ? result.result : result); };
+      tx.onerror = () => { db.close(); reject(tx.error); };
+    }));
+  }
+
+  function newKey() {
+    if (root.crypto && root.crypto.randomUUID) return root.crypto.randomUUID().replace(/-/g, '');
+    return Date.now().toString(16) + Math.random().toString(16).slice(2);
+  }
+
+  // entries: [[name, value], ...]（FormData の内容。同じ名前の明細列が複数ある）
+  function enqueue(entries) {
+    let key = '';
+    for (const [name, value] of entries) {
+      if (name === 'idempotency_key') key = value;
+    }
+    if (!key) {
+      key = newKey();
+      entries = entries.concat([['idempotency_key', key]]);
+    }
+    const title = (entries.find(([name]) => name === 'title') || [null, ''])[1];
+    const record = { key, entries, title, queuedAt: new Date().toISOString(), status: 'pending', error: '' };
+    return withStore('readwrite', store => store.put(record)).then(() => record);
+  }
+
+  function list() {
+    return withStore('readonly', store => store.getAll()).then(rows =>
+      (rows || []).sort((a, b) => a.queuedAt.localeCompare(b.queuedAt)));
+  }
+
+  function remove(key) {
+    return withStore('readwrite', store => store.delete(key));
+  }
+
+  function markError(record, message) {
+    return withStore('readwrite', store => store.put(Object.assign({}, record, { status: 'error', error: message })));
+  }
+
+  let flushing = null;
+
+  // 送信待ちを古い順に再送する。通信エラー・サーバーエラーで止め、次の機会に続きから送る。
+  // 入力内容の誤り（4xx）はその登録だけ「エラー」にして残す（画面で内容を確認して削除する）。
+  function flush() {
+    if (flushing) return flushing;
+    flushing = (async () => {
+      const summary = { sent: 0, failed: 0, remaining: 0, warnings: [] };
+      for (const record of await list()) {
+        if (record.status === 'error') { summary.failed += 1; continue; }
+        let resp;
+        try {
+          resp = await root.fetch('/estimates', {
+            method: 'POST',
+            body: new URLSearchParams(record.entries),
+            headers: { Accept: 'application/json' },
+            credentials: 'same-origin',
+          });
+        } catch (err) {
+          summary.remaining += 1;
+          break;
+        }
+        if (resp.ok) {
+          // 201 登録 / 200 登録済み（重複）/ 202 書き込みキューで受付
+          let body = {};
+          try { body = await resp.json(); } catch (e) { /* JSON 以外の応答 */ }
+          for (const warning of body.warnings || []) {
+            summary.warnings.push(`${record.title || '(件名なし)'}: ${warning}`);
+          }
+          await remove(record.key);
+          summary.sent += 1;
+        } else if (resp.status >= 400 && resp.status < 500) {
+          let message = `送信できませんでした（${resp.status}）`;
+          try { message = (await resp.json()).error || message; } catch (e) { /* JSON 以外の応答 */ }
+          await markError(record, message);
+          summary.failed += 1;
+        } else {
+          summary.remaining += 1;
+          break;
+        }
+      }
+      return summary;
+    })().finally(() => { flushing = null; });
+    return flushing;
+  }
+
+  // 通信が戻ったときにブラウザが送信してくれるよう依頼する（Background Sync 対応ブラウザのみ）
+  function requestSync() {
+    if (!root.navigator || !root.navigator.serviceWorker) return Promise.resolve();
+    return root.navigator.serviceWorker.ready
+      .then(reg => (reg.sync ? reg.sync.register(SYNC_TAG) : null))
+      .catch(() => null);
+  }
+
+  root.EstimateOutbox = { SYNC_TAG, enqueue, list, remove, flush, requestSync, newKey };
+
+  // --- 以下は画面でのみ動かす ---
+  if (typeof root.document === 'undefined') return;
+
+  function updateStatus() {
+    const link = root.document.getElementById('outbox-status');
+    if (!link) return Promise.resolve();
+    return list().then(rows => {
+      link.hidden = rows.length === 0;
+      link.textContent = `未送信の見積 ${rows.length} 件`;
+    }).catch(() => { link.hidden = true; });
+  }
+
+  function renderList() {
+    const container = root.document.getElementById('outbox-list');
+    if (!container) return Promise.resolve();
+    return list().then(rows => {
+      container.textContent = '';
+      if (rows.length === 0) {
+        const p = root.document.createElement('p');
+        p.textContent = '未送信の見積はありません。';
+        container.appendChild(p);
+        return;
+      }
+      const table = root.document.createElement('table');
+      table.className = 'table';
+      table.innerHTML = '<thead><tr><th>保存日時</th><th>件名</th><th>状態</th><th></th></tr></thead>';
+      const tbody = root.document.createElement('tbody');
+      for (const record of rows) {
+        const tr = root.document.createElement('tr');
+        const cells = [
+          new Date(record.queuedAt).toLocaleString('ja-JP'),
+          record.title || '(件名なし)',
+          record.status === 'error' ? `エラー: ${record.error}` : '送信待ち',
+        ];
+        for (const text of cells) {
+          const td = root.document.createElement('td');
+          td.textContent = text;
+          tr.appendChild(td);
+        }
+        const td = root.document.createElement('td');
+        const button = root.document.createElement('button');
+        button.type = 'button';
+        button.className = 'btn danger';
+        button.textContent = '削除';
+        button.addEventListener('click', () => {
+          if (!root.confirm('この見積を送信せずに削除しますか？')) return;
+          remove(record.key).then(refresh);
+        });
+        td.appendChild(button);
+        tr.appendChild(td);
+        tbody.appendChild(tr);
+      }
+      table.appendChild(tbody);
+      container.appendChild(table);
+    });
+  }
+
+  function refresh() {
+    return Promise.all([updateStatus(), renderList()]);
+  }
+
+  function flushAndRefresh() {
+    if (!root.indexedDB) return;
+    flush().then(summary => {
+      const message = root.document.getElementById('outbox-message');
+      if (message && summary.sent > 0) {
+        // 送信時の補正（値引上限など）は保存済みの見積に反映されているため、ここで知らせる
+        message.textContent = [`${summary.sent} 件の見積を送信しました。`].concat(summary.warnings).join('\n');
+      }
+    }).catch(err => console.error(err)).finally(refresh);
+  }
+
+  if ('serviceWorker' in root.navigator) {
+    root.navigator.serviceWorker.register('/sw.js').catch(err => console.error(err));
+    // サービスワーカーが登録を保存したときは件数表示を更新する
+    root.navigator.serviceWorker.addEventListener('message', event => {
+      if (event.data && event.data.type === 'outbox-updated') refresh();
+    });
+  }
+  root.addEventListener('online', flushAndRefresh);
+  root.addEventListener('DOMContentLoaded', () => {
+    const button = root.document.getElementById('outbox-flush');
+    if (button) button.addEventListener('click', flushAndRefresh);
+    const message = root.document.getElementById('outbox-message');
+    if (message && new URLSearchParams(root.location.search).has('queued')) {
+      message.textContent = '通信できないため、見積をこの端末に保存しました。通信が戻ると自動で送信します。';
+    }
+    if (root.navigator.onLine) flushAndRefresh(); else refresh();
+  });
+})(self);
@@ -0,0 +1,121 @@
+// 見積アプリのサービスワーカー（app.py の service_worker が描画する）。
+//   - 入力画面: 通信できれば常にサーバーから、できなければキャッシュした画面を返す
+//   - 内容ハッシュ付きの静的ファイル・版付きマスタ: URL が変わらない限り内容も変わらないためキャッシュ優先
+//   - 見積の登録: 通信できなければ入力内容を IndexedDB（outbox.js）に溜め、未送信一覧の画面へ移る
+importScripts({{ outbox_script | tojson }});
+
+const CACHE_NAME = {{ cache_name | tojson }};
+const PRECACHE_URLS = {{ precache | tojson }};
+const SHELL_URL = {{ shell_url | tojson }};
+const OUTBOX_URL = {{ outbox_url | tojson }};
+const CREATE_URL = {{ create_url | tojson }};
+
+self.addEventListener('install', event => {
+  // 未ログインの状態の画面をキャッシュする（フラッシュメッセージや管理モードの表示を残さない）
+  event.waitUntil(
+    caches.open(CACHE_NAME)
+      .then(cache => cache.addAll(PRECACHE_URLS.map(url => new Request(url, { credentials: 'omit' }))))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys()
+      .then(names => Promise.all(
+        names.filter(name => name.startsWith('estimate-offline-') && name !== CACHE_NAME)
+          .map(name => caches.delete(name))
+      ))
+      .then(() => self.clients.claim())
+  );
+});
+
+function isImmutable(url) {
+  return url.pathname.startsWith('/assets/') ||
+    (url.pathname.startsWith('/api/masters/') && url.searchParams.has('v'));
+}
+
+async function cacheFirst(request) {
+  const cache = await caches.open(CACHE_NAME);
+  const cached = await cache.match(request);
+  if (cached) return cached;
+  const response = await fetch(request);
+  if (response.ok) cache.put(request, response.clone());
+  return response;
+}
+
+async function networkFirst(request) {
+  try {
+    return await fetch(request);
+  } catch (err) {
+    const cached = await caches.match(request);
+    if (cached) return cached;
+    throw err;
+  }
+}
+
+async function page(request, url) {
+  try {
+    return await fetch(request);
+  } catch (err) {
+    const cache = await caches.open(CACHE_NAME);
+    if (url.pathname === SHELL_URL) {
+      // 種別（?type=）の違う画面も同じ入力画面で表示する（種別は画面側で URL から読む）
+      const shell = await cache.match(SHELL_URL);
+      if (shell) return shell;
+    }
+    const cached = await cache.match(request);
+    if (cached) return cached;
+    const outbox = await cache.match(OUTBOX_URL);
+    if (outbox) return outbox;
+    throw err;
+  }
+}
+
+async function notifyClients() {
+  const clients = await self.clients.matchAll({ type: 'window' });
+  clients.forEach(client => client.postMessage({ type: 'outbox-updated' }));
+}
+
+async function submitOrQueue(request) {
+  const copy = request.clone();
+  try {
+    return await fetch(request);
+  } catch (err) {
+    const form = await copy.formData();
+    const entries = [];
+    for (const [name, value] of form.entries()) {
+      if (typeof value === 'string') entries.push([name, value]);
+    }
+    await self.EstimateOutbox.enqueue(entries);
+    await self.EstimateOutbox.requestSync();
+    await notifyClients();
+    return Response.redirect(`${OUTBOX_URL}?queued=1`, 303);
+  }
+}
+
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) return;
+  if (request.method === 'POST' && request.mode === 'navigate' && url.pathname === CREATE_URL) {
+    event.respondWith(submitOrQueue(request));
+    return;
+  }
+  if (request.method !== 'GET') return;
+  if (request.mode === 'navigate') {
+    event.respondWith(page(request, url));
+  } else if (isImmutable(url)) {
+    event.respondWith(cacheFirst(request));
+  } else if (url.pathname.startsWith('/static/')) {
+    event.respondWith(networkFirst(request));
+  }
+});
+
+// Background Sync 対応ブラウザでは、通信が戻ると画面を開いていなくても送信する
+// （iPad の Safari は未対応のため、画面を開いたとき・通信が戻ったときに outbox.js が送信する）
+self.addEventListener('sync', event => {
+  if (event.tag === self.EstimateOutbox.SYNC_TAG) {
+    event.waitUntil(self.EstimateOutbox.flush().then(notifyClients));
+  }
+});